@@ -0,0 +1,115 @@
+"""
+Размер и скорость кодирования записей кеша: JsonCoder против BinaryCoder.
+
+    python -m benchmarks.cache_codec [--iterations 100000] [--redis redis://localhost:6379/15]
+
+Печатает байты на запись (ключ + значение) и время encode/decode на одну запись.
+С --redis дополнительно пишет по --keys записей в каждой раскладке и сравнивает
+used_memory Redis — учитываются и накладные расходы на ключ. База очищается (FLUSHDB).
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import timeit
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from fastapi_cache.coder import JsonCoder
+
+from warehouse_service.cache_coders import BinaryCoder
+from warehouse_service.cache_storage import BucketStorage, FlatStorage
+from warehouse_service.schemas import MovementResponse, StockResponse
+
+
+def _stock() -> StockResponse:
+    return StockResponse(warehouse_id=uuid4(), product_id=uuid4(), quantity=1234)
+
+
+def _movement() -> MovementResponse:
+    departed = datetime.now(timezone.utc)
+    arrived = departed + timedelta(hours=5)
+    return MovementResponse(
+        movement_id=uuid4(), sender_warehouse=uuid4(), receiver_warehouse=uuid4(),
+        departure_time=departed, arrival_time=arrived, quantity_departed=100, quantity_arrived=98,
+        quantity_difference=-2, transit_seconds=5 * 3600,
+    )
+
+
+def _text_key(stock: StockResponse) -> str:
+    return f":warehouses:{stock.warehouse_id}:products:{stock.product_id}"
+
+
+def _hashed_key(text_key: str) -> str:
+    # то же, что warehouse_service.cache.cache_key при CACHE_HASH_KEYS=1
+    return "k:" + base64.b64encode(hashlib.blake2b(text_key.encode(), digest_size=12).digest()).decode()
+
+
+def codec_report(iterations: int) -> list[dict]:
+    rows = []
+    for name, sample in (("stock", _stock()), ("movement", _movement())):
+        for coder in (JsonCoder, BinaryCoder):
+            encoded = coder.encode(sample)
+            encode_us = timeit.timeit(lambda: coder.encode(sample), number=iterations) / iterations * 1e6
+            decode_us = timeit.timeit(lambda: coder.decode(encoded), number=iterations) / iterations * 1e6
+            rows.append({
+                "value": name, "coder": coder.__name__, "bytes": len(encoded),
+                "encode_us": encode_us, "decode_us": decode_us,
+            })
+    return rows
+
+
+async def redis_report(url: str, keys: int, buckets: int) -> list[dict]:
+    import redis.asyncio as redis
+
+    client = redis.Redis.from_url(url)
+    stocks = [_stock() for _ in range(keys)]
+    layouts = (
+        ("json, text keys", JsonCoder, False, FlatStorage()),
+        ("binary, hashed keys", BinaryCoder, True, FlatStorage()),
+        (f"binary, hashed keys, {buckets} buckets", BinaryCoder, True, BucketStorage(buckets)),
+    )
+    rows = []
+    try:
+        for name, coder, hashed, storage in layouts:
+            await client.flushdb()
+            baseline = (await client.info("memory"))["used_memory"]
+            async with client.pipeline(transaction=False) as pipe:
+                for stock in stocks:
+                    key = _hashed_key(_text_key(stock)) if hashed else _text_key(stock)
+                    storage.set(pipe, key, coder.encode(stock), 3600)
+                await pipe.execute()
+            used = (await client.info("memory"))["used_memory"] - baseline
+            rows.append({"layout": name, "bytes_per_key": used / keys})
+        await client.flushdb()
+    finally:
+        await client.aclose()
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--redis", help="URL отдельной Redis-базы для замера памяти (будет очищена)")
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--buckets", type=int, default=1024)
+    args = parser.parse_args(argv)
+
+    sample = _stock()
+    print(f"key, text:   {len(_text_key(sample))} bytes")
+    print(f"key, hashed: {len(_hashed_key(_text_key(sample)))} bytes\n")
+
+    print(f"{'value':<9} {'coder':<12} {'bytes':>6} {'encode, us':>11} {'decode, us':>11}")
+    for row in codec_report(args.iterations):
+        print(f"{row['value']:<9} {row['coder']:<12} {row['bytes']:>6} "
+              f"{row['encode_us']:>11.2f} {row['decode_us']:>11.2f}")
+
+    if args.redis:
+        print(f"\nRedis used_memory, {args.keys} stock entries:")
+        for row in asyncio.run(redis_report(args.redis, args.keys, args.buckets)):
+            print(f"  {row['layout']:<40} {row['bytes_per_key']:>8.1f} bytes/key")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,109 @@
+"""
+Генератор реалистичного потока событий для нагрузочных прогонов.
+
+Каждое перемещение — пара departure (со склада-отправителя) и arrival (на склад-получатель)
+одного товара. Товар выбирается по закону Ципфа: при skew > 0 небольшая доля SKU получает
+большую часть событий, как в реальном каталоге. Часть пар приходит в обратном порядке
+(arrival раньше departure), а события разных пар перемешиваются в пределах окна window,
+не меняя порядка внутри пары.
+"""
+import bisect
+import heapq
+import itertools
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+from uuid import UUID
+
+
+@dataclass
+class StreamConfig:
+    warehouses: int = 20
+    products: int = 10_000
+    skew: float = 1.1                 # показатель Ципфа, 0 — равномерно
+    out_of_order: float = 0.05        # доля пар, где arrival приходит раньше departure
+    window: int = 64                  # на сколько событий могут разъехаться события разных пар
+    seed: int = 42
+    start: datetime = field(default_factory=lambda: datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+
+class EventStream:
+    def __init__(self, config: StreamConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.warehouses = [self._uuid() for _ in range(config.warehouses)]
+        self._codes = {wh: f"WH-{index:04d}" for index, wh in enumerate(self.warehouses)}
+        self.products = [self._uuid() for _ in range(config.products)]
+        weights = [1 / (rank ** config.skew) for rank in range(1, config.products + 1)]
+        self._cumulative = list(itertools.accumulate(weights))
+        self.movement_ids: list[UUID] = []
+
+    def _uuid(self) -> UUID:
+        return UUID(int=self.random.getrandbits(128), version=4)
+
+    def product(self) -> UUID:
+        """Товар с учётом перекоса популярности (тот же закон, что и для событий)."""
+        point = self.random.random() * self._cumulative[-1]
+        return self.products[bisect.bisect_left(self._cumulative, point)]
+
+    def warehouse(self) -> UUID:
+        return self.random.choice(self.warehouses)
+
+    def _envelope(self, movement_id, warehouse_id, product_id, event, quantity, moment) -> dict:
+        return {
+            "id": str(self._uuid()),
+            "source": self._codes[warehouse_id],
+            "specversion": "1.0",
+            "type": f"ru.retail.warehouses.{event}",
+            "datacontenttype": "application/json",
+            "dataschema": f"ru.retail.warehouses.{event}.v1",
+            "time": int(moment.timestamp() * 1000),
+            "subject": f"{self._codes[warehouse_id]}:{event.upper()}",
+            "destination": "ru.retail.warehouses",
+            "data": {
+                "movement_id": str(movement_id),
+                "warehouse_id": str(warehouse_id),
+                "timestamp": moment.isoformat(),
+                "event": event,
+                "product_id": str(product_id),
+                "quantity": quantity,
+            },
+        }
+
+    def _pairs(self) -> Iterator[list[dict]]:
+        moment = self.config.start
+        while True:
+            moment += timedelta(seconds=self.random.expovariate(1.0))
+            movement_id = self._uuid()
+            self.movement_ids.append(movement_id)
+            sender, receiver = self.random.sample(self.warehouses, 2)
+            product = self.product()
+            departed = self.random.randint(1, 200)
+            # иногда доезжает не всё
+            arrived = departed - (self.random.randint(1, 3) if self.random.random() < 0.1 else 0)
+            arrival_time = moment + timedelta(hours=self.random.uniform(1, 48))
+            pair = [
+                self._envelope(movement_id, sender, product, "departure", departed, moment),
+                self._envelope(movement_id, receiver, product, "arrival", arrived, arrival_time),
+            ]
+            if self.random.random() < self.config.out_of_order:
+                pair.reverse()
+            yield pair
+
+    def events(self, count: int) -> Iterator[dict]:
+        """count событий в порядке доставки."""
+        heap: list[tuple[float, int, dict]] = []
+        seq = itertools.count()
+        pairs = self._pairs()
+        window = self.config.window
+        index = 0
+        for _ in range(count):
+            # у пары с номером index и всех следующих ключ доставки не меньше 2 * index
+            while not heap or heap[0][0] >= 2 * index:
+                first, second = next(pairs)
+                key = 2 * index + self.random.uniform(0, window)
+                heapq.heappush(heap, (key, next(seq), first))
+                heapq.heappush(heap, (key + self.random.uniform(0, window), next(seq), second))
+                index += 1
+            yield heapq.heappop(heap)[2]
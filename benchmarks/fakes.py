@@ -0,0 +1,216 @@
+"""
+In-memory замены Redis и сессии БД для прогонов без контейнеров.
+
+Они измеряют накладные расходы самого сервиса (валидация, кодирование, логика кеша),
+а не Postgres и Redis. FakeSession не выполняет SQL: она считает запросы и ведёт остатки
+по добавленным событиям, чтобы RETURNING upsert'а отдавал правдоподобное значение.
+"""
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Optional
+
+
+class _FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self):
+        calls, self.calls = self.calls, []
+        return [await method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+class FakeRedis:
+    """Подмножество команд redis.asyncio.Redis, которое использует кеш сервиса."""
+
+    def __init__(self):
+        self.data: dict[str, bytes] = {}
+        self.hashes: dict[str, dict[str, bytes]] = defaultdict(dict)
+        self.deadlines: dict[str, float] = {}
+        self.commands = 0
+        self.published = 0
+
+    def _alive(self, key: str) -> bool:
+        deadline = self.deadlines.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.hashes.pop(key, None)
+            del self.deadlines[key]
+        return key in self.data or key in self.hashes
+
+    def pipeline(self, transaction: bool = True) -> _FakePipeline:
+        return _FakePipeline(self)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        self.commands += 1
+        return self.data.get(key) if self._alive(key) else None
+
+    async def mget(self, keys) -> list[Optional[bytes]]:
+        self.commands += 1
+        return [self.data.get(key) if self._alive(key) else None for key in keys]
+
+    async def set(self, key: str, value, ex: Optional[int] = None, px: Optional[int] = None,
+                  nx: bool = False) -> Optional[bool]:
+        self.commands += 1
+        if nx and self._alive(key):
+            return None
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        self.deadlines.pop(key, None)
+        if ex is not None:
+            self.deadlines[key] = time.monotonic() + ex
+        elif px is not None:
+            self.deadlines[key] = time.monotonic() + px / 1000
+        return True
+
+    async def ttl(self, key: str) -> int:
+        self.commands += 1
+        if not self._alive(key):
+            return -2
+        deadline = self.deadlines.get(key)
+        return -1 if deadline is None else int(deadline - time.monotonic())
+
+    async def delete(self, *keys) -> int:
+        self.commands += 1
+        removed = 0
+        for key in keys:
+            removed += self._alive(key)
+            self.data.pop(key, None)
+            self.hashes.pop(key, None)
+            self.deadlines.pop(key, None)
+        return removed
+
+    async def hget(self, name: str, key: str) -> Optional[bytes]:
+        self.commands += 1
+        return self.hashes[name].get(key) if self._alive(name) else None
+
+    async def hset(self, name: str, key: str, value: bytes) -> int:
+        self.commands += 1
+        self._alive(name)
+        self.hashes[name][key] = value
+        return 1
+
+    async def hdel(self, name: str, *keys) -> int:
+        self.commands += 1
+        return sum(self.hashes[name].pop(key, None) is not None for key in keys)
+
+    async def expire(self, name: str, seconds: int) -> bool:
+        self.commands += 1
+        self.deadlines[name] = time.monotonic() + seconds
+        return True
+
+    async def publish(self, channel: str, message) -> int:
+        self.commands += 1
+        self.published += 1
+        return 0
+
+    async def eval(self, script: str, numkeys: int, *args) -> int:
+        # единственный скрипт сервиса — снятие блокировки по токену (cache_layer._RELEASE_LOCK)
+        self.commands += 1
+        key, token = args[0], args[1]
+        if self._alive(key) and self.data.get(key) == str(token).encode():
+            return await self.delete(key)
+        return 0
+
+
+class _FakeResult:
+    def __init__(self, row=None):
+        self.row = row
+
+    def one(self):
+        return self.row
+
+    def first(self):
+        return self.row
+
+    def all(self):
+        return [] if self.row is None else [self.row]
+
+    def scalars(self):
+        return self
+
+    def __iter__(self):
+        return iter(self.all())
+
+
+class FakeSession:
+    """
+    Сессия для handle_event и читающих эндпоинтов: каждый execute/scalar/scalars — один запрос.
+
+    Остатки общие для всех сессий одной фабрики (balances), upsert отдаёт остаток
+    по последнему событию, переданному в add().
+    """
+
+    def __init__(self, balances: dict):
+        self.balances = balances
+        self.queries = 0
+        self._pending = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+    def add(self, row) -> None:
+        self._pending = row
+
+    async def execute(self, stmt, *args, **kwargs) -> _FakeResult:
+        self.queries += 1
+        if self._pending is None or not getattr(stmt, "_returning", None):
+            return _FakeResult()
+        row, self._pending = self._pending, None
+        key = (row.warehouse_id, row.product_id)
+        self.balances[key] = self.balances.get(key, 0) + (
+            row.quantity if row.event == "arrival" else -row.quantity
+        )
+        return _FakeResult(SimpleNamespace(warehouse_id=key[0], product_id=key[1], quantity=self.balances[key]))
+
+    async def scalar(self, stmt, *args, **kwargs):
+        self.queries += 1
+        return 0
+
+    async def scalars(self, stmt, *args, **kwargs) -> _FakeResult:
+        self.queries += 1
+        return _FakeResult()
+
+    async def commit(self) -> None:
+        self.queries += 1
+
+    async def rollback(self) -> None:
+        self.queries += 1
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeSessionFactory:
+    """Замена async_sessionmaker: общие остатки и суммарный счётчик запросов."""
+
+    def __init__(self):
+        self.balances: dict = {}
+        self.sessions: list[FakeSession] = []
+
+    def __call__(self) -> FakeSession:
+        session = FakeSession(self.balances)
+        self.sessions.append(session)
+        return session
+
+    @property
+    def queries(self) -> int:
+        return sum(session.queries for session in self.sessions)
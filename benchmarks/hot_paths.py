@@ -0,0 +1,147 @@
+"""
+Микробенчмарки CPU-стоимости одного события на горячих путях.
+
+    python -m benchmarks.hot_paths                      # прогон и сравнение с baseline
+    python -m benchmarks.hot_paths --save               # перезаписать baseline
+    python -m benchmarks.hot_paths --only envelope      # часть кейсов (по подстроке имени)
+
+Каждый кейс гоняется --rounds раундов по --number вызовов; время на вызов — медиана раундов.
+Baseline хранится в benchmarks/baselines/hot_paths.json в формате pytest-benchmark.
+Сравнение падает с кодом 1, если медиана кейса выросла больше чем на --threshold;
+сравнивать имеет смысл только с baseline, снятым на той же машине.
+"""
+import argparse
+import json
+import os
+import timeit
+from types import SimpleNamespace
+from typing import Callable
+
+from benchmarks.events import EventStream, StreamConfig
+from benchmarks.metrics import Run, write_report
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "hot_paths.json")
+
+
+def _run_sync(coroutine):
+    """Выполняет корутину, которая не уходит в ожидание, без event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+
+class _MovementDb:
+    """Сессия, отдающая заранее построенную строку movements."""
+
+    def __init__(self, row):
+        self.row = row
+
+    async def execute(self, stmt, params=None):
+        return self
+
+    def first(self):
+        return self.row
+
+
+def cases() -> dict[str, Callable[[], object]]:
+    from starlette.requests import Request
+
+    from kafka_utils.consumer import deserialize_value
+    from kafka_utils.db import _event_values
+    import orjson
+    from warehouse_service.main import request_key_builder
+    from warehouse_service.models import MovementEvent
+    from warehouse_service.schemas import KafkaEnvelope, KafkaEventRecord
+    from warehouse_service.services.movements import get_movement_info, movement_rows
+
+    stream = EventStream(StreamConfig(out_of_order=0, window=1))
+    departure_raw, arrival_raw = list(stream.events(2))
+    raw = json.dumps(departure_raw).encode()
+    envelope = KafkaEnvelope.model_validate(departure_raw)
+    movement_db = _MovementDb(SimpleNamespace(**movement_rows([
+        _event_values(KafkaEnvelope.model_validate(item)) for item in (departure_raw, arrival_raw)
+    ])[0]))
+    movement_id = envelope.data.movement_id
+    data = envelope.data
+    request = Request({
+        "type": "http", "method": "GET", "query_string": b"", "headers": [],
+        "path": f"/warehouses/{data.warehouse_id}/products/{data.product_id}",
+    })
+
+    return {
+        "consumer_deserialize": lambda: deserialize_value(raw),
+        "envelope_validate": lambda: KafkaEnvelope(**departure_raw),
+        "movement_event_orm": lambda: MovementEvent(**_event_values(envelope)),
+        "movement_response": lambda: _run_sync(get_movement_info(movement_db, movement_id)),
+        "request_key_builder": lambda: request_key_builder(request=request),
+        # весь разбор одного сообщения до строки для вставки: обычный путь и KAFKA_FAST_DECODE=1
+        "message_to_row": lambda: _event_values(KafkaEnvelope(**json.loads(raw.decode("utf-8")))),
+        "message_to_row_fast": lambda: _event_values(KafkaEventRecord.model_validate(orjson.loads(raw))),
+    }
+
+
+def measure(name: str, func: Callable[[], object], number: int, rounds: int) -> Run:
+    func()
+    timer = timeit.Timer(func)
+    totals = timer.repeat(repeat=rounds, number=number)
+    return Run(name, latencies=[total / number for total in totals], elapsed=sum(totals) / number,
+               extra={"number": number})
+
+
+def compare(runs: list[Run], baseline: dict, threshold: float) -> list[str]:
+    previous = {item["name"]: item["stats"]["median"] for item in baseline["benchmarks"]}
+    regressions = []
+    print(f"{'case':<28} {'baseline, us':>13} {'now, us':>9} {'change':>8}")
+    for run in runs:
+        now = run.stats()["median"]
+        before = previous.get(run.name)
+        if before is None:
+            print(f"{run.name:<28} {'—':>13} {now * 1e6:>9.2f} {'new':>8}")
+            continue
+        change = now / before - 1
+        mark = ""
+        if change > threshold:
+            regressions.append(run.name)
+            mark = "  REGRESSION"
+        print(f"{run.name:<28} {before * 1e6:>13.2f} {now * 1e6:>9.2f} {change:>+8.1%}{mark}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000, help="вызовов в раунде")
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--only", help="только кейсы, в имени которых есть подстрока")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="записать результат как baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост медианы, доля")
+    args = parser.parse_args(argv)
+
+    runs = [
+        measure(name, func, args.number, args.rounds)
+        for name, func in cases().items()
+        if not args.only or args.only in name
+    ]
+
+    if args.save:
+        write_report(runs, args.baseline)
+        for run in runs:
+            print(f"{run.name:<28} {run.stats()['median'] * 1e6:>9.2f} us")
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}, run with --save first")
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    regressions = compare(runs, baseline, args.threshold)
+    if regressions:
+        print(f"\nregressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
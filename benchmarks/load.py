@@ -0,0 +1,281 @@
+"""
+Нагрузочный прогон записи и чтения.
+
+    python -m benchmarks.load ingest --target fake|db|kafka|http [--events 10000] [--concurrency 16]
+    python -m benchmarks.load read (--fake | --base-url http://localhost:8000) [--requests 10000]
+
+ingest проигрывает поток benchmarks.events:
+  http  — POST /debug/publish_kafka запущенного сервиса (--base-url), с --batch N — /debug/publish_kafka/bulk;
+  kafka — KafkaProducerWrapper.send_many в KAFKA_TOPIC по --batch событий;
+  db    — handle_event напрямую с сессией consumer'а и Redis из окружения;
+  fake  — handle_event с in-memory Redis и сессией (benchmarks.fakes), без контейнеров.
+
+read гоняет GET остатков (товары с тем же перекосом, что и при записи) и перемещений.
+С тем же --seed и параметрами потока, что у ingest, запрашиваются существующие
+склады, товары и movement_id. --fake поднимает приложение в процессе поверх in-memory
+Redis и сессии; перемещений там нет, поэтому читаются только остатки.
+
+Печатает p50/p99, операций в секунду и число SQL-запросов; --json пишет отчёт
+в формате pytest-benchmark. Запросы считаются для fake и db, а при --pg-dsn — по
+pg_stat_statements сервера (нужно расширение pg_stat_statements).
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Iterable, Iterator, Optional
+
+from benchmarks.events import EventStream, StreamConfig
+from benchmarks.metrics import QueryCounter, Run, format_table, write_report
+
+
+async def drive(run: Run, items: Iterable, operation: Callable[..., Awaitable], concurrency: int) -> Run:
+    """Выполняет operation(item) для всех items в concurrency параллельных воркерах."""
+    iterator = iter(items)
+
+    async def worker():
+        for item in iterator:
+            try:
+                with run.timed():
+                    await operation(item)
+            except Exception:
+                if run.errors == 1:
+                    logging.warning("First failed operation:", exc_info=True)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    run.elapsed = time.perf_counter() - started
+    return run
+
+
+async def pg_statements(dsn: Optional[str]) -> Optional[int]:
+    if not dsn:
+        return None
+    import asyncpg
+
+    connection = await asyncpg.connect(dsn.replace("postgresql+asyncpg://", "postgresql://"))
+    try:
+        return await connection.fetchval("SELECT coalesce(sum(calls), 0) FROM pg_stat_statements")
+    finally:
+        await connection.close()
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _quiet(level: str) -> None:
+    # логгеры сервиса заведены setup_logger с уровнем DEBUG; на каждое событие они шумят
+    for name, logger in logging.root.manager.loggerDict.items():
+        if name.startswith(("warehouse_service", "kafka_utils")) and isinstance(logger, logging.Logger):
+            logger.setLevel(level)
+
+
+def _stream(args) -> EventStream:
+    return EventStream(StreamConfig(
+        warehouses=args.warehouses, products=args.products, skew=args.skew,
+        out_of_order=args.out_of_order, window=args.window, seed=args.seed,
+    ))
+
+
+async def ingest(args) -> Run:
+    from warehouse_service.schemas import KafkaEnvelope
+
+    stream = _stream(args)
+    events = stream.events(args.events)
+    run = Run(f"ingest[{args.target}]", extra={
+        "events": args.events, "concurrency": args.concurrency, "batch": args.batch,
+        "products": args.products, "skew": args.skew, "out_of_order": args.out_of_order,
+    })
+    # http и kafka: по --batch событий за вызов, задержки и ops — на пачку
+    batches = chunked(events, args.batch)
+
+    if args.target == "http":
+        import httpx
+
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+            async def publish(batch):
+                if len(batch) == 1:
+                    response = await client.post("/debug/publish_kafka", json=batch[0])
+                else:
+                    response = await client.post("/debug/publish_kafka/bulk", json={"events": batch})
+                response.raise_for_status()
+
+            before = await pg_statements(args.pg_dsn)
+            await drive(run, batches, publish, args.concurrency)
+        if before is not None:
+            run.queries = await pg_statements(args.pg_dsn) - before
+        return run
+
+    if args.target == "kafka":
+        from kafka_utils.producer import KafkaProducerWrapper
+        from warehouse_service.config import KAFKA_TOPIC, KAFKA_URL
+
+        producer = KafkaProducerWrapper(KAFKA_URL)
+        await producer.connect()
+        try:
+            # валидация та же, что в /debug/publish_kafka
+            await drive(run, batches, lambda batch: producer.send_many(
+                KAFKA_TOPIC, [KafkaEnvelope.model_validate(event).model_dump() for event in batch]
+            ), args.concurrency)
+        finally:
+            await producer.disconnect()
+        return run
+
+    from kafka_utils.db import handle_event
+    from warehouse_service.cache import make_backend
+
+    if args.target == "fake":
+        from benchmarks.fakes import FakeRedis, FakeSessionFactory
+
+        session_factory = FakeSessionFactory()
+        backend = make_backend(FakeRedis())
+    else:
+        import redis.asyncio as redis
+
+        from kafka_utils.db import SessionLocal as session_factory, engine
+        from warehouse_service.config import REDIS_DB, REDIS_HOST, REDIS_PORT
+
+        backend = make_backend(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB))
+
+    async def handle(event):
+        async with session_factory() as session:
+            await handle_event(KafkaEnvelope.model_validate(event), session, backend)
+
+    _quiet(args.log_level)
+    if args.target == "fake":
+        await drive(run, events, handle, args.concurrency)
+        run.queries = session_factory.queries
+    else:
+        try:
+            with QueryCounter(engine) as counter:
+                await drive(run, events, handle, args.concurrency)
+            run.queries = counter.count
+        finally:
+            await backend.redis.aclose()
+    return run
+
+
+def _fake_app():
+    """Приложение сервиса поверх in-memory Redis и сессии; lifespan не запускается."""
+    from fastapi_cache import FastAPICache
+
+    from benchmarks.fakes import FakeRedis, FakeSessionFactory
+    from warehouse_service.cache import CODER, make_backend
+    from warehouse_service.db import get_db
+    from warehouse_service.main import app, request_key_builder
+
+    session_factory = FakeSessionFactory()
+
+    async def fake_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = fake_db
+    FastAPICache.init(make_backend(FakeRedis()), prefix="fastapi-cache", coder=CODER,
+                      key_builder=request_key_builder)
+    return app, session_factory
+
+
+async def read(args) -> Run:
+    import httpx
+
+    stream = _stream(args)
+    # movement_id известны только после генерации того же потока, что писал ingest
+    for _ in stream.events(args.events):
+        pass
+    picker = random.Random(args.seed + 1)
+    movement_ratio = 0.0 if args.fake else args.movement_ratio
+
+    def paths():
+        for _ in range(args.requests):
+            if picker.random() < movement_ratio:
+                yield f"/movements/{picker.choice(stream.movement_ids)}"
+            else:
+                yield f"/warehouses/{stream.warehouse()}/products/{stream.product()}"
+
+    run = Run(f"read[{'fake' if args.fake else 'http'}]", extra={
+        "requests": args.requests, "concurrency": args.concurrency, "movement_ratio": movement_ratio,
+        "products": args.products, "skew": args.skew,
+    })
+
+    session_factory = None
+    if args.fake:
+        app, session_factory = _fake_app()
+        _quiet(args.log_level)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    else:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+
+    async def get(path):
+        response = await client.get(path)
+        if response.status_code not in (200, 404):
+            response.raise_for_status()
+
+    async with client:
+        before = await pg_statements(args.pg_dsn)
+        await drive(run, paths(), get, args.concurrency)
+        if session_factory is not None:
+            run.queries = session_factory.queries
+        elif before is not None:
+            run.queries = await pg_statements(args.pg_dsn) - before
+    return run
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="запись событий")
+    ingest_parser.add_argument("--target", choices=("fake", "db", "kafka", "http"), default="fake")
+    read_parser = commands.add_parser("read", help="чтение через API")
+    source = read_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--fake", action="store_true", help="приложение в процессе на in-memory фейках")
+    source.add_argument("--base-url", dest="read_base_url", help="адрес запущенного сервиса")
+    read_parser.add_argument("--requests", type=int, default=10_000)
+    read_parser.add_argument("--movement-ratio", type=float, default=0.2,
+                             help="доля запросов GET /movements/{id}")
+
+    for sub in (ingest_parser, read_parser):
+        sub.add_argument("--events", type=int, default=10_000,
+                         help="событий в потоке (для read — чтобы восстановить movement_id)")
+        sub.add_argument("--concurrency", type=int, default=16)
+        sub.add_argument("--warehouses", type=int, default=20)
+        sub.add_argument("--products", type=int, default=10_000)
+        sub.add_argument("--skew", type=float, default=1.1)
+        sub.add_argument("--out-of-order", type=float, default=0.05)
+        sub.add_argument("--window", type=int, default=64)
+        sub.add_argument("--seed", type=int, default=42)
+        sub.add_argument("--pg-dsn", help="Postgres для подсчёта запросов по pg_stat_statements")
+        sub.add_argument("--json", help="куда записать отчёт в формате pytest-benchmark")
+        sub.add_argument("--log-level", default="WARNING", help="уровень логгеров сервиса на время прогона")
+    ingest_parser.add_argument("--base-url", default="http://localhost:8000")
+    ingest_parser.add_argument("--batch", type=int, default=1,
+                               help="http и kafka: событий за вызов (/debug/publish_kafka/bulk, send_many)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "ingest":
+        run = asyncio.run(ingest(args))
+    else:
+        args.base_url = args.read_base_url
+        run = asyncio.run(read(args))
+
+    print(format_table([run]))
+    if args.json:
+        write_report([run], args.json)
+    return 1 if run.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
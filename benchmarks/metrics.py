@@ -0,0 +1,117 @@
+"""
+Замеры для нагрузочных прогонов и отчёт в формате pytest-benchmark.
+
+JSON-отчёт повторяет структуру `pytest --benchmark-json` (machine_info + benchmarks[].stats),
+поэтому его понимают те же инструменты сравнения; сверх неё в stats есть p50/p99,
+ops (событий или запросов в секунду) и queries (число SQL-запросов).
+"""
+import json
+import platform
+import statistics
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+@dataclass
+class Run:
+    """Результат одного прогона: латентности операций в секундах и общее время."""
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+    queries: Optional[int] = None
+    extra: dict = field(default_factory=dict)
+
+    @contextmanager
+    def timed(self):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        values = sorted(self.latencies)
+        operations = len(values)
+        return {
+            "min": values[0] if values else 0.0,
+            "max": values[-1] if values else 0.0,
+            "mean": statistics.fmean(values) if values else 0.0,
+            "median": percentile(values, 0.5),
+            "stddev": statistics.stdev(values) if operations > 1 else 0.0,
+            "p50": percentile(values, 0.5),
+            "p99": percentile(values, 0.99),
+            "rounds": operations,
+            "errors": self.errors,
+            "total": self.elapsed,
+            "ops": operations / self.elapsed if self.elapsed else 0.0,
+            "queries": self.queries,
+            "queries_per_op": self.queries / operations if self.queries is not None and operations else None,
+        }
+
+
+class QueryCounter:
+    """Считает SQL-запросы, прошедшие через движок SQLAlchemy."""
+
+    def __init__(self, engine):
+        self.engine = engine.sync_engine if hasattr(engine, "sync_engine") else engine
+        self.count = 0
+
+    def _on_execute(self, *_):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *_):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def format_table(runs: list[Run]) -> str:
+    header = f"{'name':<32} {'ops/s':>10} {'p50, ms':>9} {'p99, ms':>9} {'errors':>7} {'queries/op':>11}"
+    lines = [header, "-" * len(header)]
+    for run in runs:
+        stats = run.stats()
+        per_op = "n/a" if stats["queries_per_op"] is None else f"{stats['queries_per_op']:.2f}"
+        lines.append(
+            f"{run.name:<32} {stats['ops']:>10.1f} {stats['p50'] * 1000:>9.2f} "
+            f"{stats['p99'] * 1000:>9.2f} {stats['errors']:>7} {per_op:>11}"
+        )
+    return "\n".join(lines)
+
+
+def report(runs: list[Run]) -> dict:
+    return {
+        "machine_info": {
+            "node": platform.node(),
+            "python_version": platform.python_version(),
+            "python_implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+        },
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "benchmarks": [
+            {"name": run.name, "fullname": f"benchmarks::{run.name}", "params": run.extra, "stats": run.stats()}
+            for run in runs
+        ],
+    }
+
+
+def write_report(runs: list[Run], path: str) -> None:
+    with open(path, "w") as out:
+        json.dump(report(runs), out, indent=2)
@@ -0,0 +1,95 @@
+"""
+Латентность запросов к Postgres в зависимости от размера пула соединений.
+
+    python -m benchmarks.pools --sizes 2 5 10 20 [--overflow 0] [--concurrency 32] [--requests 5000] [--query-ms 2]
+
+Для каждого размера создаёт engine с теми же настройками пула, что у API и consumer'а
+(warehouse_service.db.engine_options: InstrumentedPool, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+кеши asyncpg), и гоняет --requests сессий в --concurrency параллельных задачах; каждая
+выполняет `SELECT pg_sleep(--query-ms)` — постоянное время на сервере, так что разница
+между прогонами — очередь за соединением. Нужен Postgres (--dsn, по умолчанию DB_URL).
+
+Печатает p50/p99 операции, операций в секунду и среднее ожидание соединения из пула
+(гистограмма warehouse_db_pool_checkout_seconds); --json пишет отчёт в формате pytest-benchmark.
+"""
+import argparse
+import asyncio
+import time
+
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+from benchmarks.load import drive
+from benchmarks.metrics import Run, format_table, write_report
+
+
+def checkout_wait(pool_name: str) -> tuple[float, float]:
+    """(сумма ожиданий в секундах, число выдач) по гистограмме пула."""
+    labels = {"pool": pool_name}
+    total = REGISTRY.get_sample_value("warehouse_db_pool_checkout_seconds_sum", labels) or 0.0
+    count = REGISTRY.get_sample_value("warehouse_db_pool_checkout_seconds_count", labels) or 0.0
+    return total, count
+
+
+async def run_pool(dsn: str, size: int, overflow: int, requests: int, concurrency: int,
+                   query_ms: float) -> Run:
+    from warehouse_service.db import create_engine_and_session, engine_options
+
+    name = f"bench-{size}+{overflow}"
+    engine, session_factory = create_engine_and_session(dsn, **engine_options(name, size, overflow, dsn))
+    query = text("SELECT pg_sleep(:seconds)")
+    run = Run(f"pool[{size}+{overflow}]", extra={
+        "pool_size": size, "max_overflow": overflow, "concurrency": concurrency, "query_ms": query_ms,
+    })
+
+    async def operation(_):
+        async with session_factory() as session:
+            await session.execute(query, {"seconds": query_ms / 1000})
+
+    try:
+        # прогрев: соединения открыты до замера
+        await drive(Run("warmup"), range(size + overflow), operation, size + overflow)
+        before = checkout_wait(name)
+        await drive(run, range(requests), operation, concurrency)
+        after = checkout_wait(name)
+    finally:
+        await engine.dispose()
+
+    checkouts = after[1] - before[1]
+    run.extra["checkout_wait_ms"] = (after[0] - before[0]) / checkouts * 1000 if checkouts else 0.0
+    return run
+
+
+async def run_all(args) -> list[Run]:
+    runs = []
+    for size in args.sizes:
+        started = time.perf_counter()
+        run = await run_pool(args.dsn, size, args.overflow, args.requests, args.concurrency, args.query_ms)
+        runs.append(run)
+        print(f"{run.name}: {time.perf_counter() - started:.1f} с, "
+              f"ожидание соединения {run.extra['checkout_wait_ms']:.2f} мс")
+    return runs
+
+
+def main(argv=None) -> int:
+    from warehouse_service.config import DB_URL
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 5, 10, 20], help="размеры пула для прогонов")
+    parser.add_argument("--overflow", type=int, default=0, help="max_overflow для всех прогонов")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--query-ms", type=float, default=2.0, help="время запроса на сервере (pg_sleep)")
+    parser.add_argument("--dsn", default=DB_URL)
+    parser.add_argument("--json", help="куда записать отчёт в формате pytest-benchmark")
+    args = parser.parse_args(argv)
+
+    runs = asyncio.run(run_all(args))
+    print(format_table(runs))
+    if args.json:
+        write_report(runs, args.json)
+    return 1 if any(run.errors for run in runs) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
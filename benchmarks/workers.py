@@ -0,0 +1,100 @@
+"""
+Пропускная способность API в зависимости от числа процессов gunicorn.
+
+    python -m benchmarks.workers --workers 1 4 [--port 8100] [-- аргументы read из benchmarks.load]
+
+Для каждого числа процессов поднимает gunicorn с warehouse_service.gunicorn_conf и WEB_CONCURRENCY=N,
+ждёт /health и гоняет тот же read, что `python -m benchmarks.load read --base-url`, затем останавливает
+сервер. Нужны Postgres, Redis и Kafka из окружения сервиса и данные, записанные ingest'ом с тем же --seed.
+DB_POOL_BUDGET берётся из окружения и одинаков для всех прогонов.
+
+Печатает таблицу прогонов и прирост операций в секунду относительно первого прогона;
+--json пишет отчёт в формате pytest-benchmark.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from benchmarks.load import build_parser, read
+from benchmarks.metrics import Run, format_table, write_report
+
+SERVER = [sys.executable, "-m", "gunicorn", "-c", "python:warehouse_service.gunicorn_conf", "warehouse_service.main:app"]
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "BIND": f"127.0.0.1:{port}"}
+    return subprocess.Popen(SERVER, env=env)
+
+
+def wait_healthy(server: subprocess.Popen, base_url: str, timeout: float) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn завершился с кодом {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base_url}/health не ответил за {timeout} с")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    # SIGTERM — штатная остановка: мастер дожидается воркеров
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=35)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def speedups(runs: list[Run]) -> list[float]:
+    """Операций в секунду каждого прогона относительно первого."""
+    base = runs[0].stats()["ops"]
+    return [run.stats()["ops"] / base if base else 0.0 for run in runs]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="числа процессов для прогонов")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--json", help="куда записать отчёт в формате pytest-benchmark")
+    args, read_argv = parser.parse_known_args(argv)
+    if read_argv[:1] == ["--"]:
+        read_argv = read_argv[1:]
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    read_args = build_parser().parse_args(["read", "--base-url", base_url, *read_argv])
+    read_args.base_url = read_args.read_base_url
+
+    runs = []
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            wait_healthy(server, base_url, args.startup_timeout)
+            run = asyncio.run(read(read_args))
+        finally:
+            stop_server(server)
+        run.name = f"read[workers={workers}]"
+        run.extra["workers"] = workers
+        runs.append(run)
+
+    print(format_table(runs))
+    for run, speedup in zip(runs, speedups(runs)):
+        print(f"{run.name}: x{speedup:.2f} к {runs[0].name}")
+    if args.json:
+        write_report(runs, args.json)
+    return 1 if any(run.errors for run in runs) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
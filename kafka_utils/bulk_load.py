@@ -0,0 +1,294 @@
+"""
+Массовая загрузка событий через COPY.
+
+    python -m kafka_utils.bulk_load events.jsonl [--chunk-size 10000] [--fast-decode] [--no-cache] [--offset N]
+
+Файл — по конверту Kafka (как в топике) на строку. Каждая порция — одна транзакция:
+COPY во временную таблицу bulk_staging, затем set-based merge — INSERT ... ON CONFLICT DO NOTHING
+в movement_event_keys (повторы message_id и (movement_id, event), в том числе внутри порции,
+пропускаются), INSERT прошедших строк в movement_events, по одному upsert'у в stock_balances
+и movements и пометка устаревших снимков. Кеш обновляется после коммита, как в handle_batch.
+
+Тот же путь использует consumer в режиме KAFKA_CONSUMER_MODE=bulk — для догона топика
+с earliest или после долгого простоя, когда пачки большие.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from kafka_utils.db import BatchResult, _event_values, cache_after_commit, late_pairs
+from warehouse_service.logger import setup_logger
+from warehouse_service.schemas import KafkaEnvelope, KafkaEventRecord
+
+logger = setup_logger(__name__)
+
+STAGING_COLUMNS = ("message_id", "movement_id", "warehouse_id", "product_id", "timestamp", "event", "quantity")
+
+# временные таблицы живут до конца транзакции порции
+_CREATE_STAGING = text(
+    """
+    CREATE TEMP TABLE bulk_staging (
+        seq BIGINT GENERATED ALWAYS AS IDENTITY,
+        message_id UUID NOT NULL,
+        movement_id UUID NOT NULL,
+        warehouse_id UUID NOT NULL,
+        product_id UUID NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+        event VARCHAR NOT NULL,
+        quantity INTEGER NOT NULL
+    ) ON COMMIT DROP
+    """
+)
+_CREATE_INSERTED = text(
+    """
+    CREATE TEMP TABLE bulk_inserted (
+        message_id UUID NOT NULL,
+        movement_id UUID NOT NULL,
+        warehouse_id UUID NOT NULL,
+        product_id UUID NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+        event VARCHAR NOT NULL,
+        quantity INTEGER NOT NULL
+    ) ON COMMIT DROP
+    """
+)
+
+# ключи без conflict target: пропускаются и повтор message_id, и повтор (movement_id, event);
+# в movement_events идут только строки, чьи ключи вставлены, по одной на message_id
+_MERGE_EVENTS = text(
+    """
+    WITH staged AS (
+        SELECT DISTINCT ON (message_id) *
+        FROM bulk_staging
+        ORDER BY message_id, seq
+    ),
+    keys AS (
+        INSERT INTO movement_event_keys (message_id, movement_id, event)
+        SELECT message_id, movement_id, event FROM bulk_staging ORDER BY seq
+        ON CONFLICT DO NOTHING
+        RETURNING message_id
+    ),
+    inserted AS (
+        INSERT INTO movement_events (message_id, movement_id, warehouse_id, product_id, timestamp, event, quantity)
+        SELECT s.message_id, s.movement_id, s.warehouse_id, s.product_id, s.timestamp, s.event, s.quantity
+        FROM staged s JOIN keys USING (message_id)
+        RETURNING message_id, movement_id, warehouse_id, product_id, timestamp, event, quantity
+    )
+    INSERT INTO bulk_inserted SELECT * FROM inserted
+    """
+)
+
+# строки порции с известным message_id — вставленные и повторы message_id, остальные пропуски — конфликты
+_COUNT = text(
+    """
+    SELECT
+        (SELECT count(*) FROM bulk_staging) AS received,
+        (SELECT count(*) FROM bulk_inserted) AS inserted,
+        (SELECT count(*) FROM bulk_staging s
+         WHERE EXISTS (SELECT 1 FROM movement_event_keys k WHERE k.message_id = s.message_id)) AS known
+    """
+)
+
+# сортировка — одинаковый порядок блокировок у параллельных транзакций, как в handle_batch
+_UPSERT_BALANCES = text(
+    """
+    INSERT INTO stock_balances (warehouse_id, product_id, quantity)
+    SELECT warehouse_id, product_id,
+           sum(CASE WHEN event = 'arrival' THEN quantity ELSE -quantity END)
+    FROM bulk_inserted
+    GROUP BY warehouse_id, product_id
+    ORDER BY warehouse_id, product_id
+    ON CONFLICT (warehouse_id, product_id)
+    DO UPDATE SET quantity = stock_balances.quantity + excluded.quantity
+    RETURNING warehouse_id, product_id, quantity
+    """
+)
+
+_MARK_STALE_SNAPSHOTS = text(
+    """
+    UPDATE stock_snapshots s
+    SET stale = true
+    FROM (
+        SELECT warehouse_id, product_id, min(timestamp) AS since
+        FROM bulk_inserted GROUP BY warehouse_id, product_id
+    ) late
+    WHERE s.warehouse_id = late.warehouse_id
+      AND s.product_id = late.product_id
+      AND s.taken_at >= late.since
+      AND NOT s.stale
+    """
+)
+
+# половины перемещений порции сводятся по movement_id; вторая половина из БД не затирается
+_UPSERT_MOVEMENTS = text(
+    """
+    INSERT INTO movements (movement_id, product_id,
+                           sender_warehouse, departure_time, quantity_departed,
+                           receiver_warehouse, arrival_time, quantity_arrived)
+    SELECT movement_id,
+           (array_agg(product_id))[1],
+           (array_agg(warehouse_id) FILTER (WHERE event = 'departure'))[1],
+           max(timestamp) FILTER (WHERE event = 'departure'),
+           max(quantity) FILTER (WHERE event = 'departure'),
+           (array_agg(warehouse_id) FILTER (WHERE event = 'arrival'))[1],
+           max(timestamp) FILTER (WHERE event = 'arrival'),
+           max(quantity) FILTER (WHERE event = 'arrival')
+    FROM bulk_inserted
+    GROUP BY movement_id
+    ORDER BY movement_id
+    ON CONFLICT (movement_id) DO UPDATE SET
+        sender_warehouse = coalesce(excluded.sender_warehouse, movements.sender_warehouse),
+        departure_time = coalesce(excluded.departure_time, movements.departure_time),
+        quantity_departed = coalesce(excluded.quantity_departed, movements.quantity_departed),
+        receiver_warehouse = coalesce(excluded.receiver_warehouse, movements.receiver_warehouse),
+        arrival_time = coalesce(excluded.arrival_time, movements.arrival_time),
+        quantity_arrived = coalesce(excluded.quantity_arrived, movements.quantity_arrived)
+    """
+)
+
+_INSERTED_MOVEMENTS = text("SELECT DISTINCT movement_id FROM bulk_inserted")
+
+_SKIPPED = text(
+    """
+    SELECT DISTINCT movement_id, warehouse_id, product_id FROM bulk_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM bulk_inserted i WHERE i.message_id = s.message_id)
+    """
+)
+
+
+async def copy_to_staging(db: AsyncSession, records: list[tuple]) -> None:
+    """Создаёт временные таблицы порции и заливает records (в порядке STAGING_COLUMNS) через COPY."""
+    # DDL через сессию: она же открывает транзакцию, в которой пойдёт COPY
+    await db.execute(_CREATE_STAGING)
+    await db.execute(_CREATE_INSERTED)
+    connection = await db.connection()
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        "bulk_staging", records=records, columns=STAGING_COLUMNS,
+    )
+
+
+async def handle_bulk(envelopes: list[KafkaEnvelope | KafkaEventRecord], db: AsyncSession, backend) -> BatchResult:
+    """То же, что handle_batch, но строки идут в БД через COPY и сливаются одним проходом на сервере."""
+    result = BatchResult(received=len(envelopes))
+    if not envelopes:
+        return result
+
+    values = [_event_values(envelope) for envelope in envelopes]
+    records = [tuple(row[column] for column in STAGING_COLUMNS) for row in values]
+    await copy_to_staging(db, records)
+    await db.execute(_MERGE_EVENTS)
+
+    counts = (await db.execute(_COUNT)).one()
+    result.inserted = counts.inserted
+    result.duplicates = counts.known - counts.inserted
+    result.conflicts = counts.received - counts.known
+
+    balances = {}
+    movement_ids = []
+    if result.inserted:
+        upserted = await db.execute(_UPSERT_BALANCES)
+        balances = {(row.warehouse_id, row.product_id): row.quantity for row in upserted.all()}
+        await db.execute(_UPSERT_MOVEMENTS)
+        await db.execute(_MARK_STALE_SNAPSHOTS)
+        movement_ids = list((await db.execute(_INSERTED_MOVEMENTS)).scalars().all())
+
+    skipped = []
+    if result.duplicates or result.conflicts:
+        skipped = [row._asdict() for row in await db.execute(_SKIPPED)]
+
+    await db.commit()
+    # пары и пропущенных повторов: лишний сброс as_of-кеша безвреден
+    late = late_pairs(values) if result.inserted else ()
+    await cache_after_commit(db, backend, balances, movement_ids, skipped, late)
+    return result
+
+
+def read_chunks(lines, chunk_size: int, fast: bool = False,
+                start: int = 0) -> Iterator[tuple[list, int, int]]:
+    """
+    Порции (конверты, число невалидных строк, смещение после порции) из JSONL.
+
+    lines — бинарный поток, уже стоящий на байте start; смещение после порции — начало
+    следующей строки, с него можно продолжить загрузку (--offset).
+    """
+    parse = KafkaEventRecord.model_validate if fast else KafkaEnvelope.model_validate
+    chunk, invalid = [], 0
+    offset = start
+    for line in lines:
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            chunk.append(parse(json.loads(line)))
+        except ValueError as e:
+            invalid += 1
+            logger.error("Offset %s: invalid envelope: %s", offset - len(line), e)
+        if len(chunk) >= chunk_size:
+            yield chunk, invalid, offset
+            chunk, invalid = [], 0
+    if chunk or invalid:
+        yield chunk, invalid, offset
+
+
+async def load_stream(source, chunk_size: int, fast: bool, use_cache: bool, start: int = 0,
+                      on_chunk: Optional[Callable[[BatchResult, int], None]] = None) -> BatchResult:
+    """Загружает JSONL из бинарного потока порциями по chunk_size, каждая — своя транзакция."""
+    import redis.asyncio as redis
+
+    from kafka_utils.db import SessionLocal, engine
+    from warehouse_service.cache import make_backend
+    from warehouse_service.config import REDIS_DB, REDIS_HOST, REDIS_PORT
+
+    backend = make_backend(redis.Redis(host=REDIS_HOST, port=int(REDIS_PORT), db=int(REDIS_DB))) if use_cache else None
+    total = BatchResult()
+    try:
+        for envelopes, invalid, offset in read_chunks(source, chunk_size, fast, start):
+            async with SessionLocal() as session:
+                result = await handle_bulk(envelopes, session, backend)
+            for field in ("received", "inserted", "duplicates", "conflicts"):
+                setattr(total, field, getattr(total, field) + getattr(result, field))
+            total.received += invalid
+            total.invalid += invalid
+            if on_chunk is not None:
+                on_chunk(total, offset)
+            else:
+                logger.info("Loaded %s events so far (%s new), resume offset %s", total.received, total.inserted, offset)
+    finally:
+        if backend is not None:
+            await backend.redis.aclose()
+        await engine.dispose()
+    return total
+
+
+async def load_file(path: str, chunk_size: int, fast: bool, use_cache: bool, start: int = 0) -> BatchResult:
+    with open(path, "rb") as source:
+        source.seek(start)
+        return await load_stream(source, chunk_size, fast, use_cache, start)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="JSONL-файл с конвертами событий")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="событий в одной транзакции")
+    parser.add_argument("--fast-decode", action="store_true",
+                        help="проверять только id и data (как KAFKA_FAST_DECODE)")
+    parser.add_argument("--no-cache", action="store_true", help="не трогать кеш (например, при пустом Redis)")
+    parser.add_argument("--offset", type=int, default=0, help="байт, с которого продолжить (resume offset из лога)")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(load_file(args.path, args.chunk_size, args.fast_decode, not args.no_cache, args.offset))
+    print(
+        f"received={result.received} inserted={result.inserted} duplicates={result.duplicates} "
+        f"conflicts={result.conflicts} invalid={result.invalid}"
+    )
+    return 1 if result.invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,33 @@
 import asyncio
 import json
+from functools import partial
 
 import redis.asyncio as redis
 from aiokafka import AIOKafkaConsumer
 from aiokafka.errors import KafkaConnectionError
-from fastapi_cache.backends.redis import RedisBackend
 
-from kafka_utils.db import handle_event, engine, SessionLocal
+from kafka_utils.bulk_load import handle_bulk
+from kafka_utils.dead_letters import RetryPolicy, Undecodable, WriteFailed, call_with_retries, is_transient
+from kafka_utils.dead_letters import record_dead_letter
+from kafka_utils.db import BatchResult, handle_batch, handle_event, engine, SessionLocal
+from kafka_utils.offsets import DrainingRebalanceListener, OffsetCommitter, OffsetTracker, message_partition
+from kafka_utils.pool import KeyedWorkerPool
+from warehouse_service.cache import make_backend
 from warehouse_service.config import KAFKA_URL, KAFKA_TOPIC
+from warehouse_service.config import KAFKA_BATCH_LINGER_MS, KAFKA_BATCH_SIZE, KAFKA_CONSUMER_MODE
+from warehouse_service.config import KAFKA_COMMIT_INTERVAL_MS, KAFKA_FAST_DECODE, KAFKA_MAX_IN_FLIGHT
+from warehouse_service.config import KAFKA_RETRY_MAX_MS
 from warehouse_service.config import REDIS_HOST, REDIS_PORT, REDIS_DB
 from warehouse_service.logger import setup_logger
-from warehouse_service.schemas import KafkaEnvelope
+from warehouse_service.schemas import KafkaEnvelope, KafkaEventRecord
+
+# пауза перед повторным чтением незаписанных сообщений: повторы внутри записи уже исчерпаны
+REDELIVERY_DELAY = KAFKA_RETRY_MAX_MS / 1000
+
+try:
+    import orjson
+except ImportError:  # без orjson KAFKA_FAST_DECODE сокращает только валидацию
+    orjson = None
 
 logger = setup_logger(__name__)
 logger.debug("Kafka consumer initialized")
@@ -19,29 +36,276 @@ _redis_client = redis.Redis(
     host=REDIS_HOST, port=int(REDIS_PORT), db=int(REDIS_DB),
     decode_responses=False,
 )
-backend = RedisBackend(_redis_client)
+backend = make_backend(_redis_client)
+
+
+def deserialize_value(raw: bytes) -> dict | Undecodable:
+    # ошибка разбора не должна ронять getmany(): сообщение уйдёт в dead_letters
+    try:
+        if KAFKA_FAST_DECODE and orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw.decode("utf-8"))
+    except ValueError as e:  # JSONDecodeError, orjson.JSONDecodeError, UnicodeDecodeError
+        return Undecodable(raw, e)
+
 
+def parse_envelope(value: dict | Undecodable) -> KafkaEnvelope | KafkaEventRecord:
+    """
+    Проверка декодированного сообщения; исключение — сообщение невалидно.
+
+    С KAFKA_FAST_DECODE проверяются только id и data — то, что пишется в БД;
+    метаданные конверта не проверяются, и сообщение без них будет принято.
+    """
+    if isinstance(value, Undecodable):
+        raise value.error
+    if KAFKA_FAST_DECODE:
+        return KafkaEventRecord.model_validate(value)
+    return KafkaEnvelope(**value)
+
+
+async def write_message(msg, envelope: KafkaEnvelope | KafkaEventRecord,
+                        policy: RetryPolicy = RetryPolicy()) -> str | None:
+    """
+    Запись одного события с повторами временных ошибок.
+
+    Возвращает inserted, duplicate или dead_letter (постоянная ошибка, сообщение сохранено
+    в dead_letters); None — временная ошибка пережила все повторы, сообщение не записано.
+    """
+    async def write() -> str:
+        async with SessionLocal() as session:
+            try:
+                await handle_event(envelope, session, backend)
+                await session.commit()
+            except ValueError as e:
+                logger.warning("Duplicate event skipped: %s", e)
+                return "duplicate"
+            except Exception:
+                await session.rollback()
+                raise
+        return "inserted"
+
+    try:
+        return await call_with_retries(write, policy, "message")
+    except WriteFailed as e:
+        if is_transient(e.error):
+            logger.error("handle_event failed after %s attempt(s): %s", e.attempts, e.error)
+            return None
+        logger.error("handle_event failed: %s", e.error, exc_info=e.error)
+        return "dead_letter" if await record_dead_letter(msg, e.error, e.attempts) else None
 
-async def process_message(msg):
-    """Обработка одного Kafka-сообщения."""
+
+async def process_message(msg, policy: RetryPolicy = RetryPolicy()) -> bool:
+    """
+    Обработка одного Kafka-сообщения.
+
+    Возвращает True, если сообщение больше не нужно перечитывать: событие записано,
+    отброшено как дубликат или сохранено в dead_letters. False — запись не удалась:
+    run_message_loop вернёт чтение партиции к этому сообщению (redeliver_failed).
+    Повторы ждут внутри задачи пула, поэтому стоит только ключ этого сообщения.
+    """
     logger.debug("Kafka message: %s", msg.value)
-    # start_time = time.perf_counter()
 
     try:
-        envelope = KafkaEnvelope(**msg.value)
+        envelope = parse_envelope(msg.value)
     except Exception as e:
-        logger.error("Invalid envelope: %s", e, exc_info=True)
-        return
+        logger.error("Invalid envelope: %s", e)
+        return await record_dead_letter(msg, e)
+
+    return await write_message(msg, envelope, policy) is not None
 
-    async with SessionLocal() as session:
+
+async def process_batch(messages, policy: RetryPolicy = RetryPolicy()) -> BatchResult | None:
+    """
+    Валидация и запись пачки Kafka-сообщений одной транзакцией (в режиме bulk — через COPY).
+
+    Невалидные сообщения уходят в dead_letters. Временная ошибка повторяет пачку целиком;
+    постоянная — пачка дописывается поштучно по порядку, и в dead_letters попадает только
+    сообщение, которое её вызвало. None — пачка не записана: run_batch_loop вернёт чтение
+    её партиций к её началу (rewind), и она придёт ещё раз.
+    """
+    valid = []
+    invalid = 0
+    for msg in messages:
         try:
-            await handle_event(envelope, session, backend)
-            await session.commit()
-            # elapsed = time.perf_counter() - start_time
-            # logger.info("Processed Kafka event in %.3f seconds", elapsed)
+            valid.append((msg, parse_envelope(msg.value)))
         except Exception as e:
-            await session.rollback()
-            logger.error("handle_event failed: %s", e, exc_info=True)
+            invalid += 1
+            logger.error("Invalid envelope: %s", e)
+            if not await record_dead_letter(msg, e):
+                return None
+
+    result = BatchResult(received=len(messages), invalid=invalid)
+    if valid:
+        handler = handle_bulk if KAFKA_CONSUMER_MODE == "bulk" else handle_batch
+
+        async def write() -> BatchResult:
+            async with SessionLocal() as session:
+                try:
+                    return await handler([envelope for _, envelope in valid], session, backend)
+                except Exception:
+                    await session.rollback()
+                    raise
+
+        try:
+            result = await call_with_retries(write, policy, "batch")
+        except WriteFailed as e:
+            if is_transient(e.error):
+                logger.error("handle_batch failed after %s attempt(s): %s", e.attempts, e.error)
+                return None
+            logger.error("handle_batch failed, writing messages one by one: %s", e.error, exc_info=e.error)
+            result = BatchResult()
+            for msg, envelope in valid:
+                outcome = await write_message(msg, envelope, policy)
+                if outcome is None:
+                    return None
+                if outcome == "inserted":
+                    result.inserted += 1
+                elif outcome == "duplicate":
+                    result.duplicates += 1
+                else:
+                    result.dead_letters += 1
+        result.received = len(messages)
+        result.invalid = invalid
+    result.dead_letters += invalid
+
+    logger.info(
+        "Batch processed: received=%s inserted=%s duplicates=%s conflicts=%s invalid=%s dead_letters=%s",
+        result.received, result.inserted, result.duplicates, result.conflicts, result.invalid,
+        result.dead_letters,
+    )
+    return result
+
+
+async def collect_batch(consumer, max_records: int = KAFKA_BATCH_SIZE,
+                        linger_ms: int = KAFKA_BATCH_LINGER_MS) -> list:
+    """
+    Набирает пачку через getmany(): ждёт первое сообщение, затем не дольше linger_ms
+    добирает пачку до max_records.
+    """
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+
+    while len(batch) < max_records:
+        timeout = 1.0 if deadline is None else max(deadline - loop.time(), 0)
+        chunk = await consumer.getmany(
+            timeout_ms=int(timeout * 1000), max_records=max_records - len(batch),
+        )
+        for records in chunk.values():
+            batch.extend(records)
+
+        if batch and deadline is None:
+            deadline = loop.time() + linger_ms / 1000
+        if deadline is not None and loop.time() >= deadline:
+            break
+
+    return batch
+
+
+def rewind(consumer, tracker: OffsetTracker, partitions) -> None:
+    """Возвращает чтение партиций к первому незаписанному сообщению: оно будет перечитано, а не пропущено."""
+    assigned = consumer.assignment()
+    for tp in partitions:
+        offset = tracker.rewind(tp)
+        if offset is not None and tp in assigned:
+            consumer.seek(tp, offset)
+            logger.warning("Partition %s:%s rewound to offset %s", tp.topic, tp.partition, offset)
+
+
+async def run_batch_loop(consumer, committer: OffsetCommitter, writing: asyncio.Lock | None = None) -> None:
+    """
+    writing удерживается, пока пачка пишется в БД: ребалансировка дожидается её (см. consume).
+
+    Незаписанная пачка перечитывается: партиции возвращаются к её началу, и после паузы
+    REDELIVERY_DELAY чтение продолжается с неё.
+    """
+    tracker = committer.tracker
+    writing = writing or asyncio.Lock()
+    while True:
+        batch = await collect_batch(consumer)
+        async with writing:
+            # сообщения партиций, отобранных, пока пачка собиралась, достанутся новому владельцу
+            batch = [msg for msg in batch if tracker.track(message_partition(msg), msg.offset)]
+            if not batch:
+                continue
+
+            # смещения пачки отдаются в коммит только после COMMIT в Postgres
+            written = await process_batch(batch) is not None
+            if written:
+                for msg in batch:
+                    tracker.done(message_partition(msg), msg.offset)
+            else:
+                rewind(consumer, tracker, {message_partition(msg) for msg in batch})
+        if not written:
+            # вне writing: ребалансировка не ждёт паузу
+            await asyncio.sleep(REDELIVERY_DELAY)
+        await committer.maybe_commit()
+
+
+def message_key(msg):
+    """Ключ упорядочивания: события одной пары (склад, товар) обрабатываются по очереди."""
+    try:
+        data = msg.value["data"]
+        return data["warehouse_id"], data["product_id"]
+    except (KeyError, TypeError):
+        # невалидное сообщение: process_message отправит его в dead_letters
+        return None
+
+
+async def process_tracked(msg, tracker: OffsetTracker) -> None:
+    if await process_message(msg):
+        tracker.done(message_partition(msg), msg.offset)
+    else:
+        tracker.fail(message_partition(msg))
+
+
+async def redeliver_failed(consumer, pool: KeyedWorkerPool, tracker: OffsetTracker) -> set:
+    """
+    Поштучный режим: дожидается задач пула и возвращает партиции с неудачными сообщениями
+    к первому незаписанному смещению. Возвращает эти партиции.
+    """
+    await pool.drain()
+    partitions = tracker.take_failed()
+    rewind(consumer, tracker, partitions)
+    await asyncio.sleep(REDELIVERY_DELAY)
+    return partitions
+
+
+async def run_message_loop(consumer, pool: KeyedWorkerPool, committer: OffsetCommitter) -> None:
+    """
+    Поштучная обработка с ограничением числа задач в работе.
+
+    Когда пул заполнен, чтение партиций ставится на паузу и возобновляется,
+    как только пул разгрузится наполовину — память не растёт при перечитывании топика.
+    Сообщения завершаются в произвольном порядке, коммитится непрерывный префикс.
+    После неудачного сообщения его партиция перечитывается с первого незаписанного смещения.
+    """
+    tracker = committer.tracker
+    while True:
+        if tracker.has_failed:
+            await redeliver_failed(consumer, pool, tracker)
+        chunk = await consumer.getmany(timeout_ms=1000, max_records=KAFKA_BATCH_SIZE)
+        # партиции, возвращённые назад: их сообщения этой порции придут ещё раз после seek
+        rewound = set()
+        for records in chunk.values():
+            for msg in records:
+                if tracker.has_failed:
+                    rewound |= await redeliver_failed(consumer, pool, tracker)
+                if message_partition(msg) in rewound:
+                    continue
+                if pool.full:
+                    partitions = consumer.assignment()
+                    consumer.pause(*partitions)
+                    logger.debug("Pool is full (%s in flight), fetching paused", pool.in_flight)
+                    await pool.wait_below(pool.max_in_flight // 2)
+                    # за время паузы часть партиций могли отобрать при ребалансировке
+                    consumer.resume(*(tp for tp in partitions if tp in consumer.assignment()))
+                    await committer.maybe_commit()
+                if not tracker.track(message_partition(msg), msg.offset):
+                    # партицию отобрали, пока порция ждала очереди
+                    continue
+                await pool.submit(message_key(msg), partial(process_tracked, msg, tracker))
+        await committer.maybe_commit()
 
 
 async def consume(max_retries: int = 10, retry_delay: float = 3.0) -> None:
@@ -51,14 +315,15 @@ async def consume(max_retries: int = 10, retry_delay: float = 3.0) -> None:
     while attempt <= max_retries:
         try:
             consumer = AIOKafkaConsumer(
-                KAFKA_TOPIC,
                 bootstrap_servers=KAFKA_URL,
                 group_id=KAFKA_TOPIC,
-                value_deserializer=lambda m: json.loads(m.decode("utf-8")),
+                value_deserializer=deserialize_value,
                 auto_offset_reset="earliest",
+                # смещения коммитим сами, только после записи в БД
+                enable_auto_commit=False,
             )
             await consumer.start()
-            logger.info("Kafka consumer started (topic=%s)", KAFKA_TOPIC)
+            logger.info("Kafka consumer started (topic=%s, mode=%s)", KAFKA_TOPIC, KAFKA_CONSUMER_MODE)
             break
         except KafkaConnectionError as e:
             logger.warning("Kafka not ready (attempt %s/%s): %s", attempt, max_retries, e)
@@ -68,17 +333,32 @@ async def consume(max_retries: int = 10, retry_delay: float = 3.0) -> None:
     if consumer is None:
         raise RuntimeError("Could not connect to Kafka")
 
-    tasks = set()
+    pool = KeyedWorkerPool(KAFKA_MAX_IN_FLIGHT)
+    committer = OffsetCommitter(consumer, OffsetTracker(), KAFKA_COMMIT_INTERVAL_MS)
+    batch_mode = KAFKA_CONSUMER_MODE in ("batch", "bulk")
+    writing = asyncio.Lock()
+
+    async def drain() -> None:
+        # батч-режим: дождаться пачки, которая сейчас пишется; поштучный — всех задач пула
+        if batch_mode:
+            async with writing:
+                return
+        await pool.drain()
+
+    # процессы одной группы (kafka_utils.run_consumer --workers) делят партиции топика
+    consumer.subscribe([KAFKA_TOPIC], listener=DrainingRebalanceListener(committer, drain))
 
     try:
-        async for msg in consumer:
-            task = asyncio.create_task(process_message(msg))
-            tasks.add(task)
-            task.add_done_callback(tasks.discard)
+        if batch_mode:
+            await run_batch_loop(consumer, committer, writing)
+        else:
+            await run_message_loop(consumer, pool, committer)
     except Exception as e:
         logger.error("Consumer error: %s", e, exc_info=True)
     finally:
+        # сначала дописываем начатое и коммитим, потом отключаемся от Kafka
+        await pool.drain()
+        await committer.commit()
         await consumer.stop()
         logger.info("Kafka consumer stopped")
-        await asyncio.gather(*tasks, return_exceptions=True)
         await engine.dispose()
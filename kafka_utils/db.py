@@ -1,37 +1,182 @@
 import logging
+from collections import defaultdict
+from datetime import timezone
+from dataclasses import dataclass
 
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from warehouse_service.config import DB_URL
-from warehouse_service.db import create_engine_and_session
-from warehouse_service.models import MovementEvent
-from warehouse_service.schemas import KafkaEnvelope
+from warehouse_service.cache import (
+    as_of_horizon, bump_as_of_versions, cache_expire, encode_response, invalidate_cache, movement_cache_key,
+    publish_invalidation, set_many, stock_cache_key,
+)
+from warehouse_service.config import CACHE_WRITE_MODE, DB_URL, KAFKA_DB_MAX_OVERFLOW, KAFKA_DB_POOL_SIZE
+from warehouse_service.db import create_engine_and_session, engine_options
+from warehouse_service.models import MovementEvent, MovementEventKey, StockBalance
+from warehouse_service.schemas import KafkaEnvelope, KafkaEventRecord, StockResponse
+from warehouse_service.services.movements import (
+    movement_from_row, movement_half, movement_rows, movements_by_ids_stmt, upsert_movements_stmt,
+)
+from warehouse_service.services.snapshots import mark_stale_snapshots_stmt
+from warehouse_service.services.stock import (
+    non_negative_stock, stock_delta, upsert_balance_stmt, upsert_balances_stmt,
+)
 
 engine, SessionLocal = create_engine_and_session(
     DB_URL,
     echo=False,
-    pool_size=5,
-    max_overflow=10,
+    **engine_options("consumer", KAFKA_DB_POOL_SIZE, KAFKA_DB_MAX_OVERFLOW),
 )
 
 
-async def handle_event(envelope: KafkaEnvelope, db: AsyncSession, backend):
+# имя ограничения из модели и старое имя, которое встречалось в ранних схемах
+MOVEMENT_EVENT_CONSTRAINTS = ("uix_movement_id_event_type", "uix_movement_event_event_type")
+
+# asyncpg передаёт в одном запросе не больше 32767 параметров. Самая широкая строка пачки —
+# upsert movements (8 столбцов), поэтому многострочные запросы handle_batch режутся по 4095 строк
+# и KAFKA_BATCH_SIZE не ограничен этим лимитом.
+MAX_BIND_PARAMS = 32767
+STATEMENT_ROWS = MAX_BIND_PARAMS // 8
+
+
+def _chunks(rows: list):
+    for start in range(0, len(rows), STATEMENT_ROWS):
+        yield rows[start:start + STATEMENT_ROWS]
+
+
+@dataclass
+class BatchResult:
+    """Итог записи одной пачки событий."""
+    received: int = 0
+    inserted: int = 0
+    duplicates: int = 0   # такой message_id уже был
+    conflicts: int = 0    # такое событие (movement_id, event) уже было
+    invalid: int = 0      # не прошли валидацию конверта
+    dead_letters: int = 0  # сохранены в dead_letters: невалидные и с постоянной ошибкой записи
+
+
+async def write_through(db: AsyncSession, backend, balances: dict, movement_ids, stale=()) -> None:
+    """
+    Кладёт в кеш значения, которые прочитали бы GET-эндпоинты, одним pipeline-запросом.
+
+    balances — новые остатки {(warehouse_id, product_id): quantity} из RETURNING upsert'а,
+    перемещения дочитываются одним запросом после коммита. Незавершённое перемещение
+    удаляется из кеша: кешированный 404 был бы неверным после второго события.
+    Ключи из stale просто удаляются.
+    """
+    if backend is None:
+        return
+    movement_ids = list(dict.fromkeys(movement_ids))
+
+    items = {
+        stock_cache_key(wh, product): encode_response(StockResponse(
+            warehouse_id=wh, product_id=product, quantity=non_negative_stock(wh, product, quantity),
+        ))
+        for (wh, product), quantity in balances.items()
+    }
+    try:
+        complete = {
+            row.movement_id: movement_from_row(row)
+            for row in await db.execute(movements_by_ids_stmt(movement_ids))
+        }
+    except Exception as e:
+        logging.warning(f"Error while reading movements for cache: {e}")
+        complete = {}
+
+    stale = list(stale)
+    for movement_id in movement_ids:
+        if movement_id in complete:
+            items[movement_cache_key(movement_id)] = encode_response(complete[movement_id])
+        else:
+            stale.append(movement_cache_key(movement_id))
+    await set_many(backend, items, cache_expire(), delete=stale)
+
+
+def late_pairs(rows) -> set:
+    """Пары (склад, товар) событий старше окна опозданий: они меняют уже кешированные as_of-ответы."""
+    horizon = as_of_horizon()
+    late = set()
+    for row in rows:
+        moment = row["timestamp"]
+        if (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)) <= horizon:
+            late.add((row["warehouse_id"], row["product_id"]))
+    return late
+
+
+async def cache_after_commit(db: AsyncSession, backend, balances: dict, movement_ids, skipped=(),
+                             late=()) -> None:
+    """
+    Обновление кеша после коммита пачки: write-through или удаление ключей по CACHE_WRITE_MODE.
+
+    balances — новые остатки из RETURNING, movement_ids — перемещения записанных событий,
+    skipped — строки (warehouse_id / product_id / movement_id) пропущенных повторов,
+    late — пары опоздавших событий (late_pairs), их as_of-ответы сбрасываются.
+    """
+    await bump_as_of_versions(backend, late)
+    if CACHE_WRITE_MODE == "write_through":
+        # повторы — обычно переотправка после сбоя между коммитом и записью в кеш,
+        # поэтому их ключи сбрасываются
+        stale = set()
+        for row in skipped:
+            stale.add(movement_cache_key(row["movement_id"]))
+            stale.add(stock_cache_key(row["warehouse_id"], row["product_id"]))
+        await write_through(db, backend, balances, movement_ids, sorted(stale))
+    else:
+        keys = {movement_cache_key(movement_id) for movement_id in movement_ids}
+        keys.update(stock_cache_key(wh, product) for wh, product in balances)
+        await invalidate_cache(backend, sorted(keys))
+
+
+def _returning_balance(stmt):
+    return stmt.returning(StockBalance.warehouse_id, StockBalance.product_id, StockBalance.quantity)
+
+
+def _key_values(values: dict) -> dict:
+    return {
+        "message_id": values["message_id"],
+        "movement_id": values["movement_id"],
+        "event": values["event"],
+    }
+
+
+def _event_values(envelope: KafkaEnvelope | KafkaEventRecord) -> dict:
     data = envelope.data
+    return {
+        "message_id": envelope.id,
+        "movement_id": data.movement_id,
+        "warehouse_id": data.warehouse_id,
+        "product_id": data.product_id,
+        "timestamp": data.timestamp,
+        "event": data.event,
+        "quantity": data.quantity,
+    }
 
-    event_row = MovementEvent(
-        message_id=envelope.id,
-        movement_id=data.movement_id,
-        warehouse_id=data.warehouse_id,
-        product_id=data.product_id,
-        timestamp=data.timestamp,
-        event=data.event,
-        quantity=data.quantity,
-    )
-    db.add(event_row)
+
+async def handle_event(envelope: KafkaEnvelope | KafkaEventRecord, db: AsyncSession, backend):
+    data = envelope.data
+
+    values = _event_values(envelope)
+    event_row = MovementEvent(**values)
+    balances = None
 
     try:
+        # ключ дедупликации: повтор message_id / (movement_id, event) падает здесь,
+        # до записи в партицию
+        await db.execute(insert(MovementEventKey).values(_key_values(values)))
+        db.add(event_row)
+        # проекция остатков обновляется в той же транзакции, что и вставка события
+        balance = (await db.execute(_returning_balance(upsert_balance_stmt(
+            data.warehouse_id, data.product_id, stock_delta(data.event, data.quantity),
+        )))).one()
+        # половина перемещения — туда же, GET /movements/{id} читает её по ключу
+        await db.execute(upsert_movements_stmt([movement_half(values)]))
+        await db.execute(mark_stale_snapshots_stmt(
+            [(data.warehouse_id, data.product_id, data.timestamp)]
+        ))
         await db.commit()
+        balances = {(balance.warehouse_id, balance.product_id): balance.quantity}
     except IntegrityError as exc:
         await db.rollback()
 
@@ -39,7 +184,7 @@ async def handle_event(envelope: KafkaEnvelope, db: AsyncSession, backend):
         msg = str(exc.orig)
         if "movement_events_message_id_key" in msg:
             raise ValueError(f"Message {envelope.id} already exists") from exc
-        elif "uix_movement_event_event_type" in msg:
+        elif any(name in msg for name in MOVEMENT_EVENT_CONSTRAINTS):
             raise ValueError(
                 f"Event '{data.event}' for movement_id={data.movement_id} "
                 "already exists"
@@ -47,11 +192,99 @@ async def handle_event(envelope: KafkaEnvelope, db: AsyncSession, backend):
         else:
             raise
     finally:
-        if backend is not None:
-            movement_cache_key = f":movements:{data.movement_id}"
-            stock_cache_key = f":warehouses:{data.warehouse_id}:products:{data.product_id}"
+        if balances is not None and CACHE_WRITE_MODE == "write_through":
+            await write_through(db, backend, balances, [data.movement_id])
+        elif backend is not None:
+            # ошибка или повтор: запись могла пройти раньше, а обновить кеш — нет
+            keys = [movement_cache_key(data.movement_id), stock_cache_key(data.warehouse_id, data.product_id)]
             try:
-                await backend.clear(key=movement_cache_key)
-                await backend.clear(key=stock_cache_key)
+                for key in keys:
+                    await backend.clear(key=key)
             except Exception as e:
                 logging.warning(f"Error while clearing cache: {e}")
+            await publish_invalidation(backend, keys)
+        if balances is not None:
+            await bump_as_of_versions(backend, late_pairs([values]))
+
+
+async def handle_batch(envelopes: list[KafkaEnvelope | KafkaEventRecord], db: AsyncSession, backend) -> BatchResult:
+    """
+    Записывает пачку событий одной транзакцией.
+
+    Многострочный INSERT ... ON CONFLICT DO NOTHING в movement_event_keys отсекает повторы,
+    прошедшие строки одним INSERT пишутся в movement_events, затем один upsert
+    в stock_balances, один в movements, пометка устаревших снимков и один COMMIT. Пачка больше
+    STATEMENT_ROWS строк пишется теми же запросами по кускам в той же транзакции.
+    Повторы не роняют пачку, а считаются в BatchResult:
+    duplicates — по message_id, conflicts — по паре (movement_id, event).
+    """
+    result = BatchResult(received=len(envelopes))
+
+    rows = []
+    seen_messages, seen_events = set(), set()
+    for envelope in envelopes:
+        values = _event_values(envelope)
+        if values["message_id"] in seen_messages:
+            result.duplicates += 1
+            continue
+        if (values["movement_id"], values["event"]) in seen_events:
+            result.conflicts += 1
+            continue
+        seen_messages.add(values["message_id"])
+        seen_events.add((values["movement_id"], values["event"]))
+        rows.append(values)
+
+    if not rows:
+        return result
+
+    inserted_ids = set()
+    for chunk in _chunks(rows):
+        # без явного conflict target: пропускаем и повтор message_id, и повтор (movement_id, event)
+        stmt = (
+            insert(MovementEventKey)
+            .values([_key_values(row) for row in chunk])
+            .on_conflict_do_nothing()
+            .returning(MovementEventKey.message_id)
+        )
+        inserted_ids.update((await db.execute(stmt)).scalars().all())
+    inserted = [row for row in rows if row["message_id"] in inserted_ids]
+    result.inserted = len(inserted)
+
+    skipped = [row["message_id"] for row in rows if row["message_id"] not in inserted_ids]
+    for chunk in _chunks(skipped):
+        existing = await db.execute(
+            select(MovementEventKey.message_id).where(MovementEventKey.message_id.in_(chunk))
+        )
+        duplicates = len(existing.scalars().all())
+        result.duplicates += duplicates
+        result.conflicts += len(chunk) - duplicates
+
+    for chunk in _chunks(inserted):
+        await db.execute(insert(MovementEvent).values(chunk))
+
+    balances = {}
+    deltas = defaultdict(int)
+    for row in inserted:
+        deltas[(row["warehouse_id"], row["product_id"])] += stock_delta(row["event"], row["quantity"])
+
+    if deltas:
+        # сортировка ключей — одинаковый порядок блокировок у параллельных транзакций,
+        # куски идут по порядку и его не нарушают
+        for chunk in _chunks([
+            {"warehouse_id": wh, "product_id": product, "quantity": delta}
+            for (wh, product), delta in sorted(deltas.items(), key=lambda item: str(item[0]))
+        ]):
+            upserted = await db.execute(_returning_balance(upsert_balances_stmt(chunk)))
+            balances.update({(row.warehouse_id, row.product_id): row.quantity for row in upserted.all()})
+        for chunk in _chunks(movement_rows(inserted)):
+            await db.execute(upsert_movements_stmt(chunk))
+        for chunk in _chunks(inserted):
+            await db.execute(mark_stale_snapshots_stmt([
+                (row["warehouse_id"], row["product_id"], row["timestamp"]) for row in chunk
+            ]))
+
+    await db.commit()
+
+    await cache_after_commit(db, backend, balances, [row["movement_id"] for row in inserted],
+                             [row for row in rows if row["message_id"] not in inserted_ids], late_pairs(inserted))
+    return result
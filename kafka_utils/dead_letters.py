@@ -0,0 +1,252 @@
+"""
+Повторы временных ошибок и dead letters — сообщения, которые consumer не смог записать.
+
+    python -m kafka_utils.dead_letters list
+    python -m kafka_utils.dead_letters replay [--id 1 --id 2] [--error-class ValidationError] [--limit 1000]
+
+Временные ошибки (соединение с БД, deadlock, serialization failure, таймауты) повторяются
+с экспоненциальной паузой; повторяется только запись своего сообщения или пачки. Если повторы
+исчерпаны, consumer возвращает чтение партиции к незаписанному сообщению (consumer.rewind)
+и читает его снова — событие не теряется и не ждёт перезапуска.
+Невалидное сообщение или постоянная ошибка записи сохраняют сообщение в таблицу dead_letters
+вместе с классом ошибки и смещением, и смещение коммитится — партиция не стоит.
+
+replay переотправляет выбранные сообщения в KAFKA_TOPIC (--topic) и отмечает replayed_at;
+записанные ранее события отбрасываются consumer'ом как дубликаты, поэтому повтор безопасен.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from prometheus_client import Counter
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from kafka_utils.db import SessionLocal, engine
+from warehouse_service.config import KAFKA_RETRY_ATTEMPTS, KAFKA_RETRY_BASE_MS, KAFKA_RETRY_MAX_MS
+from warehouse_service.logger import setup_logger
+from warehouse_service.models import DeadLetter
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+retries = Counter(
+    "warehouse_consumer_retries_total",
+    "Повторы записи после временной ошибки",
+    ["operation"],  # message | batch | dead_letter
+)
+dead_lettered = Counter(
+    "warehouse_consumer_dead_letters_total",
+    "Сообщения, сохранённые в dead_letters",
+    ["error_class"],
+)
+
+_TRANSIENT_ERRORS = (
+    OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError,
+    ConnectionError, asyncio.TimeoutError,
+)
+# SQLSTATE: 08 — соединение, 40001/40P01 — serialization failure/deadlock,
+# 53 — нехватка ресурсов, 57P01-57P03 — остановка сервера
+_TRANSIENT_SQLSTATE_PREFIXES = ("08", "40001", "40P01", "53", "57P01", "57P02", "57P03")
+
+
+class Undecodable:
+    """Значение сообщения, которое не разобралось как JSON: уходит в dead_letters как есть."""
+
+    def __init__(self, raw: bytes, error: Exception):
+        self.raw = raw
+        self.error = error
+
+
+class WriteFailed(Exception):
+    """Запись не удалась после attempts попыток; error — последняя ошибка."""
+
+    def __init__(self, error: Exception, attempts: int):
+        super().__init__(f"{type(error).__name__}: {error}")
+        self.error = error
+        self.attempts = attempts
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+        if sqlstate and sqlstate.startswith(_TRANSIENT_SQLSTATE_PREFIXES):
+            return True
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = KAFKA_RETRY_ATTEMPTS
+    base_delay: float = KAFKA_RETRY_BASE_MS / 1000
+    max_delay: float = KAFKA_RETRY_MAX_MS / 1000
+
+    def delay(self, attempt: int) -> float:
+        """Пауза после неудачной попытки attempt (с 1): экспонента с полным разбросом."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+async def call_with_retries(operation: Callable[[], Awaitable[T]], policy: RetryPolicy, name: str) -> T:
+    """
+    operation() с повторами временных ошибок.
+
+    Постоянная ошибка или исчерпанные попытки — WriteFailed. Пауза — asyncio.sleep,
+    поэтому ждёт только вызывающая задача: другие ключи пула и процессы продолжают работу.
+    """
+    attempt = 1
+    while True:
+        try:
+            return await operation()
+        except Exception as e:
+            if not is_transient(e) or attempt >= policy.attempts:
+                raise WriteFailed(e, attempt) from e
+            delay = policy.delay(attempt)
+            retries.labels(name).inc()
+            logger.warning("%s failed (attempt %s/%s), retrying in %.2fs: %s",
+                           name, attempt, policy.attempts, delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def message_payload(value) -> str:
+    if isinstance(value, Undecodable):
+        return value.raw.decode("utf-8", errors="replace")
+    return json.dumps(value, default=str, ensure_ascii=False)
+
+
+def dead_letter_row(msg, error: Exception, attempts: int) -> dict:
+    key = getattr(msg, "key", None)
+    return {
+        "topic": msg.topic,
+        "partition": msg.partition,
+        "offset": msg.offset,
+        "key": key.decode("utf-8", errors="replace") if isinstance(key, bytes) else key,
+        "payload": message_payload(msg.value),
+        "error_class": type(error).__name__,
+        "error": str(error)[:4000],
+        "attempts": attempts,
+    }
+
+
+async def record_dead_letter(msg, error: Exception, attempts: int = 1,
+                             policy: RetryPolicy = RetryPolicy()) -> bool:
+    """
+    Сохраняет сообщение в dead_letters.
+
+    True — сообщение сохранено (или уже было), смещение можно коммитить; False — БД недоступна,
+    сообщение будет перечитано.
+    """
+    row = dead_letter_row(msg, error, attempts)
+
+    async def write():
+        async with SessionLocal() as session:
+            await session.execute(
+                insert(DeadLetter).values(row).on_conflict_do_nothing(constraint="uix_dead_letters_offset")
+            )
+            await session.commit()
+
+    try:
+        await call_with_retries(write, policy, "dead_letter")
+    except WriteFailed as e:
+        logger.error("Could not dead-letter %s:%s@%s: %s", msg.topic, msg.partition, msg.offset, e)
+        return False
+    dead_lettered.labels(row["error_class"]).inc()
+    logger.error("Dead-lettered %s:%s@%s after %s attempt(s): %s: %s",
+                 msg.topic, msg.partition, msg.offset, attempts, row["error_class"], row["error"])
+    return True
+
+
+def replay_stmt(ids: list[int], error_class: Optional[str], limit: int, again: bool):
+    stmt = select(DeadLetter).order_by(DeadLetter.id).limit(limit)
+    if ids:
+        stmt = stmt.where(DeadLetter.id.in_(ids))
+    if error_class:
+        stmt = stmt.where(DeadLetter.error_class == error_class)
+    if not again:
+        stmt = stmt.where(DeadLetter.replayed_at.is_(None))
+    return stmt
+
+
+async def replay(topic: str, ids: list[int], error_class: Optional[str], limit: int, again: bool) -> int:
+    """Переотправляет dead letters в topic в порядке id и отмечает replayed_at; возвращает их число."""
+    from kafka_utils.producer import KafkaProducerWrapper
+    from warehouse_service.config import KAFKA_URL
+
+    async with SessionLocal() as session:
+        rows = (await session.scalars(replay_stmt(ids, error_class, limit, again))).all()
+        messages, replayed = [], []
+        for row in rows:
+            try:
+                messages.append(json.loads(row.payload))
+                replayed.append(row.id)
+            except ValueError:
+                logger.warning("Dead letter %s is not JSON, skipped", row.id)
+        if not messages:
+            return 0
+
+        producer = KafkaProducerWrapper(KAFKA_URL)
+        await producer.connect()
+        try:
+            await producer.send_many(topic, messages)
+        finally:
+            await producer.disconnect()
+
+        await session.execute(
+            update(DeadLetter).where(DeadLetter.id.in_(replayed)).values(replayed_at=func.now())
+        )
+        await session.commit()
+    return len(replayed)
+
+
+async def summary() -> list:
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(
+                DeadLetter.error_class,
+                func.count().label("total"),
+                func.count().filter(DeadLetter.replayed_at.is_(None)).label("pending"),
+                func.max(DeadLetter.failed_at).label("last_failed_at"),
+            )
+            .group_by(DeadLetter.error_class)
+            .order_by(DeadLetter.error_class)
+        )
+        return result.all()
+
+
+async def main(argv=None) -> int:
+    from warehouse_service.config import KAFKA_TOPIC
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="число dead letters по классам ошибок")
+    replay_cmd = commands.add_parser("replay", help="переотправить dead letters в топик")
+    replay_cmd.add_argument("--id", type=int, action="append", default=[], dest="ids", help="id строки, можно несколько")
+    replay_cmd.add_argument("--error-class", help="только ошибки этого класса, например ValidationError")
+    replay_cmd.add_argument("--limit", type=int, default=1000)
+    replay_cmd.add_argument("--again", action="store_true", help="включая уже переотправленные")
+    replay_cmd.add_argument("--topic", default=KAFKA_TOPIC)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "list":
+            for row in await summary():
+                print(f"{row.error_class:<32} total={row.total} pending={row.pending} last={row.last_failed_at}")
+            return 0
+        count = await replay(args.topic, args.ids, args.error_class, args.limit, args.again)
+        print(f"replayed={count}")
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,178 @@
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from aiokafka import ConsumerRebalanceListener, TopicPartition
+from aiokafka.errors import KafkaError
+
+from warehouse_service.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def message_partition(msg) -> TopicPartition:
+    return TopicPartition(msg.topic, msg.partition)
+
+
+class OffsetTracker:
+    """
+    Учёт обработанных смещений по партициям.
+
+    Сообщения могут завершаться в любом порядке, а к коммиту отдаётся только
+    непрерывный префикс: смещение N + 1 коммитится, лишь когда все смещения
+    до N включительно записаны в БД.
+
+    Неудачное сообщение отмечается fail(); consumer перечитывает партицию с первого
+    незавершённого смещения (rewind), а не продолжает за дырой — иначе граница коммита
+    встала бы до перезапуска, а очередь смещений росла бы без предела.
+
+    После первой ребалансировки учитываются только назначенные партиции (assign/forget):
+    сообщение отобранной партиции, полученное до отзыва, не создаёт заново её состояние,
+    иначе после повторного назначения оно закоммитило бы старое смещение.
+    """
+
+    def __init__(self):
+        self._pending: dict[TopicPartition, deque[int]] = {}
+        self._done: dict[TopicPartition, set[int]] = {}
+        self._committable: dict[TopicPartition, int] = {}
+        self._committed: dict[TopicPartition, int] = {}
+        self._failed: set[TopicPartition] = set()
+        # None — назначения ещё не было (учитываются все партиции)
+        self._assigned: set[TopicPartition] | None = None
+
+    def _owns(self, tp: TopicPartition) -> bool:
+        return self._assigned is None or tp in self._assigned
+
+    def track(self, tp: TopicPartition, offset: int) -> bool:
+        """
+        Регистрирует полученное сообщение (смещения в партиции идут по возрастанию).
+
+        False — партиция не назначена этому consumer'у: сообщение не обрабатывается, его прочитает владелец.
+        """
+        if not self._owns(tp):
+            return False
+        self._pending.setdefault(tp, deque()).append(offset)
+        self._done.setdefault(tp, set())
+        return True
+
+    def done(self, tp: TopicPartition, offset: int) -> None:
+        pending = self._pending.get(tp)
+        if pending is None or not self._owns(tp):
+            # партицию уже отобрали при ребалансировке
+            return
+        done = self._done[tp]
+        done.add(offset)
+        while pending and pending[0] in done:
+            first = pending.popleft()
+            done.discard(first)
+            self._committable[tp] = first + 1
+
+    def fail(self, tp: TopicPartition) -> None:
+        """Сообщение партиции не записано: её нужно перечитать."""
+        if tp in self._pending:
+            self._failed.add(tp)
+
+    @property
+    def has_failed(self) -> bool:
+        return bool(self._failed)
+
+    def take_failed(self) -> set[TopicPartition]:
+        failed, self._failed = self._failed, set()
+        return failed
+
+    def rewind(self, tp: TopicPartition) -> int | None:
+        """
+        Первое незавершённое смещение партиции (None — всё завершено); учёт партиции
+        сбрасывается, сообщения с этого смещения будут получены и учтены заново.
+        """
+        pending = self._pending.get(tp)
+        offset = pending[0] if pending else None
+        if pending is not None:
+            self._pending[tp] = deque()
+            self._done[tp] = set()
+        self._failed.discard(tp)
+        return offset
+
+    @property
+    def pending(self) -> int:
+        return sum(len(offsets) for offsets in self._pending.values())
+
+    def committable(self) -> dict[TopicPartition, int]:
+        """Смещения, которые можно закоммитить и которые ещё не закоммичены."""
+        return {
+            tp: offset for tp, offset in self._committable.items()
+            if self._committed.get(tp) != offset
+        }
+
+    def mark_committed(self, offsets: dict[TopicPartition, int]) -> None:
+        self._committed.update(offsets)
+
+    def forget(self, partitions) -> None:
+        """Сбрасывает состояние отобранных партиций."""
+        for tp in partitions:
+            for state in (self._pending, self._done, self._committable, self._committed):
+                state.pop(tp, None)
+            self._failed.discard(tp)
+            if self._assigned is not None:
+                self._assigned.discard(tp)
+
+    def assign(self, partitions) -> None:
+        """Назначенные партиции начинаются с чистого состояния: смещения до отзыва не в счёт."""
+        self.forget(partitions)
+        self._assigned = (self._assigned or set()) | set(partitions)
+
+
+class OffsetCommitter:
+    """Ручной коммит смещений не чаще, чем раз в interval_ms."""
+
+    def __init__(self, consumer, tracker: OffsetTracker, interval_ms: int):
+        self.consumer = consumer
+        self.tracker = tracker
+        self.interval = interval_ms / 1000
+        self._last_commit = time.monotonic()
+
+    async def maybe_commit(self) -> None:
+        if time.monotonic() - self._last_commit >= self.interval:
+            await self.commit()
+
+    async def commit(self) -> None:
+        self._last_commit = time.monotonic()
+        assigned = self.consumer.assignment()
+        offsets = {tp: offset for tp, offset in self.tracker.committable().items() if tp in assigned}
+        if not offsets:
+            return
+        try:
+            await self.consumer.commit(offsets)
+        except KafkaError as e:
+            # смещения не потеряны: повторим на следующем коммите, в худшем случае —
+            # сообщения будут перечитаны и отброшены как дубликаты
+            logger.warning("Offset commit failed: %s", e)
+            return
+        self.tracker.mark_committed(offsets)
+        logger.debug("Committed offsets: %s", offsets)
+
+
+class DrainingRebalanceListener(ConsumerRebalanceListener):
+    """
+    Отдаёт партиции при ребалансировке только после того, как начатая запись завершена.
+
+    drain() возвращается, когда все принятые сообщения записаны в БД или отброшены;
+    затем их смещения коммитятся, и новый владелец партиции продолжит с них, а не
+    перечитает уже записанное.
+    """
+
+    def __init__(self, committer: OffsetCommitter, drain: Callable[[], Awaitable[None]]):
+        self.committer = committer
+        self.drain = drain
+
+    async def on_partitions_revoked(self, revoked) -> None:
+        if not revoked:
+            return
+        await self.drain()
+        await self.committer.commit()
+        self.committer.tracker.forget(revoked)
+        logger.info("Partitions revoked: %s", sorted(f"{tp.topic}:{tp.partition}" for tp in revoked))
+
+    async def on_partitions_assigned(self, assigned) -> None:
+        self.committer.tracker.assign(assigned)
+        logger.info("Partitions assigned: %s", sorted(f"{tp.topic}:{tp.partition}" for tp in assigned))
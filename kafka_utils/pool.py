@@ -0,0 +1,75 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Hashable
+
+from warehouse_service.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class KeyedWorkerPool:
+    """
+    Ограниченный пул задач с упорядочиванием по ключу.
+
+    Задачи с одинаковым ключом выполняются строго последовательно в порядке submit(),
+    задачи с разными ключами — параллельно. Одновременно принято не больше
+    max_in_flight задач (выполняются или ждут в очереди своего ключа); submit()
+    ждёт, пока освободится место. Число asyncio-задач ограничено числом активных ключей.
+    """
+
+    def __init__(self, max_in_flight: int):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be >= 1")
+        self.max_in_flight = max_in_flight
+        self._queues: dict[Hashable, deque[Job]] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+        self._in_flight = 0
+        self._changed = asyncio.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def full(self) -> bool:
+        return self._in_flight >= self.max_in_flight
+
+    async def submit(self, key: Hashable, job: Job) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._in_flight < self.max_in_flight)
+            self._in_flight += 1
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._workers[key] = asyncio.create_task(self._run(key, queue))
+        queue.append(job)
+
+    async def wait_below(self, threshold: int) -> None:
+        """Ждёт, пока число принятых задач не станет не больше threshold."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._in_flight <= threshold)
+
+    async def drain(self) -> None:
+        """Ждёт завершения всех принятых задач."""
+        await self.wait_below(0)
+
+    async def _run(self, key: Hashable, queue: deque[Job]) -> None:
+        try:
+            while queue:
+                job = queue.popleft()
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error("Job for key %s failed: %s", key, e, exc_info=True)
+                finally:
+                    async with self._changed:
+                        self._in_flight -= 1
+                        self._changed.notify_all()
+        finally:
+            # между проверкой `while queue` и этим блоком нет await — submit() не может
+            # положить задачу в очередь, которую уже никто не разберёт
+            self._queues.pop(key, None)
+            self._workers.pop(key, None)
@@ -1,34 +1,118 @@
 import asyncio
 import json
 import logging
+import time
+from typing import Iterable
 
 from aiokafka import AIOKafkaProducer
 from aiokafka.errors import KafkaConnectionError, KafkaError
+from prometheus_client import Counter, Histogram
+
+from warehouse_service.config import (
+    KAFKA_PRODUCER_BATCH_BYTES, KAFKA_PRODUCER_COMPRESSION, KAFKA_PRODUCER_IDEMPOTENT, KAFKA_PRODUCER_LINGER_MS,
+)
+
+try:
+    import orjson
+except ImportError:  # без orjson — json с default=str, как раньше
+    orjson = None
+
+produced = Counter(
+    "warehouse_kafka_produced_total",
+    "Сообщения, отправленные producer'ом: пропускная способность — rate по result=ok",
+    # result: ok | error — итог доставки; timeout — send()/send_many() не дождались подтверждения,
+    # доставка при этом продолжается и позже тоже попадёт в ok или error
+    ["topic", "result"],
+)
+ack_latency = Histogram(
+    "warehouse_kafka_produce_ack_seconds",
+    "Время от постановки сообщения в очередь producer'а до подтверждения брокером",
+    ["topic"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+def serialize_value(value: dict) -> bytes:
+    # UUID и datetime из model_dump() orjson кодирует сам
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, default=str).encode("utf-8")
+
+
+def partition_key(message: dict) -> bytes | None:
+    """
+    Ключ сообщения — пара (склад, товар): события одного остатка попадают в одну партицию
+    и читаются по порядку. Половины перемещения уходят в разные партиции, но таблица
+    movements не зависит от порядка их прихода.
+    """
+    try:
+        data = message["data"]
+        return f"{data['warehouse_id']}:{data['product_id']}".encode()
+    except (KeyError, TypeError):
+        return None
+
+
+class KafkaSendTimeout(RuntimeError):
+    """Подтверждение не пришло за send_timeout: итог неизвестен, сообщение ещё может быть доставлено."""
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    # исход ожидания, брошенного по таймауту, никто не заберёт: без этого asyncio пишет
+    # «exception was never retrieved»
+    if not future.cancelled():
+        future.exception()
 
 
 class KafkaProducerWrapper:
+    """
+    Обёртка над AIOKafkaProducer.
+
+    send() ждёт подтверждения брокера (не дольше send_timeout), send_nowait() только ставит
+    сообщение в очередь и возвращает future доставки, send_many() отправляет пачку и ждёт
+    подтверждения всех сообщений. Сообщения копятся в пачки по партициям до linger_ms
+    или max_batch_size байт и сжимаются compression_type.
+    """
+
     def __init__(
         self,
         bootstrap_servers: str,
         max_retries: int = 10,
         delay: float = 3.0,
         send_timeout: float = 10.0,
+        linger_ms: int = KAFKA_PRODUCER_LINGER_MS,
+        max_batch_size: int = KAFKA_PRODUCER_BATCH_BYTES,
+        compression_type: str | None = KAFKA_PRODUCER_COMPRESSION,
+        enable_idempotence: bool = KAFKA_PRODUCER_IDEMPOTENT,
     ):
         self.bootstrap_servers = bootstrap_servers
         self.max_retries       = max_retries
         self.retry_delay       = delay
         self.send_timeout      = send_timeout
+        self.linger_ms         = linger_ms
+        self.max_batch_size    = max_batch_size
+        self.compression_type  = compression_type
+        self.enable_idempotence = enable_idempotence
         self.producer: AIOKafkaProducer | None = None
 
+    def _create_producer(self) -> AIOKafkaProducer:
+        return AIOKafkaProducer(
+            bootstrap_servers=self.bootstrap_servers,
+            value_serializer=serialize_value,
+            linger_ms=self.linger_ms,
+            max_batch_size=self.max_batch_size,
+            compression_type=self.compression_type,
+            # идемпотентность: повтор отправки после сбоя не дублирует сообщение в партиции,
+            # порядок внутри партиции сохраняется; требует acks=all
+            enable_idempotence=self.enable_idempotence,
+            acks="all" if self.enable_idempotence else 1,
+        )
+
     async def connect(self):
         attempt = 1
         while attempt <= self.max_retries:
             try:
                 logging.debug(f"Attempting to connect to Kafka ({self.bootstrap_servers}), try {attempt}")
-                self.producer = AIOKafkaProducer(
-                    bootstrap_servers=self.bootstrap_servers,
-                    value_serializer=lambda v: json.dumps(v, default=str).encode("utf-8")
-                )
+                self.producer = self._create_producer()
                 await self.producer.start()
                 logging.info("Kafka producer connected successfully.")
                 return
@@ -43,6 +127,7 @@ class KafkaProducerWrapper:
     async def disconnect(self):
         if self.producer:
             try:
+                # stop() дожидается отправки накопленных пачек
                 await self.producer.stop()
                 logging.info("Kafka producer stopped.")
             except KafkaError as stop_err:
@@ -51,14 +136,51 @@ class KafkaProducerWrapper:
                 # переводим обёртку в состояние 'не подключен'
                 self.producer = None
 
-    async def send(self, topic: str, message: dict):
+    async def send_nowait(self, topic: str, message: dict) -> asyncio.Future:
+        """Ставит сообщение в очередь producer'а; future завершается подтверждением брокера."""
         if not self.producer:
             raise RuntimeError("Kafka producer is not started")
 
+        started = time.perf_counter()
+        # ждёт только места в буфере, не доставки
+        delivery = await self.producer.send(topic, message, key=partition_key(message))
+
+        def record(future: asyncio.Future) -> None:
+            if future.cancelled() or future.exception() is not None:
+                produced.labels(topic, "error").inc()
+                return
+            produced.labels(topic, "ok").inc()
+            ack_latency.labels(topic).observe(time.perf_counter() - started)
+
+        delivery.add_done_callback(record)
+        return delivery
+
+    async def send(self, topic: str, message: dict):
         logging.debug(f"Sending message to {topic}, waiting up to {self.send_timeout}s for an ack…")
+        delivery = await self.send_nowait(topic, message)
         try:
-            await self.producer.send(topic, message)
+            # shield: таймаут не отменяет future доставки, и её итог попадёт в метрику
+            metadata = await asyncio.wait_for(asyncio.shield(delivery), self.send_timeout)
             logging.debug("Message acknowledged by broker.")
+            return metadata
         except asyncio.TimeoutError:
+            produced.labels(topic, "timeout").inc()
             logging.error(f"Timeout after {self.send_timeout}s sending to {topic}")
-            raise RuntimeError(f"Kafka send timed out after {self.send_timeout}s")
+            raise KafkaSendTimeout(f"Kafka send timed out after {self.send_timeout}s")
+
+    async def send_many(self, topic: str, messages: Iterable[dict]) -> list:
+        """
+        Отправляет сообщения и ждёт подтверждения всех; порядок сообщений одного ключа сохраняется.
+
+        Возвращает RecordMetadata в порядке messages, первая ошибка доставки пробрасывается.
+        KafkaSendTimeout — подтверждения не пришли вовремя, но сообщения ещё могут быть доставлены.
+        """
+        deliveries = [await self.send_nowait(topic, message) for message in messages]
+        acked = asyncio.gather(*deliveries)
+        try:
+            return await asyncio.wait_for(asyncio.shield(acked), self.send_timeout)
+        except asyncio.TimeoutError:
+            acked.add_done_callback(_retrieve)
+            produced.labels(topic, "timeout").inc(sum(not delivery.done() for delivery in deliveries))
+            logging.error(f"Timeout after {self.send_timeout}s sending {len(deliveries)} messages to {topic}")
+            raise KafkaSendTimeout(f"Kafka send timed out after {self.send_timeout}s")
@@ -1,6 +1,156 @@
+"""
+Запуск consumer'а: один процесс или несколько процессов одной группы.
+
+    python -m kafka_utils.run_consumer [--workers N]
+
+Каждый процесс — отдельный consume() со своими engine, Redis-клиентом и пулом; Kafka делит
+между ними партиции топика, поэтому процессов больше числа партиций держать смысла нет.
+Порядок событий сохраняется внутри партиции, а producer кладёт события одной пары
+(склад, товар) в одну партицию.
+
+SIGTERM/SIGINT передаются процессам: каждый дописывает начатое, коммитит смещения
+и выходит. Упавший процесс перезапускается.
+
+Метрики (пул соединений, повторы, dead letters) отдаются на KAFKA_METRICS_PORT/metrics.
+С --workers > 1 процессы пишут их в каталог PROMETHEUS_MULTIPROC_DIR (по умолчанию
+/tmp/warehouse-consumer-prometheus, очищается при старте), а главный процесс отдаёт сумму.
+"""
+import argparse
 import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+
+from warehouse_service.config import KAFKA_CONSUMER_WORKERS, KAFKA_METRICS_PORT
+from warehouse_service.logger import setup_logger
+
+logger = setup_logger("kafka_utils.run_consumer")
+
+# упавший процесс перезапускается не чаще, чем раз в столько секунд
+RESTART_DELAY = 3.0
+# сколько ждать штатного завершения процессов после SIGTERM: дописать пачку и закоммитить смещения
+SHUTDOWN_TIMEOUT = 30.0
+
+
+def serve_metrics(port: int, multiprocess_dir: str | None = None) -> None:
+    """HTTP-сервер /metrics в фоновом потоке; с multiprocess_dir — сумма метрик всех процессов каталога."""
+    from prometheus_client import REGISTRY, CollectorRegistry, start_http_server
+    from prometheus_client.multiprocess import MultiProcessCollector
+
+    registry = REGISTRY
+    if multiprocess_dir:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry, path=multiprocess_dir)
+    start_http_server(port, registry=registry)
+    logger.info("Consumer metrics on :%s/metrics", port)
+
+
+def prepare_multiprocess_dir() -> str:
+    # до запуска процессов: spawn-процессы наследуют переменную и пишут метрики в файлы каталога
+    path = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/warehouse-consumer-prometheus")
+    # файлы прошлого запуска дали бы счётчики мёртвых процессов
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def run_worker() -> None:
+    """Тело процесса: consume() до SIGTERM/SIGINT, затем штатное завершение."""
+    from kafka_utils.consumer import consume
+
+    async def main():
+        task = asyncio.create_task(consume())
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            # finally в consume() уже дописал начатое и закоммитил смещения
+            pass
+
+    asyncio.run(main())
+
+
+def mark_process_dead(pid: int) -> None:
+    from prometheus_client import multiprocess
+
+    # gauge'и умершего процесса больше не учитываются
+    multiprocess.mark_process_dead(pid)
+
+
+def supervise(workers: int, metrics_port: int = KAFKA_METRICS_PORT) -> None:
+    # spawn, а не fork: модуль consumer'а создаёт клиенты при импорте, и каждый процесс
+    # должен получить свои
+    context = multiprocessing.get_context("spawn")
+    stopping = False
+    # SIGTERM отправляется процессу один раз: повторный прервал бы его штатное завершение
+    terminated = set()
+
+    def start(index: int):
+        process = context.Process(target=run_worker, name=f"consumer-{index}")
+        process.start()
+        logger.info("Consumer process %s started (pid=%s)", index, process.pid)
+        return process
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes:
+            if process.is_alive() and process.pid not in terminated:
+                terminated.add(process.pid)
+                process.terminate()
+
+    metrics_dir = prepare_multiprocess_dir()
+    if metrics_port:
+        serve_metrics(metrics_port, metrics_dir)
+
+    processes = [start(index) for index in range(workers)]
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        for index, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                logger.error("Consumer process %s exited with code %s, restarting", index, process.exitcode)
+                mark_process_dead(process.pid)
+                time.sleep(RESTART_DELAY)
+                # SIGTERM мог прийти во время паузы: новый процесс stop() бы уже не остановил
+                if stopping:
+                    break
+                processes[index] = start(index)
+        time.sleep(1)
+
+    # процесс, запущенный одновременно с сигналом, stop() мог не застать
+    stop(signal.SIGTERM, None)
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            logger.error("Consumer process %s (pid=%s) did not stop in %ss, killing",
+                         process.name, process.pid, SHUTDOWN_TIMEOUT)
+            process.kill()
+            process.join()
+    logger.info("All consumer processes stopped")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=KAFKA_CONSUMER_WORKERS,
+                        help="процессов в группе (по умолчанию KAFKA_CONSUMER_WORKERS)")
+    parser.add_argument("--metrics-port", type=int, default=KAFKA_METRICS_PORT,
+                        help="порт /metrics, 0 — не отдавать (по умолчанию KAFKA_METRICS_PORT)")
+    args = parser.parse_args(argv)
+
+    if args.workers <= 1:
+        if args.metrics_port:
+            serve_metrics(args.metrics_port)
+        run_worker()
+    else:
+        supervise(args.workers, args.metrics_port)
 
-from kafka_utils.consumer import consume
 
 if __name__ == "__main__":
-    asyncio.run(consume())
+    main()
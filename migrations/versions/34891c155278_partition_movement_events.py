@@ -0,0 +1,156 @@
+"""partition movement_events by month
+
+Revision ID: 34891c155278
+Revises: 627d6ab7193f
+Create Date: 2026-10-18 13:04:51.330118
+
+Таблица пересоздаётся как партиционированная (RANGE по `timestamp`, партиция на
+календарный месяц UTC + DEFAULT), данные переносятся целиком — миграция требует
+остановки consumer'а на время копирования. Уникальность message_id и
+(movement_id, event) переезжает в таблицу movement_event_keys.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '34891c155278'
+down_revision: Union[str, None] = '627d6ab7193f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# сколько будущих месяцев создать сразу, дальше — devtools/partitions ensure
+MONTHS_AHEAD = 3
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TABLE movement_events RENAME TO movement_events_legacy")
+    # имена ограничений и индексов понадобятся новым таблицам
+    op.execute(
+        "ALTER TABLE movement_events_legacy "
+        "DROP CONSTRAINT movement_events_pkey, "
+        "DROP CONSTRAINT movement_events_message_id_key, "
+        "DROP CONSTRAINT uix_movement_id_event_type"
+    )
+    op.execute("DROP INDEX ix_movement_events_warehouse_product")
+    op.execute("ALTER TABLE movement_events_legacy ALTER COLUMN id DROP DEFAULT")
+    op.execute("ALTER SEQUENCE movement_events_id_seq OWNED BY NONE")
+
+    op.execute(
+        """
+        CREATE TABLE movement_events (
+            id INTEGER NOT NULL DEFAULT nextval('movement_events_id_seq'),
+            message_id UUID NOT NULL,
+            movement_id UUID NOT NULL,
+            warehouse_id UUID NOT NULL,
+            product_id UUID NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            event VARCHAR NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+        """
+    )
+    op.execute("ALTER SEQUENCE movement_events_id_seq OWNED BY movement_events.id")
+    op.execute(
+        "CREATE INDEX ix_movement_events_warehouse_product "
+        "ON movement_events (warehouse_id, product_id) INCLUDE (event, quantity)"
+    )
+    op.execute("CREATE INDEX ix_movement_events_movement ON movement_events (movement_id, event)")
+
+    # по партиции на каждый месяц от самого старого события до MONTHS_AHEAD вперёд
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            m date;
+        BEGIN
+            FOR m IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE(
+                        (SELECT min(timestamp) FROM movement_events_legacy), now()
+                    ) AT TIME ZONE 'UTC')::date,
+                    (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '{MONTHS_AHEAD} months')::date,
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF movement_events FOR VALUES FROM (%L) TO (%L)',
+                    'movement_events_p' || to_char(m, 'YYYYMM'),
+                    m::timestamp AT TIME ZONE 'UTC',
+                    (m + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute("CREATE TABLE movement_events_default PARTITION OF movement_events DEFAULT")
+
+    op.execute(
+        """
+        INSERT INTO movement_events
+            (id, message_id, movement_id, warehouse_id, product_id, timestamp, event, quantity)
+        SELECT id, message_id, movement_id, warehouse_id, product_id, timestamp, event, quantity
+        FROM movement_events_legacy
+        """
+    )
+
+    op.execute(
+        """
+        CREATE TABLE movement_event_keys (
+            message_id UUID NOT NULL,
+            movement_id UUID NOT NULL,
+            event VARCHAR NOT NULL,
+            CONSTRAINT movement_events_message_id_key PRIMARY KEY (message_id),
+            CONSTRAINT uix_movement_id_event_type UNIQUE (movement_id, event)
+        )
+        """
+    )
+    op.execute(
+        "INSERT INTO movement_event_keys (message_id, movement_id, event) "
+        "SELECT message_id, movement_id, event FROM movement_events_legacy"
+    )
+
+    op.execute("DROP TABLE movement_events_legacy")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE movement_events RENAME TO movement_events_partitioned")
+    op.execute("ALTER TABLE movement_events_partitioned DROP CONSTRAINT movement_events_pkey")
+    op.execute("DROP INDEX ix_movement_events_warehouse_product")
+    op.execute("DROP INDEX ix_movement_events_movement")
+    op.execute("DROP TABLE movement_event_keys")
+    op.execute("ALTER SEQUENCE movement_events_id_seq OWNED BY NONE")
+
+    op.execute(
+        """
+        CREATE TABLE movement_events (
+            id INTEGER NOT NULL DEFAULT nextval('movement_events_id_seq'),
+            message_id UUID NOT NULL,
+            movement_id UUID NOT NULL,
+            warehouse_id UUID NOT NULL,
+            product_id UUID NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            event VARCHAR NOT NULL,
+            quantity INTEGER NOT NULL,
+            CONSTRAINT movement_events_pkey PRIMARY KEY (id),
+            CONSTRAINT movement_events_message_id_key UNIQUE (message_id),
+            CONSTRAINT uix_movement_id_event_type UNIQUE (movement_id, event)
+        )
+        """
+    )
+    op.execute("ALTER SEQUENCE movement_events_id_seq OWNED BY movement_events.id")
+    op.execute(
+        "INSERT INTO movement_events "
+        "SELECT id, message_id, movement_id, warehouse_id, product_id, timestamp, event, quantity "
+        "FROM movement_events_partitioned"
+    )
+    op.execute(
+        "CREATE INDEX ix_movement_events_warehouse_product "
+        "ON movement_events (warehouse_id, product_id) INCLUDE (event, quantity)"
+    )
+    # партиции удаляются вместе с родительской таблицей
+    op.execute("DROP TABLE movement_events_partitioned")
@@ -0,0 +1,67 @@
+"""movements table
+
+Revision ID: 5c1e7b9d2f40
+Revises: a18f60a1a5e2
+Create Date: 2026-10-18 16:02:37.518904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e7b9d2f40'
+down_revision: Union[str, None] = 'a18f60a1a5e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('movements',
+    sa.Column('movement_id', sa.Uuid(), nullable=False),
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('sender_warehouse', sa.Uuid(), nullable=True),
+    sa.Column('receiver_warehouse', sa.Uuid(), nullable=True),
+    sa.Column('departure_time', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('arrival_time', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('quantity_departed', sa.Integer(), nullable=True),
+    sa.Column('quantity_arrived', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(), sa.Computed(
+        "CASE WHEN departure_time IS NULL THEN 'awaiting_departure' "
+        "WHEN arrival_time IS NULL THEN 'in_transit' ELSE 'completed' END",
+        persisted=True,
+    ), nullable=False),
+    sa.PrimaryKeyConstraint('movement_id')
+    )
+    # заполняем по уже накопленной истории: на перемещение не больше одного события каждого типа
+    op.execute(
+        """
+        INSERT INTO movements (movement_id, product_id,
+                               sender_warehouse, departure_time, quantity_departed,
+                               receiver_warehouse, arrival_time, quantity_arrived)
+        SELECT movement_id,
+               (array_agg(product_id))[1],
+               (array_agg(warehouse_id) FILTER (WHERE event = 'departure'))[1],
+               max(timestamp) FILTER (WHERE event = 'departure'),
+               max(quantity) FILTER (WHERE event = 'departure'),
+               (array_agg(warehouse_id) FILTER (WHERE event = 'arrival'))[1],
+               max(timestamp) FILTER (WHERE event = 'arrival'),
+               max(quantity) FILTER (WHERE event = 'arrival')
+        FROM movement_events
+        GROUP BY movement_id
+        """
+    )
+    op.create_index('ix_movements_sender', 'movements',
+                    ['sender_warehouse', 'departure_time', 'movement_id'], unique=False)
+    op.create_index('ix_movements_receiver', 'movements',
+                    ['receiver_warehouse', 'departure_time', 'movement_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_movements_receiver', table_name='movements')
+    op.drop_index('ix_movements_sender', table_name='movements')
+    op.drop_table('movements')
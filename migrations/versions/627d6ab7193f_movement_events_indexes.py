@@ -0,0 +1,76 @@
+"""movement_events indexes and (movement_id, event) unique constraint
+
+Revision ID: 627d6ab7193f
+Revises: 9d06029ff017
+Create Date: 2026-10-18 11:32:47.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '627d6ab7193f'
+down_revision: Union[str, None] = '9d06029ff017'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _ensure_no_duplicates() -> None:
+    duplicates = op.get_bind().execute(sa.text(
+        """
+        SELECT count(*) FROM (
+            SELECT 1 FROM movement_events
+            GROUP BY movement_id, event
+            HAVING count(*) > 1
+        ) AS d
+        """
+    )).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f"movement_events has {duplicates} duplicated (movement_id, event) pairs, "
+            "remove them before applying this migration"
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # без ограничения в БД могли накопиться повторы — уникальный индекс на них не построится
+    if not context.is_offline_mode():
+        _ensure_no_duplicates()
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции.
+    # Если построение прервётся, останется INVALID-индекс: его нужно удалить и повторить миграцию.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_movement_events_warehouse_product', 'movement_events',
+            ['warehouse_id', 'product_id'],
+            postgresql_include=['event', 'quantity'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'uix_movement_id_event_type', 'movement_events',
+            ['movement_id', 'event'],
+            unique=True,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+    # ограничение поверх уже построенного индекса — без повторного сканирования таблицы
+    op.execute(
+        "ALTER TABLE movement_events "
+        "ADD CONSTRAINT uix_movement_id_event_type UNIQUE USING INDEX uix_movement_id_event_type"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uix_movement_id_event_type', 'movement_events', type_='unique')
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_movement_events_warehouse_product', table_name='movement_events',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,44 @@
+"""dead_letters
+
+Revision ID: 7f3d0c5e8a21
+Revises: e4b2a7c9d158
+Create Date: 2026-10-18 18:40:12.027715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f3d0c5e8a21'
+down_revision: Union[str, None] = 'e4b2a7c9d158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('dead_letters',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('topic', sa.String(), nullable=False),
+    sa.Column('partition', sa.Integer(), nullable=False),
+    sa.Column('offset', sa.BigInteger(), nullable=False),
+    sa.Column('key', sa.String(), nullable=True),
+    sa.Column('payload', sa.String(), nullable=False),
+    sa.Column('error_class', sa.String(), nullable=False),
+    sa.Column('error', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('failed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('replayed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('topic', 'partition', 'offset', name='uix_dead_letters_offset')
+    )
+    op.create_index('ix_dead_letters_error_class', 'dead_letters', ['error_class', 'failed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_dead_letters_error_class', table_name='dead_letters')
+    op.drop_table('dead_letters')
@@ -0,0 +1,44 @@
+"""stock_balances projection
+
+Revision ID: 9d06029ff017
+Revises: c7d98583d62a
+Create Date: 2026-10-18 10:05:12.418223
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d06029ff017'
+down_revision: Union[str, None] = 'c7d98583d62a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('stock_balances',
+    sa.Column('warehouse_id', sa.Uuid(), nullable=False),
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('quantity', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('warehouse_id', 'product_id')
+    )
+    # заполняем проекцию по уже накопленной истории событий
+    op.execute(
+        """
+        INSERT INTO stock_balances (warehouse_id, product_id, quantity)
+        SELECT warehouse_id,
+               product_id,
+               SUM(CASE WHEN event = 'arrival' THEN quantity ELSE -quantity END)
+        FROM movement_events
+        GROUP BY warehouse_id, product_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('stock_balances')
@@ -0,0 +1,35 @@
+"""stock_snapshots
+
+Revision ID: a18f60a1a5e2
+Revises: 34891c155278
+Create Date: 2026-10-18 14:21:09.671240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a18f60a1a5e2'
+down_revision: Union[str, None] = '34891c155278'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # первичный ключ (warehouse_id, product_id, taken_at) покрывает поиск ближайшего снимка
+    op.create_table('stock_snapshots',
+    sa.Column('warehouse_id', sa.Uuid(), nullable=False),
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('quantity', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('warehouse_id', 'product_id', 'taken_at')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('stock_snapshots')
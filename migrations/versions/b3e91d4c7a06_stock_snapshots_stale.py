@@ -0,0 +1,37 @@
+"""stock_snapshots stale flag
+
+Revision ID: b3e91d4c7a06
+Revises: 7f3d0c5e8a21
+Create Date: 2026-10-18 21:05:37.418902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e91d4c7a06'
+down_revision: Union[str, None] = '7f3d0c5e8a21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # опоздавшее событие помечает снимки stale вместо удаления: задача снимков находит такие пары
+    # по частичному индексу и пересчитывает их, даже если по паре больше нет движения
+    op.add_column('stock_snapshots',
+                  sa.Column('stale', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.create_index('ix_stock_snapshots_taken_at', 'stock_snapshots', ['taken_at'])
+    op.create_index('ix_stock_snapshots_stale', 'stock_snapshots', ['warehouse_id', 'product_id'],
+                    postgresql_where=sa.text('stale'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM stock_snapshots WHERE stale")
+    op.drop_index('ix_stock_snapshots_stale', table_name='stock_snapshots')
+    op.drop_index('ix_stock_snapshots_taken_at', table_name='stock_snapshots')
+    op.drop_column('stock_snapshots', 'stale')
@@ -0,0 +1,34 @@
+"""stock_baselines
+
+Revision ID: d5a2c8e1f934
+Revises: b3e91d4c7a06
+Create Date: 2026-10-19 10:12:44.205318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a2c8e1f934'
+down_revision: Union[str, None] = 'b3e91d4c7a06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # сумма отсоединённой истории: check_stock и снимки прибавляют её к оставшимся событиям
+    op.create_table('stock_baselines',
+    sa.Column('warehouse_id', sa.Uuid(), nullable=False),
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('quantity', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('warehouse_id', 'product_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('stock_baselines')
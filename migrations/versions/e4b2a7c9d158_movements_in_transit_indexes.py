@@ -0,0 +1,48 @@
+"""movements in-transit partial indexes
+
+Revision ID: e4b2a7c9d158
+Revises: 5c1e7b9d2f40
+Create Date: 2026-10-18 17:21:09.341862
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b2a7c9d158'
+down_revision: Union[str, None] = '5c1e7b9d2f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции.
+    # Если построение прервётся, останется INVALID-индекс: его нужно удалить и повторить миграцию.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_movements_in_transit', 'movements',
+            ['departure_time', 'movement_id'],
+            postgresql_where=sa.text("status = 'in_transit'"),
+            postgresql_include=['quantity_departed'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_movements_in_transit_sender', 'movements',
+            ['sender_warehouse', 'departure_time', 'movement_id'],
+            postgresql_where=sa.text("status = 'in_transit'"),
+            postgresql_include=['quantity_departed'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_movements_in_transit_sender', table_name='movements', postgresql_concurrently=True)
+        op.drop_index('ix_movements_in_transit', table_name='movements', postgresql_concurrently=True)
@@ -0,0 +1,48 @@
+from datetime import date, datetime, timezone
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import text
+
+from warehouse_service.db import _engine
+from warehouse_service.devtools.partitions import create_partition, detach, list_partitions, partition_name
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_detach_moves_old_month_to_archive_schema():
+    month = date(2000, 1, 1)
+    name = partition_name(month)
+    warehouse_id, product_id = uuid4(), uuid4()
+    async with _engine.begin() as conn:
+        await create_partition(conn, month)
+        for event, quantity in (("arrival", 10), ("departure", 3)):
+            await conn.execute(text(
+                "INSERT INTO movement_events (message_id, movement_id, warehouse_id, product_id, timestamp, event, quantity) "
+                "VALUES (:message_id, :movement_id, :warehouse_id, :product_id, :timestamp, :event, :quantity)"
+            ), {"message_id": uuid4(), "movement_id": uuid4(), "warehouse_id": warehouse_id, "product_id": product_id,
+                "timestamp": datetime(2000, 1, 15, tzinfo=timezone.utc), "event": event, "quantity": quantity})
+
+    # cutoff — февраль 2000: отсоединяется только созданный месяц
+    now = datetime.now(timezone.utc)
+    older_than = now.year * 12 + now.month - (2000 * 12 + 2)
+    try:
+        detached = await detach(older_than, "archive_test", drop=False)
+
+        assert detached == [name]
+        async with _engine.connect() as conn:
+            assert name not in await list_partitions(conn)
+            archived = await conn.scalar(
+                text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f"archive_test.{name}"},
+            )
+            baseline = await conn.scalar(
+                text("SELECT quantity FROM stock_baselines WHERE warehouse_id = :w AND product_id = :p"),
+                {"w": warehouse_id, "p": product_id},
+            )
+        assert archived
+        # отсоединённая история остаётся в сверке суммой
+        assert baseline == 7
+    finally:
+        async with _engine.begin() as conn:
+            await conn.execute(text("DELETE FROM stock_baselines WHERE warehouse_id = :w"), {"w": warehouse_id})
+            await conn.exec_driver_sql("DROP SCHEMA IF EXISTS archive_test CASCADE")
+            await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
@@ -0,0 +1,121 @@
+import io
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+import pytest
+
+from kafka_utils.bulk_load import STAGING_COLUMNS, handle_bulk, read_chunks
+from warehouse_service.cache import movement_cache_key, stock_cache_key
+from warehouse_service.schemas import KafkaEnvelope
+
+
+def _envelope(event="arrival", movement_id=None):
+    return {
+        "id": str(uuid4()), "source": "WH-1", "specversion": "1.0", "type": "t", "datacontenttype": "application/json",
+        "dataschema": "s", "time": 1, "subject": "WH-1:ARRIVAL", "destination": "d",
+        "data": {
+            "movement_id": str(movement_id or uuid4()), "warehouse_id": str(uuid4()), "product_id": str(uuid4()),
+            "timestamp": datetime.now(timezone.utc).isoformat(), "event": event, "quantity": 3,
+        },
+    }
+
+
+def _result(**attrs):
+    result = MagicMock()
+    for name, value in attrs.items():
+        setattr(result, name, MagicMock(return_value=value))
+    return result
+
+
+def _bulk_db(counts, balances=(), movement_ids=(), skipped=()):
+    db = AsyncMock()
+    driver = SimpleNamespace(copy_records_to_table=AsyncMock())
+    connection = AsyncMock()
+    connection.get_raw_connection.return_value = SimpleNamespace(driver_connection=driver)
+    db.connection.return_value = connection
+    movements = _result()
+    movements.scalars.return_value.all.return_value = list(movement_ids)
+    db.execute.side_effect = [
+        MagicMock(), MagicMock(), MagicMock(),                        # временные таблицы, merge
+        _result(one=SimpleNamespace(**counts)),
+        _result(all=[SimpleNamespace(warehouse_id=wh, product_id=product, quantity=qty)
+                     for wh, product, qty in balances]),
+        MagicMock(),                                                  # upsert перемещений
+        MagicMock(),                                                  # сброс снимков
+        movements,
+        [SimpleNamespace(_asdict=lambda row=row: row) for row in skipped],
+    ]
+    return db, driver
+
+
+def _redis_backend():
+    backend = MagicMock()
+    pipe = MagicMock(execute=AsyncMock())
+    backend.redis.pipeline.return_value.__aenter__.return_value = pipe
+    return backend, pipe
+
+
+@pytest.mark.asyncio
+async def test_handle_bulk_copies_merges_and_updates_cache():
+    first, repeated = KafkaEnvelope(**_envelope()), KafkaEnvelope(**_envelope("departure"))
+    data = first.data
+    db, driver = _bulk_db(
+        {"received": 2, "inserted": 1, "known": 2},
+        balances=[(data.warehouse_id, data.product_id, 3)],
+        movement_ids=[data.movement_id],
+        skipped=[{"movement_id": repeated.data.movement_id, "warehouse_id": repeated.data.warehouse_id,
+                  "product_id": repeated.data.product_id}],
+    )
+    backend, pipe = _redis_backend()
+
+    result = await handle_bulk([first, repeated], db, backend)
+
+    assert (result.received, result.inserted, result.duplicates, result.conflicts) == (2, 1, 1, 0)
+    table, = driver.copy_records_to_table.await_args.args
+    records = driver.copy_records_to_table.await_args.kwargs["records"]
+    assert table == "bulk_staging"
+    assert driver.copy_records_to_table.await_args.kwargs["columns"] == STAGING_COLUMNS
+    assert records[0] == (first.id, data.movement_id, data.warehouse_id, data.product_id,
+                          data.timestamp, "arrival", 3)
+    db.commit.assert_awaited_once()
+
+    written = {call.args[0] for call in pipe.set.call_args_list}
+    deleted = {call.args[0] for call in pipe.delete.call_args_list}
+    assert stock_cache_key(data.warehouse_id, data.product_id) in written
+    # перемещение без второго события удаляется, ключи повтора сбрасываются
+    assert deleted == {movement_cache_key(data.movement_id), movement_cache_key(repeated.data.movement_id),
+                       stock_cache_key(repeated.data.warehouse_id, repeated.data.product_id)}
+
+
+@pytest.mark.asyncio
+async def test_handle_bulk_without_new_rows_skips_projection():
+    db, _ = _bulk_db({"received": 1, "inserted": 0, "known": 0})
+    db.execute.side_effect = list(db.execute.side_effect)[:4] + [[]]
+
+    result = await handle_bulk([KafkaEnvelope(**_envelope())], db, None)
+
+    assert (result.inserted, result.duplicates, result.conflicts) == (0, 0, 1)
+    # временные таблицы, merge, счётчики, пропущенные строки
+    assert db.execute.await_count == 5
+
+
+def test_read_chunks_splits_and_counts_invalid_lines():
+    lines = [json.dumps(_envelope()) for _ in range(5)]
+    lines.insert(2, '{"id": "broken"}')
+    lines.insert(4, "")
+    source = io.BytesIO("\n".join(lines).encode())
+
+    chunks = list(read_chunks(source, chunk_size=2))
+
+    assert [(len(envelopes), invalid) for envelopes, invalid, _ in chunks] == [(2, 0), (2, 1), (1, 0)]
+    # смещение после порции — начало следующей строки, с него загрузка продолжается
+    resume = chunks[0][2]
+    assert source.getvalue()[resume - 1:resume] == b"\n"
+    source.seek(resume)
+    rest = list(read_chunks(source, chunk_size=2, start=resume))
+    assert [(len(envelopes), invalid, offset) for envelopes, invalid, offset in rest] == [
+        (len(envelopes), invalid, offset) for envelopes, invalid, offset in chunks[1:]
+    ]
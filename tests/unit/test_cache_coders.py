@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import pytest
+from fastapi.responses import JSONResponse
+from fastapi_cache.coder import JsonCoder
+
+from warehouse_service import cache
+from warehouse_service.cache_coders import BinaryCoder
+from warehouse_service.cache_storage import BucketStorage
+from warehouse_service.schemas import MovementResponse, StockResponse
+
+
+def _movement(quantity_arrived=90):
+    departed = datetime(2026, 5, 1, 8, 30, 15, 123456, tzinfo=timezone.utc)
+    arrived = departed + timedelta(hours=3, seconds=7)
+    return MovementResponse(
+        movement_id=uuid4(), sender_warehouse=uuid4(), receiver_warehouse=uuid4(),
+        departure_time=departed, arrival_time=arrived,
+        quantity_departed=100, quantity_arrived=quantity_arrived,
+        quantity_difference=quantity_arrived - 100,
+        transit_seconds=int((arrived - departed).total_seconds()),
+    )
+
+
+@pytest.mark.parametrize("quantity", [0, 1, 63, 64, 300, 2**31, -1, -2**40])
+def test_stock_round_trip(quantity):
+    stock = StockResponse(warehouse_id=uuid4(), product_id=uuid4(), quantity=quantity)
+
+    encoded = BinaryCoder.encode(stock)
+
+    assert StockResponse.model_validate(BinaryCoder.decode(encoded)) == stock
+    assert len(encoded) < len(JsonCoder.encode(stock)) / 2
+
+
+def test_movement_round_trip():
+    movement = _movement()
+
+    encoded = BinaryCoder.encode(movement)
+
+    assert MovementResponse.model_validate(BinaryCoder.decode(encoded)) == movement
+    assert len(encoded) < len(JsonCoder.encode(movement)) / 3
+
+
+def test_other_values_fall_back_to_json():
+    not_found = JSONResponse(status_code=404, content={"detail": "Movement incomplete or not found"})
+
+    assert BinaryCoder.encode(not_found) == not_found.body
+    assert BinaryCoder.decode(BinaryCoder.encode(not_found)) == {"detail": "Movement incomplete or not found"}
+
+
+def test_reads_entries_written_by_json_coder():
+    stock = StockResponse(warehouse_id=uuid4(), product_id=uuid4(), quantity=5)
+
+    assert StockResponse.model_validate(BinaryCoder.decode(JsonCoder.encode(stock))) == stock
+
+
+def test_bucket_storage_keeps_deadline_in_value():
+    storage = BucketStorage(buckets=64)
+    pipe = MagicMock()
+
+    storage.set(pipe, "k", b"payload", expire=90)
+
+    bucket, field, raw = pipe.hset.call_args.args
+    assert bucket == storage.bucket("k") and field == "k"
+    pipe.expire.assert_called_once_with(bucket, 90)
+    ttl, value = storage._unpack(raw)
+    assert value == b"payload" and 89 <= ttl <= 90
+
+
+def test_bucket_storage_expired_field_is_a_miss():
+    storage = BucketStorage(buckets=64)
+    expired = (0).to_bytes(4, "big") + b"payload"
+
+    assert storage._unpack(expired) == (-2, None)
+    assert storage._unpack(None) == (-2, None)
+
+
+
+def test_hashed_keys_are_short_and_stable(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_HASH_KEYS", True)
+    warehouse_id, product_id = uuid4(), uuid4()
+
+    key = cache.stock_cache_key(warehouse_id, product_id)
+
+    assert key == cache.stock_cache_key(warehouse_id, product_id)
+    assert key != cache.stock_cache_key(product_id, warehouse_id)
+    assert key.startswith("k:") and len(key) == 18
@@ -0,0 +1,222 @@
+import asyncio
+
+import pytest
+from fastapi_cache import FastAPICache
+from fastapi_cache.coder import JsonCoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from warehouse_service.cache import cache_expire
+from warehouse_service.cache_layer import StampedeGuard, cached, coalesced_waits, stale_served
+from warehouse_service.config import CACHE_STALE_TTL, CACHE_TTL_JITTER
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.locks = {}
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.locks:
+            return None
+        self.locks[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token):
+        if self.locks.get(key) == token:
+            del self.locks[key]
+
+
+class _FakeBackend:
+    def __init__(self):
+        self.redis = _FakeRedis()
+        self.values = {}   # ключ -> (ttl, значение)
+
+    async def get_with_ttl(self, key):
+        return self.values.get(key, (-2, None))
+
+    async def get(self, key):
+        return self.values.get(key, (-2, None))[1]
+
+    async def set(self, key, value, expire=None):
+        self.values[key] = (expire, value)
+
+
+def _counter(compute_value, delay=0.01):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return compute_value
+
+    return compute, calls
+
+
+def _sample(metric, **labels):
+    return metric.labels(**labels)._value.get() if labels else metric._value.get()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_hit_db_once():
+    backend, guard = _FakeBackend(), StampedeGuard()
+    compute, calls = _counter({"quantity": 5})
+    waits_before = _sample(coalesced_waits, scope="process")
+
+    results = await asyncio.gather(*(
+        guard.fetch(backend, ":k", compute, JsonCoder, ttl=60) for _ in range(10)
+    ))
+
+    assert len(calls) == 1
+    assert [status for status, _ in results].count("MISS") == 1
+    assert all(value == {"quantity": 5} for _, value in results)
+    assert _sample(coalesced_waits, scope="process") - waits_before == 9
+    assert not backend.redis.locks
+
+
+@pytest.mark.asyncio
+async def test_fresh_value_is_a_hit():
+    backend, guard = _FakeBackend(), StampedeGuard()
+    backend.values[":k"] = (CACHE_STALE_TTL + 10, JsonCoder.encode({"quantity": 1}))
+    compute, calls = _counter({"quantity": 2})
+
+    assert await guard.fetch(backend, ":k", compute, JsonCoder, ttl=60) == ("HIT", {"quantity": 1})
+    assert not calls
+
+
+@pytest.mark.asyncio
+async def test_stale_value_served_while_other_process_refreshes():
+    backend, guard = _FakeBackend(), StampedeGuard()
+    backend.values[":k"] = (CACHE_STALE_TTL - 1, JsonCoder.encode({"quantity": 1}))
+    backend.redis.locks["lock::k"] = "other-process"
+    compute, calls = _counter({"quantity": 2})
+    stale_before = _sample(stale_served)
+
+    assert await guard.fetch(backend, ":k", compute, JsonCoder, ttl=60) == ("STALE", {"quantity": 1})
+    assert not calls
+    assert _sample(stale_served) - stale_before == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_value_refreshed_by_lock_holder():
+    backend, guard = _FakeBackend(), StampedeGuard()
+    backend.values[":k"] = (CACHE_STALE_TTL - 1, JsonCoder.encode({"quantity": 1}))
+    compute, calls = _counter({"quantity": 2})
+
+    assert await guard.fetch(backend, ":k", compute, JsonCoder, ttl=60) == ("MISS", {"quantity": 2})
+    assert backend.values[":k"][0] > CACHE_STALE_TTL
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_miss_waits_for_other_process():
+    backend, guard = _FakeBackend(), StampedeGuard(lock_lease_ms=1000, poll_interval=0.005)
+    backend.redis.locks["lock::k"] = "other-process"
+    compute, calls = _counter({"quantity": 2})
+
+    async def other_process_fills():
+        await asyncio.sleep(0.02)
+        await backend.set(":k", JsonCoder.encode({"quantity": 7}), 90)
+
+    filler = asyncio.create_task(other_process_fills())
+    status, value = await guard.fetch(backend, ":k", compute, JsonCoder, ttl=60)
+    await filler
+
+    assert (status, value) == ("HIT", {"quantity": 7})
+    assert not calls
+
+
+@pytest.mark.asyncio
+async def test_miss_computes_after_lease_expires():
+    backend, guard = _FakeBackend(), StampedeGuard(lock_lease_ms=30, poll_interval=0.005)
+    backend.redis.locks["lock::k"] = "dead-process"
+    compute, calls = _counter({"quantity": 3})
+
+    assert await guard.fetch(backend, ":k", compute, JsonCoder, ttl=60) == ("MISS", {"quantity": 3})
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_leader_lets_waiters_compute():
+    backend, guard = _FakeBackend(), StampedeGuard()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("db down")
+
+    compute, calls = _counter({"quantity": 4})
+    leader = asyncio.create_task(guard.fetch(backend, ":k", failing, JsonCoder, ttl=60))
+    await asyncio.sleep(0)
+    waiter = await guard.fetch(backend, ":k", compute, JsonCoder, ttl=60)
+
+    with pytest.raises(RuntimeError):
+        await leader
+    assert waiter == ("MISS", {"quantity": 4})
+
+
+
+def _get(path, headers=()):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"",
+                    "headers": [(name.encode(), value.encode()) for name, value in headers]})
+
+
+def _init_cache(monkeypatch, backend):
+    for name, value in {
+        "_backend": backend, "_coder": JsonCoder, "_enable": True, "_cache_status_header": "X-FastAPI-Cache",
+        "_key_builder": lambda func, namespace, *, request, **kwargs: request.url.path,
+    }.items():
+        monkeypatch.setattr(FastAPICache, name, value)
+
+
+@pytest.mark.asyncio
+async def test_cached_endpoint_answers_304_to_matching_etag(monkeypatch):
+    backend = _FakeBackend()
+    _init_cache(monkeypatch, backend)
+    compute, calls = _counter({"quantity": 7})
+
+    @cached(expire=60)
+    async def endpoint():
+        return await compute()
+
+    first = Response()
+    assert await endpoint(request=_get("/k"), response=first) == {"quantity": 7}
+    tag = first.headers["etag"]
+    assert tag.startswith("W/")
+    assert first.headers["cache-control"] == "max-age=60"
+
+    again = await endpoint(request=_get("/k", [("if-none-match", tag)]), response=Response())
+    assert again.status_code == 304
+    assert again.headers["etag"] == tag
+    assert len(calls) == 1
+
+    other = await endpoint(request=_get("/k", [("if-none-match", 'W/"other"')]), response=Response())
+    assert other == {"quantity": 7}
+
+
+
+@pytest.mark.asyncio
+async def test_no_cache_request_recomputes_and_overwrites_entry(monkeypatch):
+    backend = _FakeBackend()
+    _init_cache(monkeypatch, backend)
+    backend.values["/k"] = (CACHE_STALE_TTL + 10, JsonCoder.encode({"quantity": 1}))
+    compute, calls = _counter({"quantity": 2})
+
+    @cached(expire=60)
+    async def endpoint():
+        return await compute()
+
+    response = Response()
+    fresh = await endpoint(request=_get("/k", [("cache-control", "no-cache")]), response=response)
+
+    assert fresh == {"quantity": 2} and len(calls) == 1
+    assert response.headers["x-fastapi-cache"] == "MISS"
+    # следующий обычный запрос читает уже обновлённую запись
+    assert await endpoint(request=_get("/k"), response=Response()) == {"quantity": 2}
+    assert len(calls) == 1
+
+def test_cache_expire_jitter_and_stale_window():
+    values = {cache_expire(100) for _ in range(200)}
+
+    low = round(100 * (1 - CACHE_TTL_JITTER)) + CACHE_STALE_TTL
+    high = round(100 * (1 + CACHE_TTL_JITTER)) + CACHE_STALE_TTL
+    assert all(low <= value <= high for value in values)
+    assert len(values) > 1
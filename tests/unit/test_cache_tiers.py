@@ -0,0 +1,93 @@
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from warehouse_service.cache_tiers import LocalCache, TieredBackend, lookups
+
+
+def _message(*keys):
+    return {"type": "message", "data": json.dumps(keys).encode()}
+
+
+def _backend(ttl=100, value=b"v"):
+    redis_backend = MagicMock()
+    redis_backend.get_with_ttl = AsyncMock(return_value=(ttl, value))
+    redis_backend.set = AsyncMock()
+    tiered = TieredBackend(redis_backend, LocalCache(max_bytes=10_000, max_ttl=5), stale_ttl=30)
+    tiered.subscribed = True
+    return tiered, redis_backend
+
+
+def _hits(tier):
+    return lookups.labels(tier, "hit")._value.get()
+
+
+def test_local_cache_evicts_least_recently_used_by_size():
+    local = LocalCache(max_bytes=3 * (1 + 100 + 128), max_ttl=5)
+    for key in "abc":
+        local.set(key, b"x" * 100, redis_ttl=100, stale_ttl=30)
+    local.get("a")
+    local.set("d", b"x" * 100, redis_ttl=100, stale_ttl=30)
+
+    assert local.get("b") is None
+    assert all(local.get(key) is not None for key in "acd")
+    assert local.size <= local.max_bytes
+
+
+def test_local_cache_skips_values_about_to_go_stale():
+    local = LocalCache(max_bytes=10_000, max_ttl=5)
+    local.set("k", b"v", redis_ttl=30, stale_ttl=30)
+
+    assert local.get("k") is None
+    assert len(local) == 0
+
+
+@pytest.mark.asyncio
+async def test_second_read_is_served_from_l1():
+    tiered, redis_backend = _backend()
+    l1_before = _hits("l1")
+
+    assert await tiered.get_with_ttl("k") == (100, b"v")
+    ttl, value = await tiered.get_with_ttl("k")
+
+    assert value == b"v" and 95 <= ttl <= 100
+    redis_backend.get_with_ttl.assert_awaited_once()
+    assert _hits("l1") - l1_before == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidation_message_drops_key():
+    tiered, redis_backend = _backend()
+    await tiered.get_with_ttl("k")
+
+    tiered._apply(_message("k", "other"))
+    await tiered.get_with_ttl("k")
+
+    assert redis_backend.get_with_ttl.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_value_read_before_invalidation_is_not_cached():
+    tiered, redis_backend = _backend()
+
+    async def invalidated_meanwhile(key):
+        tiered._apply(_message(key))
+        return 100, b"old"
+
+    redis_backend.get_with_ttl.side_effect = invalidated_meanwhile
+    assert await tiered.get_with_ttl("k") == (100, b"old")
+
+    assert len(tiered.local) == 0
+
+
+@pytest.mark.asyncio
+async def test_l1_bypassed_without_subscription():
+    tiered, redis_backend = _backend()
+    tiered.subscribed = False
+
+    await tiered.get_with_ttl("k")
+    await tiered.get_with_ttl("k")
+
+    assert redis_backend.get_with_ttl.await_count == 2
+    assert len(tiered.local) == 0
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from warehouse_service.devtools.check_stock import fix_deltas, mismatches_stmt
+from warehouse_service.services.stock import upsert_balances_stmt
+
+
+def test_fix_applies_difference_not_absolute_value():
+    wh, product = uuid4(), uuid4()
+    rows = [
+        SimpleNamespace(warehouse_id=wh, product_id=product, expected=10, actual=7),
+        SimpleNamespace(warehouse_id=uuid4(), product_id=uuid4(), expected=0, actual=4),
+    ]
+
+    deltas = fix_deltas(rows)
+
+    assert {(d["warehouse_id"], d["product_id"]): d["quantity"] for d in deltas}[(wh, product)] == 3
+    assert sorted(d["quantity"] for d in deltas) == [-4, 3]
+    sql = str(upsert_balances_stmt(deltas).compile(dialect=postgresql.dialect()))
+    # сумма с текущим значением строки: дельта consumer'а между чтением и записью не теряется
+    assert "SET quantity = (stock_balances.quantity + excluded.quantity)" in sql
+
+
+def test_mismatches_include_detached_history():
+    sql = str(mismatches_stmt().compile(dialect=postgresql.dialect()))
+
+    assert "FROM stock_baselines" in sql
+    assert "UNION ALL" in sql
@@ -1,3 +1,5 @@
+import asyncio
+import json
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from types import SimpleNamespace
@@ -5,12 +7,17 @@ from unittest.mock import AsyncMock, patch
 from uuid import uuid4
 
 import pytest
+from aiokafka import TopicPartition
 
 from kafka_utils import consumer
-from warehouse_service.schemas import KafkaEnvelope
+from kafka_utils.db import BatchResult, _event_values
+from kafka_utils.offsets import OffsetCommitter, OffsetTracker
+from kafka_utils.pool import KeyedWorkerPool
+from kafka_utils.producer import partition_key
+from warehouse_service.schemas import KafkaEnvelope, KafkaEventRecord
 
 
-def _raw_msg():
+def _raw_msg(offset: int = 0):
     """Сообщение такого же формата, какой кладёт Producer."""
     body = {
         "movement_id": uuid4(),
@@ -32,7 +39,8 @@ def _raw_msg():
         "destination": "ru.retail.w",
         "data": body,
     }
-    return SimpleNamespace(value=envelope)  # value уже dict – именно это ждёт consumer
+    # value уже dict – именно это ждёт consumer
+    return SimpleNamespace(value=envelope, topic="t", partition=0, offset=offset)
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -54,3 +62,196 @@ async def test_process_message_calls_handle_event(monkeypatch):
         env = he.await_args.args[0]
         assert isinstance(env, KafkaEnvelope)
         assert env.data.event == "arrival"
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_process_batch_skips_invalid_envelopes(monkeypatch):
+    broken = SimpleNamespace(value={"id": "not-a-uuid"})
+    messages = [_raw_msg(), broken, _raw_msg()]
+
+    fake_session = AsyncMock()
+
+    @asynccontextmanager
+    async def _ctx():
+        yield fake_session
+
+    monkeypatch.setattr(consumer, "SessionLocal", _ctx)
+    dead_letter = AsyncMock(return_value=True)
+    monkeypatch.setattr(consumer, "record_dead_letter", dead_letter)
+
+    with patch.object(consumer, "handle_batch",
+                      new=AsyncMock(return_value=BatchResult(received=2, inserted=2))) as hb:
+        result = await consumer.process_batch(messages)
+
+    envelopes = hb.await_args.args[0]
+    assert len(envelopes) == 2
+    assert all(isinstance(env, KafkaEnvelope) for env in envelopes)
+    assert (result.received, result.inserted, result.invalid, result.dead_letters) == (3, 2, 1, 1)
+    assert dead_letter.await_args.args[0] is broken
+
+
+class _FakeConsumer:
+    """getmany() отдаёт заранее заготовленные порции сообщений."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.calls = []
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        self.calls.append(max_records)
+        if not self.chunks:
+            return {}
+        chunk = self.chunks.pop(0)
+        return {"tp": chunk[:max_records]}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_collect_batch_respects_max_records():
+    fake = _FakeConsumer([[1, 2], [3, 4, 5], [6]])
+
+    batch = await consumer.collect_batch(fake, max_records=4, linger_ms=1000)
+
+    assert batch == [1, 2, 3, 4]
+    assert fake.calls == [4, 2]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_collect_batch_stops_after_linger():
+    fake = _FakeConsumer([[1]])
+
+    batch = await consumer.collect_batch(fake, max_records=100, linger_ms=0)
+
+    assert batch == [1]
+
+
+class _StopLoop(Exception):
+    pass
+
+
+class _PausableConsumer:
+    def __init__(self, messages):
+        self.messages = messages
+        self.paused = []
+        self.resumed = []
+        self.committed = []
+        self.seeks = []
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        if not self.messages:
+            raise _StopLoop
+        messages = self.messages.pop(0)
+        return {"tp": messages}
+
+    def assignment(self):
+        return {TopicPartition("t", 0)}
+
+    async def commit(self, offsets):
+        self.committed.append(offsets)
+
+    def pause(self, *partitions):
+        self.paused.append(partitions)
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp, offset))
+
+    def resume(self, *partitions):
+        self.resumed.append(partitions)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_message_loop_pauses_fetching_when_pool_is_full(monkeypatch):
+    fake = _PausableConsumer([[_raw_msg(offset) for offset in range(6)]])
+    pool = KeyedWorkerPool(max_in_flight=2)
+    committer = OffsetCommitter(fake, OffsetTracker(), interval_ms=0)
+
+    async def slow_process(msg):
+        await asyncio.sleep(0.001)
+        return True
+
+    monkeypatch.setattr(consumer, "process_message", slow_process)
+
+    with pytest.raises(_StopLoop):
+        await consumer.run_message_loop(fake, pool, committer)
+    await pool.drain()
+    await committer.commit()
+
+    assert fake.paused and len(fake.paused) == len(fake.resumed)
+    assert fake.committed[-1] == {TopicPartition("t", 0): 6}
+
+
+class _SeekableConsumer(_PausableConsumer):
+    """После seek отдаёт партицию заново с указанного смещения."""
+
+    def __init__(self, messages, polls=10):
+        super().__init__([messages])
+        self.log = list(messages)
+        self.polls = polls
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        self.polls -= 1
+        if self.polls < 0:
+            raise _StopLoop
+        await asyncio.sleep(0)
+        return {"tp": self.messages.pop(0)} if self.messages else {}
+
+    def seek(self, tp, offset):
+        super().seek(tp, offset)
+        self.messages = [[msg for msg in self.log if msg.offset >= offset]]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_message_loop_rereads_partition_after_failed_message(monkeypatch):
+    fake = _SeekableConsumer([_raw_msg(offset) for offset in range(4)])
+    pool = KeyedWorkerPool(max_in_flight=10)
+    committer = OffsetCommitter(fake, OffsetTracker(), interval_ms=0)
+    failures = {1}
+    processed = []
+
+    async def flaky_process(msg):
+        await asyncio.sleep(0)
+        processed.append(msg.offset)
+        if msg.offset in failures:
+            failures.discard(msg.offset)
+            return False
+        return True
+
+    monkeypatch.setattr(consumer, "process_message", flaky_process)
+    monkeypatch.setattr(consumer, "REDELIVERY_DELAY", 0)
+
+    with pytest.raises(_StopLoop):
+        await consumer.run_message_loop(fake, pool, committer)
+    await pool.drain()
+    await committer.commit()
+
+    # неудачное смещение 1 перечитано и записано, граница коммита дошла до конца
+    assert fake.seeks == [(TopicPartition("t", 0), 1)]
+    assert processed.count(1) == 2
+    assert fake.committed[-1] == {TopicPartition("t", 0): 4}
+    assert committer.tracker.pending == 0
+
+
+def test_fast_decode_validates_only_stored_fields(monkeypatch):
+    monkeypatch.setattr(consumer, "KAFKA_FAST_DECODE", True)
+    value = _raw_msg().value
+    value["data"] = {key: str(item) if key != "quantity" else item for key, item in value["data"].items()}
+    raw = json.dumps(value).encode()
+
+    decoded = consumer.deserialize_value(raw)
+    assert decoded == json.loads(raw)
+
+    del decoded["subject"], decoded["source"]
+    record = consumer.parse_envelope(decoded)
+    assert isinstance(record, KafkaEventRecord)
+    assert _event_values(record) == _event_values(KafkaEnvelope(**value))
+
+    decoded["data"]["event"] = "teleport"
+    with pytest.raises(ValueError):
+        consumer.parse_envelope(decoded)
+
+
+def test_producer_key_is_warehouse_and_product():
+    msg = _raw_msg()
+    data = msg.value["data"]
+
+    assert partition_key(msg.value) == f"{data['warehouse_id']}:{data['product_id']}".encode()
+    assert partition_key({"id": "x"}) is None
@@ -1,12 +1,17 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock
 from uuid import uuid4
 
 import pytest
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
 
-from kafka_utils.db import handle_event
-from warehouse_service.schemas import KafkaEnvelope, KafkaEventData
+import kafka_utils.db
+from kafka_utils.db import handle_batch, handle_event
+from warehouse_service.services.movements import movement_rows, upsert_movements_stmt
+from warehouse_service.cache import as_of_version_key, movement_cache_key, stock_cache_key
+from warehouse_service.schemas import KafkaEnvelope, KafkaEventData, StockResponse
 
 
 def _fake_envelope(event: str = "arrival", duplicate=False):
@@ -44,6 +49,7 @@ def _integrity_error(pg_msg: str) -> IntegrityError:
 async def test_duplicate_message_id():
     db = AsyncMock()
     db.add = MagicMock()
+    db.execute.return_value = MagicMock()
     # commit бросает PG-ошибку по уникальному индексу message_id
     db.commit.side_effect = _integrity_error("movement_events_message_id_key")
 
@@ -58,6 +64,7 @@ async def test_duplicate_message_id():
 async def test_duplicate_event():
     db = AsyncMock()
     db.add = MagicMock()
+    db.execute.return_value = MagicMock()
     db.commit.side_effect = _integrity_error("uix_movement_event_event_type")
 
     with pytest.raises(ValueError, match="already exists"):
@@ -66,34 +73,110 @@ async def test_duplicate_event():
     db.rollback.assert_awaited_once()
 
 
-@pytest.mark.asyncio
-async def test_success_adds_and_commits():
+def _balances(*rows):
+    """Результат upsert ... RETURNING warehouse_id, product_id, quantity."""
+    rows = [SimpleNamespace(warehouse_id=wh, product_id=product, quantity=qty) for wh, product, qty in rows]
+    result = MagicMock()
+    result.one.return_value = rows[0] if rows else None
+    result.all.return_value = rows
+    return result
+
+
+def _event_db(envelope, quantity=1, movements=()):
     db = AsyncMock()
-    db.add = MagicMock()           # add — синхронный
+    db.add = MagicMock()
+    db.execute.return_value = MagicMock()
+    db.execute.side_effect = [
+        MagicMock(),                                                           # ключ дедупликации
+        _balances((envelope.data.warehouse_id, envelope.data.product_id, quantity)),
+        MagicMock(),                                                           # upsert перемещения
+        MagicMock(),                                                           # пометка снимков
+        list(movements),                                                       # перемещения для кеша
+    ]
+    return db
+
+
+def _redis_backend():
+    backend = MagicMock()
+    pipe = MagicMock(execute=AsyncMock())
+    backend.redis.pipeline.return_value.__aenter__.return_value = pipe
+    return backend, pipe
+
+
+@pytest.fixture
+def invalidate_mode(monkeypatch):
+    monkeypatch.setattr(kafka_utils.db, "CACHE_WRITE_MODE", "invalidate")
+
+
+@pytest.mark.asyncio
+async def test_success_adds_and_commits(invalidate_mode):
+    env = _fake_envelope()
+    db = _event_db(env)
     backend = AsyncMock()
 
-    await handle_event(_fake_envelope(), db, backend=backend)
+    await handle_event(env, db, backend=backend)
 
     db.add.assert_called_once()
+    # ключ дедупликации + upsert в stock_balances и movements + сброс снимков в той же транзакции
+    assert db.execute.await_count == 4
     db.commit.assert_awaited_once()
     # два ключа: :movements:* и :warehouses:*:products:*
     assert backend.clear.await_count == 2
+    # ... и сообщение процессам API, чтобы сбросили их из локального кеша
+    backend.redis.publish.assert_awaited_once()
 
 
 @pytest.mark.asyncio
 async def test_handle_event_no_backend():
-    db = AsyncMock()
-    db.add = MagicMock()
+    env = _fake_envelope()
+    db = _event_db(env)
 
-    await handle_event(_fake_envelope(), db, backend=None)
+    await handle_event(env, db, backend=None)
 
     db.commit.assert_awaited_once()
 
 
+@pytest.mark.asyncio
+async def test_handle_event_writes_through_stock_and_movement():
+    env = _fake_envelope("arrival")
+    data = env.data
+    departed = data.timestamp - timedelta(hours=1)
+    movement = SimpleNamespace(
+        movement_id=data.movement_id, sender_warehouse=uuid4(), receiver_warehouse=data.warehouse_id,
+        departure_time=departed, arrival_time=data.timestamp, quantity_departed=1, quantity_arrived=1,
+    )
+    db = _event_db(env, quantity=42, movements=[movement])
+    backend, pipe = _redis_backend()
+
+    await handle_event(env, db, backend=backend)
+
+    written = {call.args[0]: call.args[1] for call in pipe.set.call_args_list}
+    stock = StockResponse.model_validate_json(written[stock_cache_key(data.warehouse_id, data.product_id)])
+    assert stock.quantity == 42
+    assert b'"transit_seconds": 3600' in written[movement_cache_key(data.movement_id)]
+    pipe.delete.assert_not_called()
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_handle_event_incomplete_movement_is_dropped_from_cache():
+    env = _fake_envelope("departure")
+    db = _event_db(env, quantity=-3)
+    backend, pipe = _redis_backend()
+
+    await handle_event(env, db, backend=backend)
+
+    key, value = pipe.set.call_args.args
+    assert key == stock_cache_key(env.data.warehouse_id, env.data.product_id)
+    assert StockResponse.model_validate_json(value).quantity == 0
+    pipe.delete.assert_called_once_with(movement_cache_key(env.data.movement_id))
+
+
 @pytest.mark.asyncio
 async def test_duplicate_event_raises_text():
     db = AsyncMock()
     db.add = MagicMock()
+    db.execute.return_value = MagicMock()
     db.commit.side_effect = _integrity_error("uix_movement_event_event_type")
 
     env = _fake_envelope()
@@ -106,3 +189,164 @@ async def test_duplicate_event_raises_text():
         f"for movement_id={env.data.movement_id} already exists"
     )
     assert str(exc.value) == expected
+
+
+def _returning(*values):
+    """Результат db.execute(...) с .scalars().all() == values."""
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = list(values)
+    return result
+
+
+@pytest.mark.asyncio
+async def test_batch_single_insert_and_commit(invalidate_mode):
+    envs = [_fake_envelope(), _fake_envelope("departure")]
+    db = AsyncMock()
+    db.execute.side_effect = [
+        _returning(*(e.id for e in envs)), MagicMock(),
+        _balances(*((e.data.warehouse_id, e.data.product_id, 1) for e in envs)), MagicMock(), MagicMock(),
+    ]
+    backend, pipe = _redis_backend()
+
+    result = await handle_batch(envs, db, backend)
+
+    assert (result.received, result.inserted, result.duplicates, result.conflicts) == (2, 2, 0, 0)
+    # INSERT ключей + INSERT событий + upsert остатков и перемещений + пометка снимков, один commit
+    assert db.execute.await_count == 5
+    db.commit.assert_awaited_once()
+    # по два ключа на событие, один round-trip в Redis
+    assert pipe.delete.call_count == 4
+    pipe.publish.assert_called_once()
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_batch_writes_through_new_balances():
+    envs = [_fake_envelope(), _fake_envelope()]
+    duplicate = _fake_envelope()
+    balances = [(e.data.warehouse_id, e.data.product_id, 5) for e in envs]
+    db = AsyncMock()
+    db.execute.side_effect = [
+        _returning(*(e.id for e in envs)),   # ключи: duplicate не вставился
+        _returning(duplicate.id),            # ... потому что уже есть в БД
+        MagicMock(),                         # INSERT событий
+        _balances(*balances),                # upsert остатков
+        MagicMock(),                         # upsert перемещений
+        MagicMock(),                         # пометка снимков
+        [],                                  # перемещения ещё не завершены
+    ]
+    backend, pipe = _redis_backend()
+
+    await handle_batch([*envs, duplicate], db, backend)
+
+    assert {call.args[0] for call in pipe.set.call_args_list} == {
+        stock_cache_key(wh, product) for wh, product, _ in balances
+    }
+    deleted = {call.args[0] for call in pipe.delete.call_args_list}
+    assert deleted == {movement_cache_key(e.data.movement_id) for e in (*envs, duplicate)} | {
+        stock_cache_key(duplicate.data.warehouse_id, duplicate.data.product_id)
+    }
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_batch_counts_duplicates_and_conflicts():
+    first = _fake_envelope()
+    same_message = first.model_copy()
+    same_event = first.model_copy(update={"id": uuid4()})
+    already_stored = _fake_envelope()
+    conflicting = _fake_envelope()
+
+    db = AsyncMock()
+    db.execute.side_effect = [
+        _returning(first.id),                  # вставилась только первая строка
+        _returning(already_stored.id),         # message_id уже есть в БД
+        MagicMock(),                           # INSERT событий
+        _balances(),                           # upsert остатков
+        MagicMock(),                           # upsert перемещений
+        MagicMock(),                           # пометка снимков
+    ]
+
+    result = await handle_batch(
+        [first, same_message, same_event, already_stored, conflicting], db, backend=None,
+    )
+
+    assert result.inserted == 1
+    assert result.duplicates == 2   # повтор в пачке + повтор в БД
+    assert result.conflicts == 2    # повтор (movement_id, event) в пачке + в БД
+    db.commit.assert_awaited_once()
+
+
+
+def test_widest_batch_statement_fits_bind_param_limit():
+    rows = [
+        {"movement_id": uuid4(), "product_id": uuid4(), "warehouse_id": uuid4(), "event": "departure",
+         "timestamp": datetime.now(timezone.utc), "quantity": 1}
+        for _ in range(kafka_utils.db.STATEMENT_ROWS)
+    ]
+    stmt = upsert_movements_stmt(movement_rows(rows))
+
+    assert len(stmt.compile(dialect=postgresql.dialect()).params) <= kafka_utils.db.MAX_BIND_PARAMS
+
+
+@pytest.mark.asyncio
+async def test_large_batch_is_written_in_chunks(monkeypatch):
+    monkeypatch.setattr(kafka_utils.db, "STATEMENT_ROWS", 2)
+    envs = [_fake_envelope() for _ in range(5)]
+    db = AsyncMock()
+    db.execute.side_effect = [
+        _returning(*(e.id for e in envs[:2])), _returning(*(e.id for e in envs[2:4])), _returning(envs[4].id),
+        *[MagicMock()] * 3,                                                    # INSERT событий
+        *[_balances(*((e.data.warehouse_id, e.data.product_id, 1) for e in chunk))
+          for chunk in (envs[:2], envs[2:4], envs[4:])],                      # upsert остатков
+        *[MagicMock()] * 6,                                                    # перемещения и снимки
+    ]
+
+    result = await handle_batch(envs, db, backend=None)
+
+    assert result.inserted == 5
+    assert db.execute.await_count == 15
+    db.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_late_event_resets_cached_as_of_answers_of_its_pair():
+    late = _fake_envelope()
+    late.data.timestamp = datetime.now(timezone.utc) - timedelta(days=1)
+    fresh = _fake_envelope()
+    db = AsyncMock()
+    db.execute.side_effect = [
+        _returning(late.id, fresh.id), MagicMock(),
+        _balances(*((e.data.warehouse_id, e.data.product_id, 1) for e in (late, fresh))), MagicMock(), MagicMock(),
+        [],
+    ]
+    backend, pipe = _redis_backend()
+
+    await handle_batch([late, fresh], db, backend)
+
+    # версия пары входит в ключ as_of-ответов: её увеличение делает их недостижимыми
+    pipe.incr.assert_called_once_with(as_of_version_key(late.data.warehouse_id, late.data.product_id))
+
+@pytest.mark.asyncio
+async def test_batch_nothing_inserted_skips_balances():
+    env = _fake_envelope()
+    db = AsyncMock()
+    db.execute.side_effect = [_returning(), _returning(env.id)]
+
+    result = await handle_batch([env], db, backend=None)
+
+    assert (result.inserted, result.duplicates) == (0, 1)
+    assert db.execute.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_duplicate_event_model_constraint_name():
+    db = AsyncMock()
+    db.add = MagicMock()
+    db.execute.return_value = MagicMock()
+    db.commit.side_effect = _integrity_error(
+        'duplicate key value violates unique constraint "uix_movement_id_event_type"'
+    )
+
+    with pytest.raises(ValueError, match="for movement_id="):
+        await handle_event(_fake_envelope(), db, backend=None)
@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.util import greenlet_spawn
+
+from warehouse_service import db
+
+
+@pytest.mark.parametrize("budget, workers, expected", [
+    (0, 4, {}),
+    (20, 4, {"pool_size": 5, "max_overflow": 0}),
+    (10, 3, {"pool_size": 3, "max_overflow": 0}),
+    (2, 4, {"pool_size": 1, "max_overflow": 0}),
+])
+def test_pool_limits_split_budget_between_workers(budget, workers, expected):
+    assert db.pool_limits(budget, workers) == expected
+
+
+def test_init_engine_rebinds_sessions_after_fork():
+    inherited = db._engine
+    try:
+        with patch.object(inherited.sync_engine, "dispose") as dispose:
+            engine = db.init_engine()
+
+        # соединения родителя не закрываются
+        dispose.assert_called_once_with(close=False)
+        assert engine is db._engine and engine is not inherited
+        assert db.AsyncSessionLocal.kw["bind"] is engine
+    finally:
+        db._engine = inherited
+        db.AsyncSessionLocal.configure(bind=inherited)
+
+
+def test_engine_options_configure_pool_and_asyncpg_statement_cache():
+    options = db.engine_options("consumer", 3, 7, "postgresql+asyncpg://u:p@localhost/db")
+    assert options["poolclass"] is db.InstrumentedPool
+    assert (options["pool_logging_name"], options["pool_size"], options["max_overflow"]) == ("consumer", 3, 7)
+    assert set(options["connect_args"]) == {"statement_cache_size", "prepared_statement_cache_size"}
+    assert "connect_args" not in db.engine_options("api", 3, 7, "sqlite://")
+
+
+def test_pool_budget_overrides_configured_size():
+    with patch.object(db, "pool_limits", return_value={"pool_size": 4, "max_overflow": 0}):
+        options = db.api_engine_options()
+    assert (options["pool_size"], options["max_overflow"]) == (4, 0)
+    assert db._engine.pool.__class__ is db.InstrumentedPool
+
+
+def _sample(name, pool):
+    return REGISTRY.get_sample_value(name, {"pool": pool}) or 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_instrumented_pool_reports_checkout_in_use_and_overflow():
+    pool = db.InstrumentedPool(MagicMock, pool_size=1, max_overflow=1, timeout=0.05, logging_name="test-pool")
+    checkouts = _sample("warehouse_db_pool_checkout_seconds_count", "test-pool")
+
+    first = await greenlet_spawn(pool.connect)
+    second = await greenlet_spawn(pool.connect)
+    assert _sample("warehouse_db_pool_in_use", "test-pool") == 2
+    assert _sample("warehouse_db_pool_overflow", "test-pool") == 1
+
+    with pytest.raises(TimeoutError):
+        await greenlet_spawn(pool.connect)
+    assert _sample("warehouse_db_pool_timeouts_total", "test-pool") == 1
+    assert _sample("warehouse_db_pool_checkout_seconds_count", "test-pool") == checkouts + 3
+
+    await greenlet_spawn(second.close)
+    await greenlet_spawn(first.close)
+    assert _sample("warehouse_db_pool_in_use", "test-pool") == 0
+    assert _sample("warehouse_db_pool_overflow", "test-pool") == 0
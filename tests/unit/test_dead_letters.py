@@ -0,0 +1,183 @@
+from contextlib import asynccontextmanager
+from functools import partial
+from unittest.mock import AsyncMock
+
+import pytest
+from aiokafka import TopicPartition
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+from kafka_utils import consumer, dead_letters
+from kafka_utils.db import BatchResult
+from kafka_utils.dead_letters import RetryPolicy, Undecodable, WriteFailed, call_with_retries, is_transient
+from kafka_utils.offsets import OffsetCommitter, OffsetTracker
+from tests.unit.test_consumer import _SeekableConsumer, _StopLoop, _raw_msg
+
+NO_WAIT = RetryPolicy(attempts=3, base_delay=0, max_delay=0)
+
+
+class _Orig(Exception):
+    def __init__(self, sqlstate):
+        super().__init__(sqlstate)
+        self.sqlstate = sqlstate
+
+
+def test_transient_errors_are_classified_by_type_and_sqlstate():
+    assert is_transient(OperationalError("select", {}, Exception("connection refused")))
+    assert is_transient(ConnectionResetError())
+    assert is_transient(DBAPIError("update", {}, _Orig("40P01")))  # deadlock
+    assert not is_transient(DBAPIError("update", {}, _Orig("22003")))  # numeric out of range
+    assert not is_transient(IntegrityError("insert", {}, _Orig("23514")))
+    assert not is_transient(ValueError("bad data"))
+
+
+def test_retry_delay_grows_exponentially_up_to_max():
+    policy = RetryPolicy(attempts=10, base_delay=0.1, max_delay=1.0)
+    assert all(0 <= policy.delay(1) <= 0.1 for _ in range(50))
+    assert all(0 <= policy.delay(3) <= 0.4 for _ in range(50))
+    assert all(0 <= policy.delay(9) <= 1.0 for _ in range(50))
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_call_with_retries_repeats_only_transient_errors():
+    operation = AsyncMock(side_effect=[ConnectionResetError(), ConnectionResetError(), "ok"])
+    assert await call_with_retries(operation, NO_WAIT, "message") == "ok"
+    assert operation.await_count == 3
+
+    operation = AsyncMock(side_effect=ConnectionResetError())
+    with pytest.raises(WriteFailed) as failed:
+        await call_with_retries(operation, NO_WAIT, "message")
+    assert failed.value.attempts == 3
+
+    operation = AsyncMock(side_effect=ValueError("bad data"))
+    with pytest.raises(WriteFailed) as failed:
+        await call_with_retries(operation, NO_WAIT, "message")
+    assert (failed.value.attempts, operation.await_count) == (1, 1)
+
+
+def test_undecodable_message_is_kept_for_dead_letters():
+    value = consumer.deserialize_value(b"{not json")
+    assert isinstance(value, Undecodable)
+    with pytest.raises(ValueError):
+        consumer.parse_envelope(value)
+
+    msg = _raw_msg(offset=7)
+    msg.value, msg.key = value, b"wh:product"
+    row = dead_letters.dead_letter_row(msg, value.error, 1)
+    assert (row["topic"], row["partition"], row["offset"], row["key"]) == ("t", 0, 7, "wh:product")
+    assert row["payload"] == "{not json"
+    assert row["error_class"] == "JSONDecodeError"
+
+
+def _sessions(monkeypatch):
+    @asynccontextmanager
+    async def _ctx():
+        yield AsyncMock()
+
+    monkeypatch.setattr(consumer, "SessionLocal", _ctx)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_permanent_error_dead_letters_message(monkeypatch):
+    _sessions(monkeypatch)
+    error = IntegrityError("insert", {}, _Orig("23514"))
+    monkeypatch.setattr(consumer, "handle_event", AsyncMock(side_effect=error))
+    dead_letter = AsyncMock(return_value=True)
+    monkeypatch.setattr(consumer, "record_dead_letter", dead_letter)
+
+    msg = _raw_msg()
+    assert await consumer.process_message(msg, NO_WAIT) is True
+    dead_letter.assert_awaited_once_with(msg, error, 1)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_exhausted_transient_error_leaves_message_for_redelivery(monkeypatch):
+    _sessions(monkeypatch)
+    handle_event = AsyncMock(side_effect=OperationalError("insert", {}, Exception("server closed")))
+    monkeypatch.setattr(consumer, "handle_event", handle_event)
+    dead_letter = AsyncMock(return_value=True)
+    monkeypatch.setattr(consumer, "record_dead_letter", dead_letter)
+
+    assert await consumer.process_message(_raw_msg(), NO_WAIT) is False
+    assert handle_event.await_count == NO_WAIT.attempts
+    dead_letter.assert_not_awaited()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_batch_with_poison_message_is_written_one_by_one(monkeypatch):
+    _sessions(monkeypatch)
+    messages = [_raw_msg(0), _raw_msg(1), _raw_msg(2)]
+    poison_id = messages[1].value["id"]
+    error = IntegrityError("insert", {}, _Orig("23514"))
+
+    async def handle_event(envelope, session, backend):
+        if str(envelope.id) == poison_id:
+            raise error
+
+    monkeypatch.setattr(consumer, "handle_batch", AsyncMock(side_effect=error))
+    monkeypatch.setattr(consumer, "handle_event", handle_event)
+    dead_letter = AsyncMock(return_value=True)
+    monkeypatch.setattr(consumer, "record_dead_letter", dead_letter)
+
+    result = await consumer.process_batch(messages, NO_WAIT)
+
+    assert (result.received, result.inserted, result.dead_letters) == (3, 2, 1)
+    dead_letter.assert_awaited_once_with(messages[1], error, 1)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_batch_is_not_committed_when_dead_letter_write_fails(monkeypatch):
+    _sessions(monkeypatch)
+    monkeypatch.setattr(consumer, "handle_batch", AsyncMock(return_value=BatchResult(inserted=1)))
+    monkeypatch.setattr(consumer, "record_dead_letter", AsyncMock(return_value=False))
+    broken = _raw_msg(1)
+    broken.value = {"id": "not-a-uuid"}
+
+    assert await consumer.process_batch([_raw_msg(0), broken], NO_WAIT) is None
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_record_dead_letter_inserts_once_per_offset(monkeypatch):
+    session = AsyncMock()
+
+    @asynccontextmanager
+    async def _ctx():
+        yield session
+
+    monkeypatch.setattr(dead_letters, "SessionLocal", _ctx)
+    msg = _raw_msg(offset=5)
+
+    assert await dead_letters.record_dead_letter(msg, ValueError("bad"), 2, NO_WAIT) is True
+    stmt = session.execute.await_args.args[0]
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT ON CONSTRAINT uix_dead_letters_offset DO NOTHING" in sql
+    session.commit.assert_awaited_once()
+
+    session.execute = AsyncMock(side_effect=ConnectionResetError())
+    assert await dead_letters.record_dead_letter(msg, ValueError("bad"), 2, NO_WAIT) is False
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_batch_is_redelivered_after_retries_are_exhausted(monkeypatch):
+    _sessions(monkeypatch)
+    messages = [_raw_msg(0), _raw_msg(1)]
+    fake = _SeekableConsumer(messages)
+    outage = OperationalError("insert", {}, Exception("server closed"))
+    # первая доставка: все попытки падают; после seek пачка приходит снова и записывается
+    handle_batch = AsyncMock(side_effect=[outage] * NO_WAIT.attempts + [BatchResult(inserted=2)])
+    dead_letter = AsyncMock(return_value=True)
+
+    monkeypatch.setattr(consumer, "handle_batch", handle_batch)
+    monkeypatch.setattr(consumer, "record_dead_letter", dead_letter)
+    monkeypatch.setattr(consumer, "process_batch", partial(consumer.process_batch, policy=NO_WAIT))
+    monkeypatch.setattr(consumer, "collect_batch", partial(consumer.collect_batch, linger_ms=0))
+    monkeypatch.setattr(consumer, "REDELIVERY_DELAY", 0)
+    committer = OffsetCommitter(fake, OffsetTracker(), interval_ms=0)
+
+    with pytest.raises(_StopLoop):
+        await consumer.run_batch_loop(fake, committer)
+
+    assert fake.seeks == [(TopicPartition("t", 0), 0)]
+    assert handle_batch.await_count == NO_WAIT.attempts + 1
+    assert fake.committed[-1] == {TopicPartition("t", 0): 2}
+    dead_letter.assert_not_awaited()
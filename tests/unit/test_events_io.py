@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from warehouse_service.devtools.events_io import event_envelope, export_stmt, open_input, open_output
+from warehouse_service.schemas import KafkaEnvelope
+
+
+def _row(row_id=7, event="departure"):
+    return SimpleNamespace(
+        id=row_id, message_id=uuid4(), movement_id=uuid4(), warehouse_id=uuid4(), product_id=uuid4(),
+        timestamp=datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc), event=event, quantity=40,
+    )
+
+
+def test_exported_envelope_round_trips_through_import_validation():
+    row = _row()
+
+    envelope = KafkaEnvelope.model_validate(event_envelope(row))
+
+    assert envelope.id == row.message_id
+    assert (envelope.data.movement_id, envelope.data.warehouse_id, envelope.data.product_id) == (
+        row.movement_id, row.warehouse_id, row.product_id,
+    )
+    assert (envelope.data.timestamp, envelope.data.event, envelope.data.quantity) == (row.timestamp, "departure", 40)
+    assert event_envelope(row)["export_id"] == 7
+
+
+def test_export_resumes_after_last_id_in_id_order():
+    sql = str(export_stmt(100).compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+    assert "movement_events.id > 100" in sql
+    assert sql.rstrip().endswith("ORDER BY movement_events.id")
+
+
+def test_gzip_append_and_offset_resume(tmp_path):
+    path = str(tmp_path / "events.jsonl.gz")
+    with open_output(path) as out:
+        out.write(b"first\n")
+    with open_output(path, append=True) as out:
+        out.write(b"second\nthird\n")
+
+    with open_input(path) as source:
+        assert source.read() == b"first\nsecond\nthird\n"
+    with open_input(path, offset=len(b"first\n")) as source:
+        assert list(source) == [b"second\n", b"third\n"]
@@ -0,0 +1,18 @@
+from benchmarks.hot_paths import cases, compare
+from benchmarks.metrics import Run, report
+from warehouse_service.schemas import MovementResponse
+
+
+def test_cases_exercise_real_code():
+    results = {name: func() for name, func in cases().items()}
+
+    assert isinstance(results["movement_response"], MovementResponse)
+    assert results["request_key_builder"].startswith(":warehouses:") or results["request_key_builder"].startswith("k:")
+    assert results["consumer_deserialize"]["data"]["event"] == "departure"
+
+
+def test_compare_flags_only_regressions_over_threshold():
+    baseline = report([Run("fast", latencies=[1.0]), Run("slow", latencies=[1.0])])
+    runs = [Run("fast", latencies=[1.1]), Run("slow", latencies=[1.5]), Run("new", latencies=[1.0])]
+
+    assert compare(runs, baseline, threshold=0.2) == ["slow"]
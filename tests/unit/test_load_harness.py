@@ -0,0 +1,83 @@
+from collections import Counter
+
+import pytest
+
+from benchmarks.events import EventStream, StreamConfig
+from benchmarks.fakes import FakeRedis, FakeSessionFactory
+from benchmarks.metrics import Run, percentile
+from benchmarks.workers import speedups
+from kafka_utils.db import handle_event
+from warehouse_service.cache import make_backend, stock_cache_key
+from warehouse_service.schemas import KafkaEnvelope
+
+
+def _positions(events):
+    positions = {}
+    for index, event in enumerate(events):
+        positions[(event["data"]["movement_id"], event["data"]["event"])] = index
+    return positions
+
+
+def test_stream_is_reproducible_and_valid():
+    first = list(EventStream(StreamConfig(products=100, seed=7)).events(200))
+    second = list(EventStream(StreamConfig(products=100, seed=7)).events(200))
+
+    assert first == second
+    for event in first:
+        KafkaEnvelope.model_validate(event)
+
+
+def test_stream_keeps_pair_order_except_out_of_order_share():
+    positions = _positions(EventStream(StreamConfig(out_of_order=0.2, window=32)).events(20_000))
+    movements = {movement_id for movement_id, _ in positions}
+    complete = [m for m in movements if (m, "departure") in positions and (m, "arrival") in positions]
+    reversed_share = sum(
+        positions[(m, "arrival")] < positions[(m, "departure")] for m in complete
+    ) / len(complete)
+
+    assert len(complete) > 0.95 * len(movements)
+    assert 0.15 < reversed_share < 0.25
+
+
+def test_stream_skew_concentrates_on_few_products():
+    stream = EventStream(StreamConfig(products=1000, skew=1.2))
+    counts = Counter(event["data"]["product_id"] for event in stream.events(20_000))
+    top = sum(count for _, count in counts.most_common(10))
+
+    assert top > 0.4 * 20_000
+    flat = Counter(e["data"]["product_id"] for e in EventStream(StreamConfig(products=1000, skew=0)).events(20_000))
+    assert sum(count for _, count in flat.most_common(10)) < 0.05 * 20_000
+
+
+def test_percentiles_and_ops():
+    run = Run("x", latencies=[i / 1000 for i in range(1, 101)], elapsed=2.0, queries=300)
+
+    stats = run.stats()
+
+    assert percentile([], 0.5) == 0.0
+    assert stats["p50"] == pytest.approx(0.050)
+    assert stats["p99"] == pytest.approx(0.099)
+    assert stats["ops"] == pytest.approx(50)
+    assert stats["queries_per_op"] == pytest.approx(3)
+
+
+def test_worker_runs_compare_ops_to_first_run():
+    runs = [Run(f"w{n}", latencies=[0.001] * 100, elapsed=elapsed) for n, elapsed in ((1, 2.0), (4, 0.5))]
+
+    assert speedups(runs) == [pytest.approx(1.0), pytest.approx(4.0)]
+
+
+@pytest.mark.asyncio
+async def test_fake_ingest_writes_through_to_fake_redis():
+    stream = EventStream(StreamConfig(products=10, out_of_order=0))
+    factory = FakeSessionFactory()
+    backend = make_backend(FakeRedis())
+
+    for event in stream.events(20):
+        async with factory() as session:
+            await handle_event(KafkaEnvelope.model_validate(event), session, backend)
+
+    (wh, product), quantity = next(iter(factory.balances.items()))
+    cached = await backend.get(stock_cache_key(wh, product))
+    assert cached is not None
+    assert len(factory.sessions) == 20 and factory.queries > 0
@@ -1,13 +1,25 @@
 import json
 from datetime import datetime, timedelta, timezone
 from types import SimpleNamespace
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 from uuid import uuid4
 
 import pytest
 from fastapi.responses import JSONResponse
+from sqlalchemy.dialects import postgresql
 
-from warehouse_service.services.movements import get_movement_info
+from warehouse_service.services.movements import (
+    UnknownCursor, get_in_transit, get_movement_info, in_transit_stmt, in_transit_totals_stmt, movement_half,
+    movement_rows, movements_by_ids_stmt, resolve_cursor, stream_movements, upsert_movements_stmt,
+    warehouse_movements_stmt,
+)
+
+
+def _movement_db(row):
+    db = AsyncMock()
+    db.execute.return_value = MagicMock()
+    db.execute.return_value.first.return_value = row
+    return db
 
 
 @pytest.mark.asyncio
@@ -16,26 +28,24 @@ async def test_happy_path():
     t0 = datetime.now(timezone.utc)
     t1 = t0 + timedelta(hours=2)
 
-    dep = SimpleNamespace(event="departure", warehouse_id=wid_from,
-                          timestamp=t0, quantity=100)
-    arr = SimpleNamespace(event="arrival", warehouse_id=wid_to,
-                          timestamp=t1, quantity=90)
-
-    db = AsyncMock()
-    db.scalars.return_value = [dep, arr]
+    row = SimpleNamespace(movement_id=mid, sender_warehouse=wid_from, receiver_warehouse=wid_to,
+                          departure_time=t0, arrival_time=t1,
+                          quantity_departed=100, quantity_arrived=90)
+    db = _movement_db(row)
 
     resp = await get_movement_info(db, mid)
 
     assert resp.movement_id == mid
     assert resp.quantity_difference == -10
     assert resp.transit_seconds == int((t1 - t0).total_seconds())
+    db.execute.assert_awaited_once()
 
 
 # ────────────────────────────────────────────────────────────
 @pytest.mark.asyncio
 async def test_incomplete_returns_404():
-    db = AsyncMock()
-    db.scalars.return_value = []            # пустой ответ
+    """Нет строки или перемещение не завершено (status отфильтрован в запросе) → 404."""
+    db = _movement_db(None)
 
     resp = await get_movement_info(db, uuid4())
 
@@ -45,26 +55,174 @@ async def test_incomplete_returns_404():
     assert body["detail"] == "Movement incomplete or not found"
 
 
-# ────────────────────────────────────────────────────────────
 @pytest.mark.asyncio
-async def test_missing_arrival_returns_404():
-    """Есть departure, но нет arrival → JSONResponse 404."""
-    movement_id = uuid4()
+async def test_movement_info_is_primary_key_read():
+    db = _movement_db(None)
+
+    await get_movement_info(db, uuid4())
+
+    sql = str(db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "FROM movements" in sql
+    assert "movements.movement_id = %(movement_id)s" in sql
+    assert "movements.status = %(status_1)s" in sql
+    assert "JOIN" not in sql
+
+
+# ────────────────────────────────────────────────────────────
+def test_movement_rows_merge_halves():
+    movement_id, product_id, sender, receiver = uuid4(), uuid4(), uuid4(), uuid4()
     t0 = datetime.now(timezone.utc)
+    departure = dict(movement_id=movement_id, product_id=product_id, warehouse_id=sender,
+                     timestamp=t0, event="departure", quantity=10)
+    arrival = dict(departure, warehouse_id=receiver, timestamp=t0 + timedelta(minutes=1),
+                   event="arrival", quantity=9)
+
+    row, = movement_rows([arrival, departure])
+
+    assert row == {
+        "movement_id": movement_id, "product_id": product_id,
+        "sender_warehouse": sender, "departure_time": t0, "quantity_departed": 10,
+        "receiver_warehouse": receiver, "arrival_time": t0 + timedelta(minutes=1), "quantity_arrived": 9,
+    }
+    assert movement_half(departure)["arrival_time"] is None
+
+
+def test_upsert_movements_keeps_other_half():
+    sql = str(upsert_movements_stmt([movement_half(dict(
+        movement_id=uuid4(), product_id=uuid4(), warehouse_id=uuid4(),
+        timestamp=datetime.now(timezone.utc), event="arrival", quantity=1,
+    ))]).compile(dialect=postgresql.dialect()))
 
-    departure_event = SimpleNamespace(
-        event="departure",
-        warehouse_id=uuid4(),
-        timestamp=t0,
-        quantity=5,
+    assert "ON CONFLICT (movement_id) DO UPDATE" in sql
+    assert "arrival_time = coalesce(excluded.arrival_time, movements.arrival_time)" in sql
+    assert "departure_time = coalesce(excluded.departure_time, movements.departure_time)" in sql
+
+
+# ────────────────────────────────────────────────────────────
+class _FakeStreamResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def partitions(self, size):
+        for start in range(0, len(self.rows), size):
+            yield self.rows[start:start + size]
+
+
+def _session_factory(rows):
+    session = AsyncMock()
+    session.stream.return_value = _FakeStreamResult(rows)
+    session.__aenter__.return_value = session
+    return lambda: session
+
+
+def _row(t0, departed=100, arrived=90):
+    return SimpleNamespace(
+        movement_id=uuid4(), sender_warehouse=uuid4(), receiver_warehouse=uuid4(),
+        departure_time=t0, arrival_time=t0 + timedelta(minutes=5),
+        quantity_departed=departed, quantity_arrived=arrived,
     )
 
-    db = AsyncMock()
-    db.scalars.side_effect = [
-        [departure_event],  # первый вызов get_movement_events
+
+async def _collect(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", [0, 1, 3, 5])
+async def test_stream_movements_is_json_array(count):
+    t0 = datetime.now(timezone.utc)
+    rows = [_row(t0) for _ in range(count)]
+
+    body = await _collect(stream_movements(_session_factory(rows), None, chunk_size=2))
+
+    items = json.loads(body)
+    assert [item["movement_id"] for item in items] == [str(row.movement_id) for row in rows]
+    assert all(item["quantity_difference"] == -10 and item["transit_seconds"] == 300 for item in items)
+
+
+def test_movements_by_ids_read_completed_rows():
+    sql = str(movements_by_ids_stmt([uuid4()]).compile(dialect=postgresql.dialect()))
+
+    assert "FROM movements" in sql
+    assert "movements.status = %(status_1)s" in sql
+    assert "movements.movement_id IN" in sql
+
+
+def test_warehouse_movements_keyset_page():
+    cursor = (datetime.now(timezone.utc), uuid4())
+    sql = str(warehouse_movements_stmt(uuid4(), cursor, 50).compile(dialect=postgresql.dialect()))
+
+    # две ветки по индексам отправителя и получателя, у каждой свой keyset и LIMIT
+    assert sql.count("(movements.departure_time, movements.movement_id) > (") == 2
+    assert sql.count("ORDER BY movements.departure_time, movements.movement_id") == 2
+    assert " UNION ALL " in sql and " OR " not in sql
+    assert sql.rstrip().endswith("ORDER BY anon_1.departure_time, anon_1.movement_id \n LIMIT %(param_7)s")
+    assert "OFFSET" not in sql
+
+
+# ────────────────────────────────────────────────────────────
+def test_in_transit_page_uses_partial_index_predicate():
+    now = datetime.now(timezone.utc)
+    sql = str(in_transit_stmt(uuid4(), now, (now, uuid4()), 50).compile(dialect=postgresql.dialect()))
+
+    # литерал совпадает с условием частичного индекса
+    assert "movements.status = 'in_transit'" in sql
+    assert "movements.sender_warehouse = %(sender_warehouse_1)s" in sql
+    assert "movements.departure_time < %(departure_time_1)s" in sql
+    assert "(movements.departure_time, movements.movement_id) > (%(param_1)s, %(param_2)s::UUID)" in sql
+    assert "ORDER BY movements.departure_time, movements.movement_id" in sql
+
+
+def test_in_transit_totals_without_filters():
+    sql = str(in_transit_totals_stmt(None, None).compile(dialect=postgresql.dialect()))
+
+    assert "count(*)" in sql and "sum(movements.quantity_departed)" in sql
+    assert "sender_warehouse" not in sql and "departure_time" not in sql
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit, next_page", [(2, True), (3, False)])
+async def test_get_in_transit_totals_and_page(limit, next_page):
+    now = datetime.now(timezone.utc)
+    rows = [
+        SimpleNamespace(movement_id=uuid4(), sender_warehouse=uuid4(), product_id=uuid4(),
+                        departure_time=now - timedelta(hours=hours), quantity_departed=5)
+        for hours in (30, 26)
     ]
+    totals = MagicMock()
+    totals.one.return_value = SimpleNamespace(movements=7, quantity=35)
+    page = MagicMock()
+    page.all.return_value = rows
+    db = AsyncMock()
+    db.execute.side_effect = [totals, page]
 
-    resp = await get_movement_info(db, movement_id)
+    resp = await get_in_transit(db, None, 24, None, limit, now=now)
 
-    assert isinstance(resp, JSONResponse)
-    assert resp.status_code == 404
\ No newline at end of file
+    assert (resp.movements, resp.quantity) == (7, 35)
+    assert [item.in_transit_seconds for item in resp.items] == [30 * 3600, 26 * 3600]
+    assert resp.next_after == (rows[-1].movement_id if next_page else None)
+    departed_before = db.execute.await_args_list[0].args[0].compile().params["departure_time_1"]
+    assert departed_before == now - timedelta(hours=24)
+
+
+@pytest.mark.asyncio
+async def test_unresolvable_cursor_is_rejected():
+    db = AsyncMock()
+    db.scalar.return_value = None  # нет такого movement_id или departure ещё не пришёл
+
+    with pytest.raises(UnknownCursor):
+        await resolve_cursor(db, uuid4())
+
+    resp = await get_in_transit(db, None, None, uuid4(), 10)
+    assert resp.status_code == 400
+    db.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_cursor_resolves_to_departure_and_id():
+    departed, after = datetime.now(timezone.utc), uuid4()
+    db = AsyncMock()
+    db.scalar.return_value = departed
+
+    assert await resolve_cursor(db, after) == (departed, after)
+    assert await resolve_cursor(db, None) is None
@@ -0,0 +1,227 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiokafka import TopicPartition
+from aiokafka.errors import CommitFailedError
+
+from kafka_utils import consumer
+from kafka_utils.db import BatchResult
+from kafka_utils.offsets import DrainingRebalanceListener, OffsetCommitter, OffsetTracker
+
+TP0 = TopicPartition("t", 0)
+TP1 = TopicPartition("t", 1)
+
+
+class _StopLoop(Exception):
+    pass
+
+
+class FakeConsumer:
+    """In-process замена AIOKafkaConsumer: отдаёт заготовленные пачки и запоминает коммиты."""
+
+    def __init__(self, batches, assignment=(TP0, TP1), fail_commit=False):
+        self.batches = list(batches)
+        self._assignment = set(assignment)
+        self.fail_commit = fail_commit
+        self.committed = []
+        self.seeks = []
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        if not self.batches:
+            raise _StopLoop
+        batch = self.batches.pop(0)
+        grouped = {}
+        for msg in batch:
+            grouped.setdefault(TopicPartition(msg.topic, msg.partition), []).append(msg)
+        return grouped
+
+    def assignment(self):
+        return self._assignment
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp, offset))
+
+    async def commit(self, offsets):
+        if self.fail_commit:
+            raise CommitFailedError("rebalance in progress")
+        self.committed.append(dict(offsets))
+
+
+def _msg(partition, offset):
+    return SimpleNamespace(topic="t", partition=partition, offset=offset, value={})
+
+
+def test_tracker_commits_only_contiguous_prefix():
+    tracker = OffsetTracker()
+    for offset in range(5):
+        tracker.track(TP0, offset)
+
+    tracker.done(TP0, 2)
+    tracker.done(TP0, 1)
+    assert tracker.committable() == {}   # 0 ещё в работе
+
+    tracker.done(TP0, 0)
+    assert tracker.committable() == {TP0: 3}
+
+    tracker.done(TP0, 4)
+    assert tracker.committable() == {TP0: 3}
+    tracker.done(TP0, 3)
+    assert tracker.committable() == {TP0: 5}
+    assert tracker.pending == 0
+
+
+def test_tracker_partitions_are_independent():
+    tracker = OffsetTracker()
+    tracker.track(TP0, 10)
+    tracker.track(TP1, 7)
+    tracker.track(TP1, 8)
+
+    tracker.done(TP1, 7)
+    assert tracker.committable() == {TP1: 8}
+
+    tracker.mark_committed({TP1: 8})
+    assert tracker.committable() == {}
+
+    tracker.forget([TP0])
+    tracker.done(TP0, 10)              # партицию отобрали — отметка игнорируется
+    assert TP0 not in tracker.committable()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_committer_skips_unassigned_and_survives_failures():
+    tracker = OffsetTracker()
+    tracker.track(TP0, 0)
+    tracker.track(TP1, 0)
+    tracker.done(TP0, 0)
+    tracker.done(TP1, 0)
+
+    fake = FakeConsumer([], assignment=[TP0], fail_commit=True)
+    committer = OffsetCommitter(fake, tracker, interval_ms=0)
+    await committer.commit()
+    assert tracker.committable() == {TP0: 1, TP1: 1}   # не закоммичено — повторим позже
+
+    fake.fail_commit = False
+    await committer.commit()
+    assert fake.committed == [{TP0: 1}]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_batch_loop_commits_after_durable_write(monkeypatch):
+    fake = FakeConsumer([
+        [_msg(0, 0), _msg(0, 1), _msg(1, 0)],
+        [_msg(0, 2), _msg(1, 1)],                 # эта пачка не записалась в БД
+        [_msg(0, 2), _msg(1, 1)],                 # и после seek пришла ещё раз
+        [_msg(0, 3)],
+    ])
+    outcomes = [BatchResult(received=3), None, BatchResult(received=2), BatchResult(received=1)]
+
+    async def fake_process_batch(batch):
+        return outcomes.pop(0)
+
+    async def one_shot_collect(c, *args, **kwargs):
+        chunk = await c.getmany()
+        return [msg for records in chunk.values() for msg in records]
+
+    monkeypatch.setattr(consumer, "process_batch", fake_process_batch)
+    monkeypatch.setattr(consumer, "collect_batch", one_shot_collect)
+    monkeypatch.setattr(consumer, "REDELIVERY_DELAY", 0)
+    committer = OffsetCommitter(fake, OffsetTracker(), interval_ms=0)
+
+    with pytest.raises(_StopLoop):
+        await consumer.run_batch_loop(fake, committer)
+
+    # неудачная пачка перечитывается с начала, граница не сдвигается за неё до повторной записи
+    assert sorted(fake.seeks) == [(TP0, 2), (TP1, 1)]
+    assert fake.committed[0] == {TP0: 2, TP1: 1}
+    assert fake.committed[1] == {TP0: 3, TP1: 2}
+    assert fake.committed[-1] == {TP0: 4}
+    assert committer.tracker.pending == 0
+
+
+def test_tracker_rewinds_to_first_unfinished_offset():
+    tracker = OffsetTracker()
+    for offset in range(100_000):
+        tracker.track(TP0, offset)
+    for offset in range(1, 100_000):
+        tracker.done(TP0, offset)
+    tracker.fail(TP0)
+
+    assert tracker.committable() == {} and tracker.has_failed
+    assert tracker.rewind(TP0) == 0
+    assert tracker.pending == 0 and not tracker.has_failed
+
+    # сообщения перечитаны с 0: учёт начинается заново
+    tracker.track(TP0, 0)
+    tracker.done(TP0, 0)
+    assert tracker.committable() == {TP0: 1}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_revoke_drains_commits_and_forgets_partitions():
+    tracker = OffsetTracker()
+    tracker.track(TP0, 0)
+    tracker.track(TP1, 0)
+    fake = FakeConsumer([])
+    committer = OffsetCommitter(fake, tracker, interval_ms=0)
+
+    async def drain():
+        # начатая запись завершается до того, как партиции отданы
+        tracker.done(TP0, 0)
+        tracker.done(TP1, 0)
+
+    listener = DrainingRebalanceListener(committer, drain)
+    await listener.on_partitions_revoked([TP0])
+
+    assert fake.committed == [{TP0: 1, TP1: 1}]
+    tracker.track(TP1, 1)
+    tracker.done(TP1, 1)
+    assert tracker.committable() == {TP1: 2}   # TP0 забыта, TP1 продолжает учёт
+
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_revoked_partition_is_not_tracked_again_until_reassigned():
+    tracker = OffsetTracker()
+    committer = OffsetCommitter(FakeConsumer([]), tracker, interval_ms=0)
+
+    async def drain():
+        pass
+
+    listener = DrainingRebalanceListener(committer, drain)
+    await listener.on_partitions_assigned([TP0, TP1])
+    await listener.on_partitions_revoked([TP0])
+
+    # сообщение TP0, полученное до отзыва, не возвращает её в учёт
+    assert tracker.track(TP0, 5) is False
+    tracker.done(TP0, 5)
+    assert tracker.committable() == {}
+    assert tracker.track(TP1, 0) is True
+
+    await listener.on_partitions_assigned([TP0])
+    assert tracker.committable() == {}
+    assert tracker.track(TP0, 9) is True
+    tracker.done(TP0, 9)
+    assert tracker.committable() == {TP0: 10}
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_batch_loop_holds_lock_while_writing(monkeypatch):
+    fake = FakeConsumer([[_msg(0, 0)]])
+    writing = asyncio.Lock()
+    held = []
+
+    async def fake_process_batch(batch):
+        held.append(writing.locked())
+        return BatchResult(received=len(batch))
+
+    async def one_shot_collect(c, *args, **kwargs):
+        chunk = await c.getmany()
+        return [msg for records in chunk.values() for msg in records]
+
+    monkeypatch.setattr(consumer, "process_batch", fake_process_batch)
+    monkeypatch.setattr(consumer, "collect_batch", one_shot_collect)
+
+    with pytest.raises(_StopLoop):
+        await consumer.run_batch_loop(fake, OffsetCommitter(fake, OffsetTracker(), interval_ms=0), writing)
+
+    assert held == [True] and not writing.locked()
@@ -0,0 +1,19 @@
+from datetime import date, datetime, timezone
+
+from warehouse_service.devtools.partitions import (
+    add_months, month_start, partition_month, partition_name,
+)
+
+
+def test_add_months_crosses_year_boundary():
+    assert add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+
+
+def test_partition_name_roundtrip():
+    month = month_start(datetime(2025, 4, 24, 11, 59, tzinfo=timezone.utc))
+
+    assert partition_name(month) == "movement_events_p202504"
+    assert partition_month("movement_events_p202504") == month
+    # DEFAULT и посторонние таблицы не считаются месячными партициями
+    assert partition_month("movement_events_default") is None
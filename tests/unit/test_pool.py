@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from kafka_utils.pool import KeyedWorkerPool
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_same_key_runs_in_submit_order():
+    pool = KeyedWorkerPool(max_in_flight=10)
+    seen = []
+
+    async def job(i, delay):
+        await asyncio.sleep(delay)
+        seen.append(i)
+
+    # первая задача самая долгая — при параллельном запуске порядок бы сломался
+    for i, delay in enumerate([0.03, 0.0, 0.01]):
+        await pool.submit("key", lambda i=i, d=delay: job(i, d))
+    await pool.drain()
+
+    assert seen == [0, 1, 2]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_in_flight_never_exceeds_limit():
+    pool = KeyedWorkerPool(max_in_flight=3)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running, pool.in_flight)
+        await asyncio.sleep(0.001)
+        running -= 1
+
+    for i in range(50):
+        await pool.submit(i, job)
+        assert pool.in_flight <= 3
+    await pool.drain()
+
+    assert peak <= 3
+    assert pool.in_flight == 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_failed_job_releases_slot():
+    pool = KeyedWorkerPool(max_in_flight=1)
+
+    async def boom():
+        raise RuntimeError("boom")
+
+    await pool.submit("a", boom)
+    # без освобождения слота второй submit() завис бы навсегда
+    await asyncio.wait_for(pool.submit("a", boom), timeout=1)
+    await pool.drain()
+
+    assert pool.in_flight == 0
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from kafka_utils import producer as producer_module
+from kafka_utils.producer import KafkaProducerWrapper, KafkaSendTimeout, ack_latency, produced, serialize_value
+
+
+class _FakeAIOProducer:
+    """Ставит сообщения в очередь; доставку подтверждает тест через ack()."""
+
+    def __init__(self):
+        self.sent = []
+        self.deliveries = []
+
+    async def send(self, topic, value, key=None):
+        self.sent.append((topic, value, key))
+        delivery = asyncio.get_running_loop().create_future()
+        self.deliveries.append(delivery)
+        return delivery
+
+    def ack(self, error=None):
+        for index, delivery in enumerate(self.deliveries):
+            if not delivery.done():
+                delivery.set_exception(error) if error else delivery.set_result(index)
+
+
+def _wrapper(send_timeout=1.0):
+    wrapper = KafkaProducerWrapper("kafka:9092", send_timeout=send_timeout)
+    wrapper.producer = _FakeAIOProducer()
+    return wrapper
+
+
+def _message():
+    return {"id": uuid4(), "data": {"warehouse_id": uuid4(), "product_id": uuid4(),
+                                    "timestamp": datetime(2026, 1, 1, tzinfo=timezone.utc)}}
+
+
+def _count(topic, result):
+    return produced.labels(topic, result)._value.get()
+
+
+def test_serialize_value_handles_uuid_and_datetime():
+    message = _message()
+
+    decoded = json.loads(serialize_value(message))
+
+    assert decoded["id"] == str(message["id"])
+    assert decoded["data"]["timestamp"].startswith("2026-01-01")
+
+
+@pytest.mark.asyncio
+async def test_send_many_waits_for_all_acks_and_records_metrics():
+    wrapper = _wrapper()
+    messages = [_message() for _ in range(3)]
+    ok_before = _count("t-many", "ok")
+
+    sending = asyncio.create_task(wrapper.send_many("t-many", messages))
+    await asyncio.sleep(0)
+    assert not sending.done()            # поставлены в очередь, подтверждений ещё нет
+    wrapper.producer.ack()
+
+    assert await sending == [0, 1, 2]
+    assert [key for _, _, key in wrapper.producer.sent] == [
+        f"{m['data']['warehouse_id']}:{m['data']['product_id']}".encode() for m in messages
+    ]
+    assert _count("t-many", "ok") - ok_before == 3
+    assert ack_latency.labels("t-many")._sum.get() > 0
+
+
+@pytest.mark.asyncio
+async def test_send_times_out_without_ack_and_counts_errors():
+    wrapper = _wrapper(send_timeout=0.01)
+    timeouts_before = _count("t-timeout", "timeout")
+
+    with pytest.raises(KafkaSendTimeout, match="timed out"):
+        await wrapper.send("t-timeout", _message())
+    assert _count("t-timeout", "timeout") - timeouts_before == 1
+
+    error_before = _count("t-error", "error")
+    delivery = await wrapper.send_nowait("t-error", _message())
+    wrapper.producer.ack(error=RuntimeError("broker down"))
+    with pytest.raises(RuntimeError):
+        await delivery
+    await asyncio.sleep(0)               # done-callback выполняется следующим шагом цикла
+    assert _count("t-error", "error") - error_before == 1
+
+
+
+@pytest.mark.asyncio
+async def test_send_many_timeout_keeps_deliveries_pending():
+    wrapper = _wrapper(send_timeout=0.01)
+    ok_before, error_before = _count("t-late", "ok"), _count("t-late", "error")
+    timeouts_before = _count("t-late", "timeout")
+
+    with pytest.raises(KafkaSendTimeout):
+        await wrapper.send_many("t-late", [_message(), _message()])
+
+    # таймаут не отменил доставку: подтверждение, пришедшее позже, считается ok
+    assert not any(delivery.cancelled() for delivery in wrapper.producer.deliveries)
+    wrapper.producer.ack()
+    await asyncio.sleep(0)
+    assert _count("t-late", "ok") - ok_before == 2
+    assert _count("t-late", "error") == error_before
+    assert _count("t-late", "timeout") - timeouts_before == 2
+
+def test_idempotent_producer_requires_acks_all(monkeypatch):
+    captured = {}
+    monkeypatch.setattr(producer_module, "AIOKafkaProducer", lambda **kwargs: captured.update(kwargs))
+
+    KafkaProducerWrapper("kafka:9092", compression_type="lz4", linger_ms=20)._create_producer()
+
+    assert captured["enable_idempotence"] is True and captured["acks"] == "all"
+    assert (captured["compression_type"], captured["linger_ms"]) == ("lz4", 20)
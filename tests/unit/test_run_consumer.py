@@ -0,0 +1,64 @@
+import signal
+
+from kafka_utils import run_consumer
+
+
+class _FakeProcess:
+    started = []
+
+    def __init__(self, target=None, name=None):
+        self.name = name
+        self.pid = 1000 + len(_FakeProcess.started)
+        self.alive = False
+        self.terminated = False
+        self.joined = []
+
+    def start(self):
+        _FakeProcess.started.append(self)
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    @property
+    def exitcode(self):
+        return None if self.alive else 1
+
+    def terminate(self):
+        self.terminated = True
+        self.alive = False
+
+    def join(self, timeout=None):
+        self.joined.append(timeout)
+
+    def kill(self):
+        self.alive = False
+
+
+class _FakeContext:
+    Process = _FakeProcess
+
+
+def test_sigterm_during_restart_delay_does_not_start_a_new_process(monkeypatch):
+    _FakeProcess.started = []
+    handlers = {}
+    monkeypatch.setattr(run_consumer.multiprocessing, "get_context", lambda method: _FakeContext)
+    monkeypatch.setattr(run_consumer.signal, "signal", lambda sig, handler: handlers.setdefault(sig, handler))
+    monkeypatch.setattr(run_consumer, "prepare_multiprocess_dir", lambda: "/tmp/unused")
+    monkeypatch.setattr(run_consumer, "mark_process_dead", lambda pid: None)
+
+    def sleep(seconds):
+        if seconds == run_consumer.RESTART_DELAY:
+            handlers[signal.SIGTERM](signal.SIGTERM, None)
+        elif seconds == 1:
+            # первый процесс падает, супервизор уходит в паузу перед перезапуском
+            _FakeProcess.started[0].alive = False
+
+    monkeypatch.setattr(run_consumer.time, "sleep", sleep)
+
+    run_consumer.supervise(2, metrics_port=0)
+
+    assert len(_FakeProcess.started) == 2
+    assert all(process.joined and not process.is_alive() for process in _FakeProcess.started)
+    # второй процесс остановлен сигналом один раз, упавший не перезапущен
+    assert _FakeProcess.started[1].terminated and not _FakeProcess.started[0].terminated
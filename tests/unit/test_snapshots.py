@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+import pytest
+from fastapi_cache import FastAPICache
+from starlette.requests import Request
+
+from warehouse_service.cache import as_of_version_key
+from warehouse_service.main import request_key_builder, stock_key_builder
+from warehouse_service.services.snapshots import calculate_stock_as_of, mark_stale_snapshots_stmt, take_snapshots
+
+AS_OF = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _db(snapshot, events_sum):
+    db = AsyncMock()
+    db.execute.return_value = MagicMock(first=MagicMock(return_value=snapshot))
+    db.scalar.return_value = events_sum
+    return db
+
+
+@pytest.mark.asyncio
+async def test_as_of_adds_events_after_snapshot():
+    snapshot = SimpleNamespace(taken_at=datetime(2026, 5, 1, tzinfo=timezone.utc), quantity=100)
+    db = _db(snapshot, -30)
+
+    assert await calculate_stock_as_of(db, uuid4(), uuid4(), AS_OF) == 70
+    assert "movement_events.timestamp >" in str(db.scalar.await_args.args[0])
+
+
+@pytest.mark.asyncio
+async def test_as_of_without_snapshot_sums_whole_history():
+    db = _db(None, None)
+    db.scalar.side_effect = [40, 15]  # сумма отсоединённых партиций, затем оставшиеся события
+
+    assert await calculate_stock_as_of(db, uuid4(), uuid4(), AS_OF) == 55
+    assert "stock_baselines" in str(db.scalar.await_args_list[0].args[0])
+    assert "movement_events.timestamp >" not in str(db.scalar.await_args.args[0])
+
+
+@pytest.mark.asyncio
+async def test_as_of_never_negative():
+    snapshot = SimpleNamespace(taken_at=datetime(2026, 5, 1, tzinfo=timezone.utc), quantity=5)
+    db = _db(snapshot, -10)
+
+    assert await calculate_stock_as_of(db, uuid4(), uuid4(), AS_OF.replace(tzinfo=None)) == 0
+
+
+def _request(path, query=""):
+    return Request({"type": "http", "method": "GET", "path": path,
+                    "query_string": query.encode(), "headers": []})
+
+
+def test_key_builder_separates_as_of_queries():
+    path = f"/warehouses/{uuid4()}/products/{uuid4()}"
+
+    current = request_key_builder(request=_request(path))
+    historical = request_key_builder(request=_request(path, "as_of=2026-05-01T12:00:00Z"))
+
+    assert current == path.replace("/", ":")
+    assert historical == f"{current}?as_of=2026-05-01T12:00:00Z"
+
+
+@pytest.mark.asyncio
+async def test_as_of_skips_stale_snapshots():
+    db = _db(None, 0)
+
+    await calculate_stock_as_of(db, uuid4(), uuid4(), AS_OF)
+
+    assert "stock_snapshots.stale IS false" in str(db.execute.await_args.args[0])
+
+
+def test_late_event_marks_snapshots_stale_instead_of_deleting():
+    stmt = str(mark_stale_snapshots_stmt([(uuid4(), uuid4(), AS_OF)]))
+
+    assert stmt.startswith("UPDATE stock_snapshots SET stale=")
+    assert "stock_snapshots.taken_at >= late_events.since" in stmt
+
+
+@pytest.mark.asyncio
+async def test_take_snapshots_skips_run_while_another_holds_the_lock():
+    db = AsyncMock()
+    db.scalar.return_value = False
+
+    assert await take_snapshots(db, AS_OF) == 0
+    assert "pg_try_advisory_xact_lock" in str(db.scalar.await_args.args[0])
+    db.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_as_of_key_is_versioned_and_skips_open_window(monkeypatch):
+    backend = MagicMock()
+    backend.redis.get = AsyncMock(return_value=b"3")
+    monkeypatch.setattr(FastAPICache, "_backend", backend)
+    wh, product = uuid4(), uuid4()
+    path = f"/warehouses/{wh}/products/{product}"
+
+    recent = datetime.now(timezone.utc)
+    assert await stock_key_builder(request=_request(path, f"as_of={recent.isoformat()}"),
+                                   kwargs={"warehouse_id": wh, "product_id": product, "as_of": recent}) is None
+
+    key = await stock_key_builder(request=_request(path, "as_of=2026-05-01T12:00:00Z"),
+                                  kwargs={"warehouse_id": wh, "product_id": product, "as_of": AS_OF})
+    assert key.endswith("?as_of=2026-05-01T12:00:00Z#v3")
+    backend.redis.get.assert_awaited_once_with(as_of_version_key(wh, product))
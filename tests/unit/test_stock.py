@@ -1,9 +1,16 @@
-from unittest.mock import AsyncMock
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
 from uuid import uuid4
 
 import pytest
 
-from warehouse_service.services.stock import calculate_stock
+from sqlalchemy.dialects import postgresql
+
+from warehouse_service.cache import encode_response, stock_cache_key
+from warehouse_service.schemas import StockResponse
+from warehouse_service.services.stock import (
+    calculate_stock, calculate_stocks, lookup_stocks, stock_delta, upsert_balance_stmt,
+)
 
 
 @pytest.mark.asyncio
@@ -33,3 +40,70 @@ async def test_none_quantity_no_log(caplog):
         qty = await calculate_stock(db, uuid4(), uuid4())
 
     assert qty == 0
+
+
+def test_stock_delta_sign():
+    assert stock_delta("arrival", 7) == 7
+    assert stock_delta("departure", 7) == -7
+
+
+def test_balance_upsert_increments_existing_row():
+    stmt = upsert_balance_stmt(uuid4(), uuid4(), stock_delta("departure", 3))
+    compiled = stmt.compile(dialect=postgresql.dialect())
+
+    assert compiled.params["quantity_m0"] == -3
+    assert "ON CONFLICT (warehouse_id, product_id) DO UPDATE" in str(compiled)
+    assert "stock_balances.quantity + excluded.quantity" in str(compiled)
+
+
+def _rows(*rows):
+    return [SimpleNamespace(warehouse_id=wh, product_id=product, quantity=qty) for wh, product, qty in rows]
+
+
+@pytest.mark.asyncio
+async def test_calculate_stocks_one_query_missing_pairs_are_zero():
+    wh, known, unknown, negative = uuid4(), uuid4(), uuid4(), uuid4()
+    db = AsyncMock()
+    db.execute.return_value = _rows((wh, known, 7), (wh, negative, -2))
+
+    quantities = await calculate_stocks(db, [(wh, known), (wh, unknown), (wh, known), (wh, negative)])
+
+    assert quantities == {(wh, known): 7, (wh, unknown): 0, (wh, negative): 0}
+    assert db.execute.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_lookup_stocks_reads_misses_from_db_and_backfills():
+    wh, hit, miss = uuid4(), uuid4(), uuid4()
+    cached = StockResponse(warehouse_id=wh, product_id=hit, quantity=3)
+
+    pipe = MagicMock(execute=AsyncMock())
+    backend = MagicMock()
+    backend.redis.mget = AsyncMock(return_value=[encode_response(cached), None])
+    backend.redis.pipeline.return_value.__aenter__.return_value = pipe
+
+    db = AsyncMock()
+    db.execute.return_value = _rows((wh, miss, 11))
+
+    result = await lookup_stocks(db, backend, [(wh, hit), (wh, miss), (wh, hit)], expire=60)
+
+    assert [r.quantity for r in result] == [3, 11, 3]
+    backend.redis.mget.assert_awaited_once_with([stock_cache_key(wh, hit), stock_cache_key(wh, miss)])
+    assert db.execute.await_count == 1
+    pipe.set.assert_called_once_with(
+        stock_cache_key(wh, miss),
+        encode_response(StockResponse(warehouse_id=wh, product_id=miss, quantity=11)),
+        ex=60,
+    )
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_lookup_stocks_without_cache_hits_db_once():
+    wh, product = uuid4(), uuid4()
+    db = AsyncMock()
+    db.execute.return_value = _rows((wh, product, 5))
+
+    result = await lookup_stocks(db, None, [(wh, product)], expire=60)
+
+    assert result == [StockResponse(warehouse_id=wh, product_id=product, quantity=5)]
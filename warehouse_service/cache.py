@@ -0,0 +1,178 @@
+"""
+Ключи кеша ответов API и пакетные операции с ним.
+
+Ключи совпадают с тем, что строит request_key_builder для GET-эндпоинтов, а значения —
+с тем, что пишет декоратор cached (CODER), поэтому пакетные эндпоинты, consumer
+и одиночные запросы работают с одними и теми же записями в Redis.
+"""
+import base64
+import hashlib
+import json
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from fastapi_cache.coder import JsonCoder
+from pydantic import BaseModel
+
+from warehouse_service.cache_coders import BinaryCoder
+from warehouse_service.cache_storage import BucketStorage, FlatStorage, StorageBackend
+from warehouse_service.config import CACHE_CODER, CACHE_HASH_BUCKETS, CACHE_HASH_KEYS
+from warehouse_service.config import CACHE_AS_OF_LAG, CACHE_STALE_TTL, CACHE_TTL_JITTER, TTL
+from warehouse_service.schemas import StockResponse
+
+CODER = BinaryCoder if CACHE_CODER == "binary" else JsonCoder
+STORAGE = BucketStorage(CACHE_HASH_BUCKETS) if CACHE_HASH_BUCKETS > 0 else FlatStorage()
+
+# канал, в который пишущие в Redis публикуют изменённые ключи: по нему процессы API
+# сбрасывают их из локального кеша (см. cache_tiers)
+INVALIDATION_CHANNEL = "cache-invalidation"
+
+
+def make_backend(redis_client) -> StorageBackend:
+    return StorageBackend(redis_client, STORAGE)
+
+
+def cache_key(path_key: str) -> str:
+    """
+    Ключ Redis для ключа вида :movements:<uuid>.
+
+    С CACHE_HASH_KEYS=1 — «k:» + 96 бит blake2b в base64 (18 байт вместо 50–100);
+    коллизия на таком числе ключей практически невозможна.
+    """
+    if not CACHE_HASH_KEYS:
+        return path_key
+    digest = hashlib.blake2b(path_key.encode(), digest_size=12).digest()
+    return "k:" + base64.b64encode(digest).decode()
+
+
+def movement_cache_key(movement_id) -> str:
+    return cache_key(f":movements:{movement_id}")
+
+
+def stock_cache_key(warehouse_id, product_id) -> str:
+    return cache_key(f":warehouses:{warehouse_id}:products:{product_id}")
+
+
+def as_of_version_key(warehouse_id, product_id) -> str:
+    return f"as-of-version:{warehouse_id}:{product_id}"
+
+
+# версия живёт дольше любой as_of-записи: иначе после её истечения старые записи стали бы снова видны
+AS_OF_VERSION_TTL = round(TTL * (1 + CACHE_TTL_JITTER)) + CACHE_STALE_TTL + 1
+
+
+def as_of_horizon() -> datetime:
+    """Граница окна опозданий: события не позже неё могут изменить уже кешированный as_of-ответ."""
+    return datetime.now(timezone.utc) - timedelta(seconds=CACHE_AS_OF_LAG)
+
+
+def cache_expire(ttl: int = TTL) -> int:
+    """
+    Время жизни записи в Redis: ttl со случайным разбросом плюс окно CACHE_STALE_TTL,
+    в котором запись считается протухшей, но ещё отдаётся (см. cache_layer).
+    """
+    fresh = ttl * random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)
+    return max(1, round(fresh)) + CACHE_STALE_TTL
+
+
+def encode_response(response: BaseModel) -> bytes:
+    """Значение в том же формате, в каком его пишут и читают кешируемые эндпоинты."""
+    return CODER.encode(response)
+
+
+def decode_stock(value: bytes) -> StockResponse:
+    return StockResponse.model_validate(CODER.decode(value))
+
+
+async def get_many(backend, keys: list[str]) -> list[Optional[bytes]]:
+    """Значения ключей одним MGET; при недоступном Redis — как будто всё промахнулось."""
+    if backend is None or not keys:
+        return [None] * len(keys)
+    try:
+        return await STORAGE.get_many(backend.redis, keys)
+    except Exception as e:
+        logging.warning(f"Error while reading cache: {e}")
+        return [None] * len(keys)
+
+
+async def set_many(backend, items: dict[str, bytes], expire: int, delete: Iterable[str] = (),
+                   notify: bool = True) -> None:
+    """
+    Записывает ключи с TTL (и удаляет ключи из delete) одним pipeline-запросом.
+
+    notify=False — для прогрева кеша значениями из БД, которые не меняют данные:
+    локальные кеши других процессов сбрасывать незачем.
+    """
+    delete = list(delete)
+    if backend is None or not (items or delete):
+        return
+    try:
+        async with backend.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                STORAGE.set(pipe, key, value, expire)
+            for key in delete:
+                STORAGE.delete(pipe, key)
+            if notify:
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps([*items, *delete]))
+            await pipe.execute()
+    except Exception as e:
+        logging.warning(f"Error while filling cache: {e}")
+
+
+async def invalidate_cache(backend, keys: Iterable[str]) -> None:
+    """Удаляет ключи кэша одним pipeline-запросом в Redis."""
+    keys = list(keys)
+    if backend is None or not keys:
+        return
+    try:
+        async with backend.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                STORAGE.delete(pipe, key)
+            pipe.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+            await pipe.execute()
+    except Exception as e:
+        logging.warning(f"Error while clearing cache: {e}")
+
+
+async def as_of_version(backend, warehouse_id, product_id) -> Optional[int]:
+    """Версия as_of-записей пары (часть их ключа); None — Redis недоступен."""
+    try:
+        value = await backend.redis.get(as_of_version_key(warehouse_id, product_id))
+    except Exception as e:
+        logging.warning(f"Error while reading as_of version: {e}")
+        return None
+    return int(value or 0)
+
+
+async def bump_as_of_versions(backend, pairs: Iterable[tuple]) -> None:
+    """
+    Делает недостижимыми кешированные as_of-ответы пар одним pipeline-запросом.
+
+    Ключи as_of-ответов нельзя перечислить (as_of произвольный, ключи могут хешироваться),
+    поэтому в ключ входит версия пары, а её увеличение сбрасывает их все; старые записи доживают TTL.
+    """
+    pairs = sorted(set(pairs), key=str)
+    if backend is None or not pairs:
+        return
+    try:
+        async with backend.redis.pipeline(transaction=False) as pipe:
+            for warehouse_id, product_id in pairs:
+                key = as_of_version_key(warehouse_id, product_id)
+                pipe.incr(key)
+                pipe.expire(key, AS_OF_VERSION_TTL)
+            await pipe.execute()
+    except Exception as e:
+        logging.warning(f"Error while bumping as_of versions: {e}")
+
+
+async def publish_invalidation(backend, keys: Iterable[str]) -> None:
+    """Сообщает процессам API, что ключи изменились в обход pipeline-операций выше."""
+    keys = list(keys)
+    if backend is None or not keys:
+        return
+    try:
+        await backend.redis.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+    except Exception as e:
+        logging.warning(f"Error while publishing cache invalidation: {e}")
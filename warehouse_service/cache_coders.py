@@ -0,0 +1,104 @@
+"""
+Компактный бинарный формат записей кеша.
+
+Остаток и перемещение кодируются тегом и полями фиксированного порядка: UUID — 16 байт,
+целые — zigzag-varint, время — микросекунды от эпохи UTC. Всё остальное (например, тело
+404-ответа) хранится как JSON, как у JsonCoder; JSON-записи BinaryCoder тоже читает,
+поэтому переход с JsonCoder на BinaryCoder не требует очистки кеша (обратный — требует).
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from fastapi_cache.coder import Coder, JsonCoder
+
+from warehouse_service.schemas import MovementResponse, StockResponse
+
+STOCK_TAG = 0x01
+MOVEMENT_TAG = 0x02
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _put_varint(out: bytearray, value: int) -> None:
+    value = (value << 1) ^ (value >> 63)   # zigzag: маленькие по модулю отрицательные — короткие
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), pos
+        shift += 7
+
+
+def _micros(moment: datetime) -> int:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def _get_uuid(data: bytes, pos: int) -> tuple[UUID, int]:
+    return UUID(bytes=data[pos:pos + 16]), pos + 16
+
+
+class BinaryCoder(Coder):
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        if isinstance(value, StockResponse):
+            out = bytearray((STOCK_TAG,))
+            out += value.warehouse_id.bytes
+            out += value.product_id.bytes
+            _put_varint(out, value.quantity)
+            return bytes(out)
+        if isinstance(value, MovementResponse):
+            out = bytearray((MOVEMENT_TAG,))
+            out += value.movement_id.bytes
+            out += value.sender_warehouse.bytes
+            out += value.receiver_warehouse.bytes
+            # quantity_difference и transit_seconds выводятся из остальных полей
+            for number in (_micros(value.departure_time), _micros(value.arrival_time),
+                           value.quantity_departed, value.quantity_arrived):
+                _put_varint(out, number)
+            return bytes(out)
+        return JsonCoder.encode(value)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        tag = value[0] if value else None
+        if tag == STOCK_TAG:
+            warehouse_id, pos = _get_uuid(value, 1)
+            product_id, pos = _get_uuid(value, pos)
+            quantity, _ = _get_varint(value, pos)
+            return {"warehouse_id": warehouse_id, "product_id": product_id, "quantity": quantity}
+        if tag == MOVEMENT_TAG:
+            movement_id, pos = _get_uuid(value, 1)
+            sender, pos = _get_uuid(value, pos)
+            receiver, pos = _get_uuid(value, pos)
+            numbers = []
+            for _ in range(4):
+                number, pos = _get_varint(value, pos)
+                numbers.append(number)
+            departed_us, arrived_us, departed, arrived = numbers
+            departure_time = _EPOCH + departed_us * _MICROSECOND
+            arrival_time = _EPOCH + arrived_us * _MICROSECOND
+            return {
+                "movement_id": movement_id,
+                "sender_warehouse": sender,
+                "receiver_warehouse": receiver,
+                "departure_time": departure_time,
+                "arrival_time": arrival_time,
+                "quantity_departed": departed,
+                "quantity_arrived": arrived,
+                "quantity_difference": arrived - departed,
+                "transit_seconds": int((arrival_time - departure_time).total_seconds()),
+            }
+        return JsonCoder.decode(value)
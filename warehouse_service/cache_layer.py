@@ -0,0 +1,247 @@
+"""
+Кеш ответов GET-эндпоинтов с защитой от одновременных промахов.
+
+Работает поверх fastapi-cache (тот же backend, key_builder и coder, заголовок
+X-FastAPI-Cache), поэтому записи, которые пишет consumer и пакетные эндпоинты, читаются как обычно.
+
+- Запись живёт TTL (с разбросом) + CACHE_STALE_TTL секунд. В последние CACHE_STALE_TTL секунд
+  она протухшая: её отдают сразу (STALE), а пересчитывает один запрос — тот, кто взял блокировку.
+- Промахи по одному ключу внутри процесса объединяются: БД идёт один запрос, остальные ждут его.
+- Между процессами — Redis-блокировка `lock:<ключ>` с коротким lease: не взявшие её ждут,
+  пока значение появится в Redis, а по истечении lease считают сами.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from functools import wraps
+from inspect import Parameter, isawaitable, signature
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from fastapi_cache import FastAPICache
+from prometheus_client import Counter
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.status import HTTP_304_NOT_MODIFIED
+
+from warehouse_service.cache import cache_expire
+from warehouse_service.config import CACHE_LOCK_LEASE_MS, CACHE_STALE_TTL, TTL
+
+logger = logging.getLogger(__name__)
+
+coalesced_waits = Counter(
+    "warehouse_cache_coalesced_waits_total",
+    "Промахи кеша, дождавшиеся чужого пересчёта вместо запроса в БД",
+    ["scope"],  # process — внутри процесса, redis — другой процесс под блокировкой
+)
+stale_served = Counter(
+    "warehouse_cache_stale_served_total",
+    "Ответы протухшими значениями, пока ключ пересчитывает другой запрос",
+)
+
+# удаляем блокировку, только если она всё ещё наша (lease мог истечь и её взял другой)
+_RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+class CacheEntry(NamedTuple):
+    status: str  # HIT | STALE | MISS
+    value: Any
+    encoded: bytes
+    max_age: int  # сколько секунд значение ещё свежее
+
+
+class StampedeGuard:
+    """Single-flight, Redis-блокировка и stale-while-revalidate для одного процесса."""
+
+    def __init__(self, stale_ttl: int = CACHE_STALE_TTL, lock_lease_ms: int = CACHE_LOCK_LEASE_MS,
+                 poll_interval: float = 0.02):
+        self.stale_ttl = stale_ttl
+        self.lock_lease_ms = lock_lease_ms
+        self.poll_interval = poll_interval
+        self._flights: dict[str, asyncio.Future] = {}
+
+    async def fetch(self, backend, key: str, compute: Callable[[], Awaitable[Any]], coder,
+                    ttl: int) -> tuple[str, Any]:
+        """Возвращает (HIT | STALE | MISS, значение); при MISS значение — результат compute()."""
+        entry = await self.lookup(backend, key, compute, coder, ttl)
+        return entry.status, entry.value
+
+    async def lookup(self, backend, key: str, compute: Callable[[], Awaitable[Any]], coder,
+                     ttl: int) -> CacheEntry:
+        """Как fetch, но вместе с закодированным значением и остатком свежести — для ETag и Cache-Control."""
+        try:
+            remaining, cached = await backend.get_with_ttl(key)
+        except Exception:
+            logger.warning(f"Error retrieving cache key '{key}' from backend:", exc_info=True)
+            remaining, cached = -2, None
+
+        if cached is not None and (remaining < 0 or remaining > self.stale_ttl):
+            max_age = remaining - self.stale_ttl if remaining > 0 else ttl
+            return CacheEntry("HIT", coder.decode(cached), cached, max_age)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            if cached is not None:
+                stale_served.inc()
+                return CacheEntry("STALE", coder.decode(cached), cached, 0)
+            encoded = await self._wait_flight(flight)
+            if encoded is not None:
+                coalesced_waits.labels("process").inc()
+                return CacheEntry("HIT", coder.decode(encoded), encoded, ttl)
+
+        return await self._lead(backend, key, compute, coder, ttl, stale=cached)
+
+    async def refresh(self, backend, key: str, compute: Callable[[], Awaitable[Any]], coder,
+                      ttl: int) -> CacheEntry:
+        """Пересчитывает значение мимо кеша и перезаписывает запись (Cache-Control: no-cache)."""
+        result = await compute()
+        encoded = coder.encode(result)
+        try:
+            await backend.set(key, encoded, cache_expire(ttl))
+        except Exception:
+            logger.warning(f"Error setting cache key '{key}' in backend:", exc_info=True)
+        return CacheEntry("MISS", result, encoded, ttl)
+
+    async def _lead(self, backend, key, compute, coder, ttl, stale: Optional[bytes]) -> CacheEntry:
+        # регистрируем полёт до первого await: остальные запросы процесса его увидят
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            token = await self._acquire(backend, key)
+            if token is None:
+                if stale is not None:
+                    flight.set_result(stale)
+                    stale_served.inc()
+                    return CacheEntry("STALE", coder.decode(stale), stale, 0)
+                encoded = await self._wait_redis(backend, key)
+                if encoded is not None:
+                    flight.set_result(encoded)
+                    coalesced_waits.labels("redis").inc()
+                    return CacheEntry("HIT", coder.decode(encoded), encoded, ttl)
+
+            try:
+                result = await compute()
+                encoded = coder.encode(result)
+                try:
+                    await backend.set(key, encoded, cache_expire(ttl))
+                except Exception:
+                    logger.warning(f"Error setting cache key '{key}' in backend:", exc_info=True)
+            finally:
+                if token:
+                    await self._release(backend, key, token)
+
+            flight.set_result(encoded)
+            return CacheEntry("MISS", result, encoded, ttl)
+        finally:
+            if not flight.done():
+                # ждущие в этом процессе посчитают сами
+                flight.cancel()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    @staticmethod
+    async def _wait_flight(flight: asyncio.Future) -> Optional[bytes]:
+        try:
+            return await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.cancelled():
+                raise
+            return None
+
+    async def _acquire(self, backend, key: str) -> Optional[str]:
+        """Токен блокировки, None — если её держит другой процесс, "" — если Redis недоступен."""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await backend.redis.set(f"lock:{key}", token, nx=True, px=self.lock_lease_ms)
+        except Exception:
+            logger.warning(f"Error locking cache key '{key}':", exc_info=True)
+            return ""
+        return token if acquired else None
+
+    async def _release(self, backend, key: str, token: str) -> None:
+        try:
+            await backend.redis.eval(_RELEASE_LOCK, 1, f"lock:{key}", token)
+        except Exception:
+            logger.warning(f"Error unlocking cache key '{key}':", exc_info=True)
+
+    async def _wait_redis(self, backend, key: str) -> Optional[bytes]:
+        deadline = time.monotonic() + self.lock_lease_ms / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                encoded = await backend.get(key)
+            except Exception:
+                return None
+            if encoded is not None:
+                return encoded
+        return None
+
+
+guard = StampedeGuard()
+
+
+def _uncacheable(request: Request) -> bool:
+    if not FastAPICache.get_enable():
+        return True
+    return request.method != "GET" or request.headers.get("Cache-Control") == "no-store"
+
+
+def etag(encoded: bytes) -> str:
+    # hash() из fastapi-cache зависит от PYTHONHASHSEED и различается между воркерами
+    return f'W/"{hashlib.md5(encoded).hexdigest()}"'
+
+
+def cached(expire: int = TTL, key_builder=None):
+    """
+    Замена @cache из fastapi-cache для GET-эндпоинтов, см. описание модуля.
+
+    key_builder (по умолчанию — из FastAPICache) может быть async и вернуть None: такой ответ не кешируется.
+
+    Как и @cache, ставит ETag и Cache-Control: max-age, а на совпавший If-None-Match отвечает 304;
+    Cache-Control: no-store в запросе обходит кеш, no-cache — пересчитывает и обновляет запись.
+    """
+
+    def wrapper(func):
+        sig = signature(func)
+        own = set(sig.parameters)
+        injected = [
+            Parameter(name, Parameter.KEYWORD_ONLY, annotation=annotation)
+            for name, annotation in (("request", Request), ("response", Response))
+            if name not in own
+        ]
+
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            request = kwargs["request"] if "request" in own else kwargs.pop("request")
+            response = kwargs["response"] if "response" in own else kwargs.pop("response")
+
+            if _uncacheable(request):
+                return await func(*args, **kwargs)
+
+            key = (key_builder or FastAPICache.get_key_builder())(
+                func, "", request=request, response=response, args=args, kwargs=kwargs,
+            )
+            if isawaitable(key):
+                key = await key
+            if key is None:
+                return await func(*args, **kwargs)
+            # no-cache, как в @cache: значение пересчитывается и перезаписывает запись
+            fetch = guard.refresh if request.headers.get("Cache-Control") == "no-cache" else guard.lookup
+            entry = await fetch(
+                FastAPICache.get_backend(), key, lambda: func(*args, **kwargs),
+                FastAPICache.get_coder(), expire,
+            )
+            tag = etag(entry.encoded)
+            response.headers.update({
+                "Cache-Control": f"max-age={entry.max_age}",
+                "ETag": tag,
+                FastAPICache.get_cache_status_header(): entry.status,
+            })
+            if request.headers.get("if-none-match") == tag:
+                return Response(status_code=HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+            return entry.value
+
+        inner.__signature__ = sig.replace(parameters=[*sig.parameters.values(), *injected])
+        return inner
+
+    return wrapper
@@ -0,0 +1,106 @@
+"""
+Раскладка записей кеша по ключам Redis.
+
+FlatStorage — запись на ключ со своим TTL, как у fastapi-cache.
+
+BucketStorage — записи упакованы в CACHE_HASH_BUCKETS хешей по полю на запись. Небольшие
+хеши Redis хранит в listpack без накладных расходов отдельного ключа (~50–70 байт), что
+заметно на миллионах пар склад/товар. TTL у поля нет, поэтому срок жизни записи хранится
+в первых 4 байтах значения, а хешу ставится EXPIRE последней записи. Цена: просроченные
+поля горячего бакета удаляются только перезаписью или истечением всего бакета, а вытеснение
+по maxmemory работает бакетами. Число бакетов стоит выбирать так, чтобы в бакете было
+не больше hash-max-listpack-entries (128) полей.
+"""
+import struct
+import time
+import zlib
+from typing import Optional, Tuple
+
+from fastapi_cache.backends.redis import RedisBackend
+
+_DEADLINE = struct.Struct(">I")
+
+
+class FlatStorage:
+    async def get_with_ttl(self, redis, key: str) -> Tuple[int, Optional[bytes]]:
+        async with redis.pipeline(transaction=True) as pipe:
+            return tuple(await pipe.ttl(key).get(key).execute())
+
+    async def get(self, redis, key: str) -> Optional[bytes]:
+        return await redis.get(key)
+
+    async def get_many(self, redis, keys: list[str]) -> list[Optional[bytes]]:
+        return await redis.mget(keys)
+
+    def set(self, pipe, key: str, value: bytes, expire: Optional[int]) -> None:
+        pipe.set(key, value, ex=expire)
+
+    def delete(self, pipe, key: str) -> None:
+        pipe.delete(key)
+
+
+class BucketStorage:
+    def __init__(self, buckets: int):
+        self.buckets = buckets
+
+    def bucket(self, key: str) -> str:
+        return f"b:{zlib.crc32(key.encode()) % self.buckets}"
+
+    @staticmethod
+    def _unpack(raw: Optional[bytes]) -> Tuple[int, Optional[bytes]]:
+        if raw is None:
+            return -2, None
+        (deadline,) = _DEADLINE.unpack_from(raw)
+        remaining = deadline - int(time.time())
+        if remaining <= 0:
+            return -2, None
+        return remaining, raw[_DEADLINE.size:]
+
+    async def get_with_ttl(self, redis, key: str) -> Tuple[int, Optional[bytes]]:
+        return self._unpack(await redis.hget(self.bucket(key), key))
+
+    async def get(self, redis, key: str) -> Optional[bytes]:
+        return (await self.get_with_ttl(redis, key))[1]
+
+    async def get_many(self, redis, keys: list[str]) -> list[Optional[bytes]]:
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hget(self.bucket(key), key)
+            raws = await pipe.execute()
+        return [self._unpack(raw)[1] for raw in raws]
+
+    def set(self, pipe, key: str, value: bytes, expire: Optional[int]) -> None:
+        # без срока — на сутки: поле без дедлайна в бакете не выразить
+        expire = expire or 86400
+        bucket = self.bucket(key)
+        pipe.hset(bucket, key, _DEADLINE.pack(int(time.time()) + expire) + value)
+        pipe.expire(bucket, expire)
+
+    def delete(self, pipe, key: str) -> None:
+        pipe.hdel(self.bucket(key), key)
+
+
+class StorageBackend(RedisBackend):
+    """RedisBackend для FastAPICache и consumer'а, раскладывающий записи через storage."""
+
+    def __init__(self, redis, storage):
+        super().__init__(redis)
+        self.storage = storage
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        return await self.storage.get_with_ttl(self.redis, key)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.storage.get(self.redis, key)
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self.storage.set(pipe, key, value, expire)
+            await pipe.execute()
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        if key:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                self.storage.delete(pipe, key)
+                return (await pipe.execute())[0]
+        return await super().clear(namespace, key)
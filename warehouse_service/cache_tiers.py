@@ -0,0 +1,173 @@
+"""
+Локальный (L1) кеш процесса перед RedisBackend.
+
+Горячие ключи отдаются из памяти без round-trip в Redis. Согласованность держится
+подпиской на INVALIDATION_CHANNEL: consumer и пакетные операции публикуют в него изменённые
+ключи, и каждый процесс API сбрасывает их у себя. Пока подписки нет (старт, обрыв
+соединения), L1 не используется и очищается — пропущенные сообщения не восстановить.
+
+Запись живёт в L1 не дольше CACHE_L1_TTL и не доходит до окна протухания в Redis:
+протухшие значения обслуживает cache_layer, и их пересчёт должен идти через Redis.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi_cache.types import Backend
+from prometheus_client import Counter
+
+from warehouse_service.cache import INVALIDATION_CHANNEL
+from warehouse_service.config import CACHE_STALE_TTL
+
+logger = logging.getLogger(__name__)
+
+lookups = Counter(
+    "warehouse_cache_tier_lookups_total",
+    "Обращения к уровням кеша: hit ratio уровня = hit / (hit + miss)",
+    ["tier", "result"],  # tier: l1 | redis
+)
+
+# накладные расходы на запись сверх длины ключа и значения (кортеж, узел OrderedDict)
+_ENTRY_OVERHEAD = 128
+
+
+class LocalCache:
+    """LRU с TTL, ограниченный суммарным размером ключей и значений в байтах."""
+
+    def __init__(self, max_bytes: int, max_ttl: float):
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.size = 0
+        # ключ -> (до какого момента отдавать из L1, когда запись истечёт в Redis, значение)
+        self._entries: OrderedDict[str, tuple[float, float, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _cost(key: str, value: bytes) -> int:
+        return len(key) + len(value) + _ENTRY_OVERHEAD
+
+    def get(self, key: str) -> Optional[tuple[float, bytes]]:
+        """(сколько секунд запись ещё живёт в Redis, значение) или None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        local_deadline, redis_deadline, value = entry
+        now = time.monotonic()
+        if now >= local_deadline:
+            self.discard([key])
+            return None
+        self._entries.move_to_end(key)
+        return redis_deadline - now, value
+
+    def set(self, key: str, value: bytes, redis_ttl: float, stale_ttl: float) -> None:
+        now = time.monotonic()
+        redis_deadline = now + redis_ttl if redis_ttl >= 0 else math.inf
+        local_deadline = min(now + self.max_ttl, redis_deadline - stale_ttl)
+        cost = self._cost(key, value)
+        if local_deadline <= now or cost > self.max_bytes:
+            self.discard([key])
+            return
+
+        self.discard([key])
+        self._entries[key] = (local_deadline, redis_deadline, value)
+        self.size += cost
+        while self.size > self.max_bytes:
+            old_key, (_, _, old_value) = self._entries.popitem(last=False)
+            self.size -= self._cost(old_key, old_value)
+
+    def discard(self, keys) -> None:
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= self._cost(key, entry[2])
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+class TieredBackend(Backend):
+    """Backend для FastAPICache: L1 в памяти процесса, за ним RedisBackend."""
+
+    def __init__(self, backend, local: LocalCache, stale_ttl: int = CACHE_STALE_TTL):
+        self.backend = backend
+        self.local = local
+        self.stale_ttl = stale_ttl
+        self.subscribed = False
+        # растёт с каждой инвалидацией: значение, прочитанное из Redis до неё, в L1 не кладём
+        self._generation = 0
+
+    @property
+    def redis(self):
+        return self.backend.redis
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        if self.subscribed:
+            entry = self.local.get(key)
+            if entry is not None:
+                lookups.labels("l1", "hit").inc()
+                remaining, value = entry
+                return (-1 if math.isinf(remaining) else int(remaining)), value
+            lookups.labels("l1", "miss").inc()
+
+        generation = self._generation
+        ttl, value = await self.backend.get_with_ttl(key)
+        lookups.labels("redis", "miss" if value is None else "hit").inc()
+        if value is not None and self.subscribed and generation == self._generation:
+            self.local.set(key, value, ttl, self.stale_ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if self.subscribed:
+            entry = self.local.get(key)
+            if entry is not None:
+                return entry[1]
+        return await self.backend.get(key)
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        generation = self._generation
+        await self.backend.set(key, value, expire)
+        if self.subscribed and generation == self._generation:
+            self.local.set(key, value, expire if expire is not None else -1, self.stale_ttl)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        if key:
+            self.local.discard([key])
+        else:
+            self.local.clear()
+        return await self.backend.clear(namespace, key)
+
+    def _apply(self, message) -> None:
+        if message.get("type") != "message":
+            return
+        self._generation += 1
+        try:
+            self.local.discard(json.loads(message["data"]))
+        except ValueError:
+            logger.warning("Malformed cache invalidation message: %r", message["data"])
+
+    async def listen(self, retry_delay: float = 1.0) -> None:
+        """Подписка на инвалидации; запускается фоновой задачей на время жизни приложения."""
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    # всё, что лежало в L1 до подписки, могло устареть незаметно для нас
+                    self.local.clear()
+                    self.subscribed = True
+                    async for message in pubsub.listen():
+                        self._apply(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cache invalidation subscription lost: %s", e)
+            finally:
+                self.subscribed = False
+                self.local.clear()
+            await asyncio.sleep(retry_delay)
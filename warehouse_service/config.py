@@ -8,10 +8,78 @@ REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 REDIS_DB = os.getenv("REDIS_DB")
 TTL = int(os.getenv('TTL'))
+# как consumer обновляет кеш после записи: "write_through" — кладёт новые значения,
+# "invalidate" — удаляет ключи, и следующий запрос пересчитывает их из БД
+CACHE_WRITE_MODE = os.getenv('CACHE_WRITE_MODE', 'write_through')
+# сколько секунд после TTL запись ещё отдаётся, пока один запрос её пересчитывает
+CACHE_STALE_TTL = int(os.getenv('CACHE_STALE_TTL', 30))
+# случайный разброс TTL (доля), чтобы ключи, записанные вместе, не истекали вместе
+CACHE_TTL_JITTER = float(os.getenv('CACHE_TTL_JITTER', 0.1))
+# lease Redis-блокировки на пересчёт ключа; остальные процессы столько ждут результата
+CACHE_LOCK_LEASE_MS = int(os.getenv('CACHE_LOCK_LEASE_MS', 2000))
+# локальный кеш процесса API перед Redis: объём в байтах (0 — выключен) и максимальный TTL
+CACHE_L1_MAX_BYTES = int(os.getenv('CACHE_L1_MAX_BYTES', 16 * 1024 * 1024))
+CACHE_L1_TTL = float(os.getenv('CACHE_L1_TTL', 5))
+# формат записей кеша: "json" (как у fastapi-cache) или "binary" (cache_coders.BinaryCoder)
+CACHE_CODER = os.getenv('CACHE_CODER', 'json')
+# 1 — короткие ключи: хеш вместо «:warehouses:<uuid>:products:<uuid>»
+CACHE_HASH_KEYS = os.getenv('CACHE_HASH_KEYS', '0') == '1'
+# > 0 — упаковывать записи в столько Redis-хешей (см. cache_storage.BucketStorage)
+CACHE_HASH_BUCKETS = int(os.getenv('CACHE_HASH_BUCKETS', 0))
+# ?as_of= новее now - CACHE_AS_OF_LAG секунд не кешируется: события за это окно ещё доезжают;
+# событие старше окна при записи сбрасывает кешированные as_of-ответы своей пары
+CACHE_AS_OF_LAG = int(os.getenv('CACHE_AS_OF_LAG', 300))
 
 DB_URL = os.getenv('DB_URL')
+# процессы API под gunicorn и общий бюджет соединений к Postgres на все процессы
+# (0 — пул SQLAlchemy по умолчанию в каждом процессе)
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+DB_POOL_BUDGET = int(os.getenv('DB_POOL_BUDGET', 0))
+# пул соединений одного процесса API (при DB_POOL_BUDGET > 0 размер считается из бюджета)
+# и consumer'а; остальные настройки общие: ожидание свободного соединения (с), пересоздание
+# соединений старше DB_POOL_RECYCLE секунд (-1 — никогда), проверка соединения перед выдачей
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+KAFKA_DB_POOL_SIZE = int(os.getenv('KAFKA_DB_POOL_SIZE', 5))
+KAFKA_DB_MAX_OVERFLOW = int(os.getenv('KAFKA_DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', -1))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '0') == '1'
+# кеши подготовленных запросов asyncpg: серверный на соединение (0 — выключен, нужно для
+# pgbouncer в режиме transaction) и кеш диалекта SQLAlchemy
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('DB_PREPARED_STATEMENT_CACHE_SIZE', 100))
 
 KAFKA_TOPIC = os.getenv('KAFKA_TOPIC')
 KAFKA_HOST = os.getenv('KAFKA_HOST')
 KAFKA_PORT = os.getenv('KAFKA_PORT')
 KAFKA_URL = f'{KAFKA_HOST}:{KAFKA_PORT}'
+
+# producer: сколько миллисекунд копить пачку, её максимальный размер в байтах, сжатие
+# (gzip, snappy, lz4, zstd; кроме gzip нужен cramjam) и идемпотентная отправка
+KAFKA_PRODUCER_LINGER_MS = int(os.getenv('KAFKA_PRODUCER_LINGER_MS', 5))
+KAFKA_PRODUCER_BATCH_BYTES = int(os.getenv('KAFKA_PRODUCER_BATCH_BYTES', 64 * 1024))
+KAFKA_PRODUCER_COMPRESSION = os.getenv('KAFKA_PRODUCER_COMPRESSION') or None
+KAFKA_PRODUCER_IDEMPOTENT = os.getenv('KAFKA_PRODUCER_IDEMPOTENT', '1') == '1'
+
+# пакетная обработка в consumer: "batch" (getmany + один INSERT на пачку), "bulk" (то же через COPY,
+# для догона топика большими пачками, см. kafka_utils.bulk_load) или "message"
+KAFKA_CONSUMER_MODE = os.getenv('KAFKA_CONSUMER_MODE', 'batch')
+KAFKA_BATCH_SIZE = int(os.getenv('KAFKA_BATCH_SIZE', 500))
+KAFKA_BATCH_LINGER_MS = int(os.getenv('KAFKA_BATCH_LINGER_MS', 50))
+# режим "message": сколько сообщений одновременно в работе (не больше пула соединений consumer'а)
+KAFKA_MAX_IN_FLIGHT = int(os.getenv('KAFKA_MAX_IN_FLIGHT', 15))
+# 1 — быстрый разбор сообщений: orjson и проверка только сохраняемых полей (KafkaEventRecord)
+KAFKA_FAST_DECODE = os.getenv('KAFKA_FAST_DECODE', '0') == '1'
+# процессов consumer'а в одной группе (kafka_utils.run_consumer), имеет смысл не больше числа партиций
+KAFKA_CONSUMER_WORKERS = int(os.getenv('KAFKA_CONSUMER_WORKERS', 1))
+# порт /metrics consumer'а (0 — не отдавать); при нескольких процессах метрики собираются
+# через общий каталог PROMETHEUS_MULTIPROC_DIR и отдаются одним портом из главного процесса
+KAFKA_METRICS_PORT = int(os.getenv('KAFKA_METRICS_PORT', 9101))
+# повторы записи при временных ошибках (соединение, deadlock, таймаут): число попыток и пауза —
+# экспонента от KAFKA_RETRY_BASE_MS до KAFKA_RETRY_MAX_MS со случайным разбросом
+KAFKA_RETRY_ATTEMPTS = int(os.getenv('KAFKA_RETRY_ATTEMPTS', 5))
+KAFKA_RETRY_BASE_MS = int(os.getenv('KAFKA_RETRY_BASE_MS', 100))
+KAFKA_RETRY_MAX_MS = int(os.getenv('KAFKA_RETRY_MAX_MS', 10_000))
+# как часто коммитить смещения, уже записанные в БД
+KAFKA_COMMIT_INTERVAL_MS = int(os.getenv('KAFKA_COMMIT_INTERVAL_MS', 1000))
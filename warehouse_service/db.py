@@ -1,18 +1,77 @@
 from __future__ import annotations
 
 import os
+import time
 
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.ext.asyncio import (
     AsyncSession, async_sessionmaker, create_async_engine,
 )
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from warehouse_service import models
-from warehouse_service.config import DB_URL
+from warehouse_service.config import DB_MAX_OVERFLOW, DB_POOL_BUDGET, DB_POOL_SIZE, DB_URL, WEB_CONCURRENCY
+from warehouse_service.config import DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_POOL_TIMEOUT
+from warehouse_service.config import DB_PREPARED_STATEMENT_CACHE_SIZE, DB_STATEMENT_CACHE_SIZE
 from warehouse_service.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# под gunicorn Gauge суммируются по живым процессам (PROMETHEUS_MULTIPROC_DIR)
+pool_checkout_wait = Histogram(
+    "warehouse_db_pool_checkout_seconds",
+    "Ожидание соединения из пула, включая открытие нового",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+pool_timeouts = Counter(
+    "warehouse_db_pool_timeouts_total",
+    "Соединение не освободилось за DB_POOL_TIMEOUT",
+    ["pool"],
+)
+pool_in_use = Gauge(
+    "warehouse_db_pool_in_use",
+    "Соединения, выданные из пула",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+pool_overflow = Gauge(
+    "warehouse_db_pool_overflow",
+    "Открытые соединения сверх pool_size",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул с метриками; метка pool — pool_logging_name engine'а (api, consumer)."""
+
+    @property
+    def metrics_name(self) -> str:
+        return self.logging_name or "default"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_timeouts.labels(self.metrics_name).inc()
+            raise
+        finally:
+            pool_checkout_wait.labels(self.metrics_name).observe(time.perf_counter() - started)
+        self._report()
+        return connection
+
+    def _do_return_conn(self, record) -> None:
+        super()._do_return_conn(record)
+        self._report()
+
+    def _report(self) -> None:
+        pool_in_use.labels(self.metrics_name).set(self.checkedout())
+        pool_overflow.labels(self.metrics_name).set(max(self.overflow(), 0))
+
 
 def create_engine_and_session(
     db_url,
@@ -27,7 +86,59 @@ def create_engine_and_session(
     return engine, session_local
 
 
-_engine, AsyncSessionLocal = create_engine_and_session(DB_URL)
+def pool_limits(budget: int = DB_POOL_BUDGET, workers: int = WEB_CONCURRENCY) -> dict:
+    """
+    Размер пула одного процесса: общий бюджет соединений делится поровну между процессами.
+
+    {} — бюджет не задан, действуют DB_POOL_SIZE и DB_MAX_OVERFLOW.
+    """
+    if budget <= 0:
+        return {}
+    workers = max(workers, 1)
+    if budget < workers:
+        logger.warning(f"DB_POOL_BUDGET={budget} меньше числа процессов {workers}: по одному соединению на процесс")
+    # без overflow: сумма по процессам не выходит за бюджет
+    return {"pool_size": max(budget // workers, 1), "max_overflow": 0}
+
+
+def engine_options(name: str, pool_size: int, max_overflow: int, db_url: str = DB_URL) -> dict:
+    """Параметры create_async_engine: пул с метриками и настройки пула из config."""
+    options = {
+        "poolclass": InstrumentedPool,
+        "pool_logging_name": name,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if db_url and "+asyncpg" in db_url:
+        options["connect_args"] = {
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+
+def api_engine_options() -> dict:
+    return {**engine_options("api", DB_POOL_SIZE, DB_MAX_OVERFLOW), **pool_limits()}
+
+
+_engine, AsyncSessionLocal = create_engine_and_session(DB_URL, **api_engine_options())
+
+
+def init_engine() -> AsyncEngine:
+    """
+    Новый engine для процесса-воркера после fork (gunicorn post_fork).
+
+    Соединения пула родителя не закрываются — они принадлежат ему, — а просто забываются;
+    AsyncSessionLocal переключается на новый engine.
+    """
+    global _engine
+    _engine.sync_engine.dispose(close=False)
+    _engine = create_async_engine(DB_URL, future=True, **api_engine_options())
+    AsyncSessionLocal.configure(bind=_engine)
+    return _engine
 
 
 async def get_db() -> AsyncSession:
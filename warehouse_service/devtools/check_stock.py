@@ -0,0 +1,107 @@
+"""
+Сверка проекции stock_balances с суммой по movement_events и stock_baselines (отсоединённые партиции).
+
+    python -m warehouse_service.devtools.check_stock [--fix] [--limit 100]
+
+Код возврата 1, если найдены расхождения (и не указан --fix).
+--fix добавляет к расходящимся строкам разницу (события − проекция) тем же upsert'ом, что и consumer,
+поэтому его можно запускать, не останавливая запись событий.
+"""
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import func, literal, select, union_all
+
+from warehouse_service.db import AsyncSessionLocal, _engine
+from warehouse_service.logger import setup_logger
+from warehouse_service.models import MovementEvent, StockBalance, StockBaseline
+from warehouse_service.services.stock import events_sum_expr, upsert_balances_stmt
+
+logger = setup_logger("warehouse_service.devtools.check_stock")
+
+
+def mismatches_stmt():
+    # история, отсоединённая devtools/partitions detach, учитывается суммами из stock_baselines
+    history = union_all(
+        select(
+            MovementEvent.warehouse_id,
+            MovementEvent.product_id,
+            events_sum_expr().label("quantity"),
+        )
+        .group_by(MovementEvent.warehouse_id, MovementEvent.product_id),
+        select(StockBaseline.warehouse_id, StockBaseline.product_id, StockBaseline.quantity),
+    ).subquery()
+    events = (
+        select(history.c.warehouse_id, history.c.product_id, func.sum(history.c.quantity).label("quantity"))
+        .group_by(history.c.warehouse_id, history.c.product_id)
+        .subquery()
+    )
+    balances = StockBalance.__table__
+
+    expected = func.coalesce(events.c.quantity, literal(0))
+    actual = func.coalesce(balances.c.quantity, literal(0))
+
+    return (
+        select(
+            func.coalesce(events.c.warehouse_id, balances.c.warehouse_id).label("warehouse_id"),
+            func.coalesce(events.c.product_id, balances.c.product_id).label("product_id"),
+            expected.label("expected"),
+            actual.label("actual"),
+        )
+        .select_from(
+            events.outerjoin(
+                balances,
+                (events.c.warehouse_id == balances.c.warehouse_id)
+                & (events.c.product_id == balances.c.product_id),
+                full=True,
+            )
+        )
+        .where(expected != actual)
+    )
+
+
+def fix_deltas(rows) -> list[dict]:
+    """Поправки к stock_balances по строкам mismatches_stmt, в порядке блокировок consumer'а."""
+    return [
+        {"warehouse_id": r.warehouse_id, "product_id": r.product_id, "quantity": r.expected - r.actual}
+        for r in sorted(rows, key=lambda r: str((r.warehouse_id, r.product_id)))
+    ]
+
+
+async def check(fix: bool = False, limit: int = 100) -> int:
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(mismatches_stmt())).all()
+
+        for row in rows[:limit]:
+            logger.warning(
+                "Расхождение: склад %s, товар %s: события=%s, проекция=%s",
+                row.warehouse_id, row.product_id, row.expected, row.actual,
+            )
+
+        if rows and fix:
+            # разница, а не абсолютное значение: expected и actual прочитаны одним снимком,
+            # а дельты, которые consumer закоммитит после чтения, при сложении сохранятся
+            await session.execute(upsert_balances_stmt(fix_deltas(rows)))
+            await session.commit()
+            logger.info("Исправлено строк: %s", len(rows))
+
+    logger.info("Проверка завершена, расхождений: %s", len(rows))
+    return len(rows)
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="привести проекцию к сумме событий")
+    parser.add_argument("--limit", type=int, default=100, help="сколько расхождений выводить в лог")
+    args = parser.parse_args(argv)
+
+    try:
+        found = await check(fix=args.fix, limit=args.limit)
+    finally:
+        await _engine.dispose()
+    return 1 if found and not args.fix else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -6,10 +6,10 @@ from fastapi_cache import FastAPICache
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from kafka_utils.db import handle_event
-from kafka_utils.producer import KafkaProducerWrapper
+from kafka_utils.producer import KafkaProducerWrapper, KafkaSendTimeout
 from warehouse_service.config import KAFKA_TOPIC
 from warehouse_service.db import get_db
-from warehouse_service.schemas import KafkaEnvelope
+from warehouse_service.schemas import KafkaEnvelope, PublishBatchRequest
 
 logger = logging.getLogger("warehouse_service.api.debug")
 
@@ -28,11 +28,32 @@ async def publish_to_kafka(
     try:
         await producer.send(KAFKA_TOPIC, envelope.model_dump())
         return {"status": "sent to Kafka"}
+    except KafkaSendTimeout as e:
+        # итог неизвестен: сообщение могло дойти, повтор отсечёт дедупликация по id
+        logger.error(f"Kafka ack timed out: {e}")
+        raise HTTPException(status_code=504, detail="Kafka ack timed out, delivery unknown")
     except Exception as e:
         logger.error(f"Failed to send message to Kafka: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Kafka send failed")
 
 
+@router.post("/publish_kafka/bulk")
+async def publish_batch_to_kafka(
+    body: PublishBatchRequest,
+    producer: KafkaProducerWrapper = Depends(get_kafka_producer_from_state)
+):
+    # один HTTP-запрос — одна пачка producer'а; ответ после подтверждения всех сообщений
+    try:
+        await producer.send_many(KAFKA_TOPIC, [envelope.model_dump() for envelope in body.events])
+        return {"status": "sent to Kafka", "count": len(body.events)}
+    except KafkaSendTimeout as e:
+        logger.error(f"Kafka ack timed out for {len(body.events)} messages: {e}")
+        raise HTTPException(status_code=504, detail="Kafka ack timed out, delivery unknown")
+    except Exception as e:
+        logger.error(f"Failed to send {len(body.events)} messages to Kafka: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Kafka send failed")
+
+
 @router.post("/simulate_kafka")
 async def simulate_kafka_event(
     envelope: KafkaEnvelope,
@@ -0,0 +1,240 @@
+"""
+Выгрузка и загрузка истории movement_events в JSONL.
+
+    python -m warehouse_service.devtools.events_io export events.jsonl.gz [--after-id N] [--append]
+    python -m warehouse_service.devtools.events_io import events.jsonl.gz [--offset N] [--chunk-size 10000]
+
+Сжатие выбирается по расширению: .gz — gzip, .zst — zstd (нужен пакет zstandard), «-» — stdout/stdin.
+Обе команды работают потоком с постоянной памятью и раз в --progress-every секунд пишут
+в лог скорость и позицию для продолжения.
+
+export — строки по возрастанию id через серверный курсор, порциями по --chunk-size.
+Каждая строка — конверт Kafka, который примет import и consumer, плюс поле export_id.
+Метаданные конверта (source, subject, time...) не хранятся в БД и восстанавливаются
+из события. Продолжить прерванную выгрузку: --after-id <последний export_id> --append.
+Продолжение по id безопасно, только если запись событий остановлена: id выдаётся при вставке,
+а не при коммите, и строка с меньшим id, закоммиченная после прерванной выгрузки, будет пропущена.
+Под нагрузкой выгрузку надо начинать заново (import пропускает повторы по message_id, так что
+перекрытие с уже загруженным безопасно).
+
+import — потоковый разбор, проверка KafkaEnvelope и запись порциями через COPY
+(kafka_utils.bulk_load). Повторы пропускаются, поэтому повторный запуск безопасен;
+--offset <resume offset из лога> продолжает с начала непрочитанной порции несжатого потока.
+"""
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import sys
+import time
+from typing import BinaryIO
+
+from sqlalchemy import select
+
+from warehouse_service.db import AsyncSessionLocal, _engine
+from warehouse_service.logger import setup_logger
+from warehouse_service.models import MovementEvent
+
+logger = setup_logger("warehouse_service.devtools.events_io")
+
+try:
+    import zstandard
+except ImportError:  # .zst — только при установленном zstandard
+    zstandard = None
+
+_SKIP_BLOCK = 1 << 20
+
+
+def _zstd():
+    if zstandard is None:
+        raise SystemExit("Для .zst нужен пакет zstandard: pip install zstandard")
+    return zstandard
+
+
+def open_output(path: str, append: bool = False) -> BinaryIO:
+    if path == "-":
+        return sys.stdout.buffer
+    mode = "ab" if append else "wb"
+    if path.endswith(".gz"):
+        # дописывание в gzip — новый member, gzip -d и gzip.open читают их подряд
+        return gzip.open(path, mode, compresslevel=6)
+    if path.endswith(".zst"):
+        # то же для zstd: несколько фреймов подряд — корректный поток
+        return _zstd().ZstdCompressor(level=3).stream_writer(open(path, mode), closefd=True)
+    return open(path, mode)
+
+
+def open_input(path: str, offset: int = 0) -> BinaryIO:
+    """Бинарный поток несжатых данных, уже стоящий на байте offset."""
+    if path == "-":
+        source = sys.stdin.buffer
+    elif path.endswith(".gz"):
+        source = gzip.open(path, "rb")
+    elif path.endswith(".zst"):
+        source = io.BufferedReader(_zstd().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    else:
+        source = open(path, "rb")
+
+    if offset and source.seekable():
+        # gzip тоже перематывает вперёд распаковкой
+        source.seek(offset)
+    else:
+        # zstd и stdin перематываются только чтением
+        remaining = offset
+        while remaining:
+            block = source.read(min(remaining, _SKIP_BLOCK))
+            if not block:
+                raise SystemExit(f"Смещение {offset} за концом потока")
+            remaining -= len(block)
+    return source
+
+
+class Progress:
+    """Пишет в лог скорость не чаще раза в interval секунд."""
+
+    def __init__(self, label: str, interval: float):
+        self.label = label
+        self.interval = interval
+        self.started = self.reported = time.monotonic()
+        self.rows = 0
+        self.bytes = 0
+
+    def update(self, rows: int, size: int, position: str, force: bool = False) -> None:
+        self.rows += rows
+        self.bytes += size
+        now = time.monotonic()
+        if not force and now - self.reported < self.interval:
+            return
+        self.reported = now
+        elapsed = max(now - self.started, 1e-9)
+        logger.info(
+            "%s: %s событий, %.0f событий/с, %.1f МБ/с, %s",
+            self.label, self.rows, self.rows / elapsed, self.bytes / elapsed / 2**20, position,
+        )
+
+
+def event_envelope(row) -> dict:
+    """Конверт Kafka для строки movement_events; метаданные восстанавливаются из события."""
+    source = f"WH-{row.warehouse_id}"
+    return {
+        "id": str(row.message_id),
+        "source": source,
+        "specversion": "1.0",
+        "type": "ru.retail.warehouses.movement",
+        "datacontenttype": "application/json",
+        "dataschema": "ru.retail.warehouses.movement.v1.0",
+        "time": int(row.timestamp.timestamp() * 1000),
+        "subject": f"{source}:{row.event.upper()}",
+        "destination": "ru.retail.warehouses",
+        "data": {
+            "movement_id": str(row.movement_id),
+            "warehouse_id": str(row.warehouse_id),
+            "timestamp": row.timestamp.isoformat(),
+            "event": row.event,
+            "product_id": str(row.product_id),
+            "quantity": row.quantity,
+        },
+        "export_id": row.id,
+    }
+
+
+def export_stmt(after_id: int):
+    # по id: индекс первичного ключа (id, timestamp) каждой партиции, слияние без сортировки
+    return (
+        select(
+            MovementEvent.id, MovementEvent.message_id, MovementEvent.movement_id, MovementEvent.warehouse_id,
+            MovementEvent.product_id, MovementEvent.timestamp, MovementEvent.event, MovementEvent.quantity,
+        )
+        .where(MovementEvent.id > after_id)
+        .order_by(MovementEvent.id)
+    )
+
+
+async def export_events(out: BinaryIO, after_id: int, chunk_size: int, progress: Progress) -> int:
+    last_id = after_id
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(export_stmt(after_id).execution_options(yield_per=chunk_size))
+        async for rows in result.partitions(chunk_size):
+            chunk = "".join(json.dumps(event_envelope(row), separators=(",", ":")) + "\n" for row in rows).encode()
+            out.write(chunk)
+            last_id = rows[-1].id
+            progress.update(len(rows), len(chunk), f"последний export_id {last_id}")
+    progress.update(0, 0, f"последний export_id {last_id}", force=True)
+    return last_id
+
+
+async def export_command(args) -> int:
+    if args.after_id:
+        logger.warning("Продолжение с export_id %s: строки с меньшим id, закоммиченные после прерванной "
+                       "выгрузки, не попадут в файл — продолжать можно только при остановленной записи событий",
+                       args.after_id)
+    out = open_output(args.path, args.append)
+    try:
+        await export_events(out, args.after_id, args.chunk_size, Progress("export", args.progress_every))
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        else:
+            out.flush()
+    return 0
+
+
+async def import_command(args) -> int:
+    from kafka_utils.bulk_load import load_stream
+
+    progress = Progress("import", args.progress_every)
+    position = {"offset": args.offset}
+
+    def on_chunk(total, offset):
+        progress.update(total.received - progress.rows, offset - position["offset"],
+                        f"новых {total.inserted}, resume offset {offset}")
+        position["offset"] = offset
+
+    source = open_input(args.path, args.offset)
+    try:
+        total = await load_stream(source, args.chunk_size, args.fast_decode, not args.no_cache,
+                                  args.offset, on_chunk)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    progress.update(0, 0, f"новых {total.inserted}, resume offset {position['offset']}", force=True)
+    logger.info(
+        "Загрузка завершена: received=%s inserted=%s duplicates=%s conflicts=%s invalid=%s",
+        total.received, total.inserted, total.duplicates, total.conflicts, total.invalid,
+    )
+    return 1 if total.invalid else 0
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="выгрузить movement_events в JSONL")
+    export_cmd.add_argument("path", help="файл (.jsonl, .jsonl.gz, .jsonl.zst) или - для stdout")
+    export_cmd.add_argument("--after-id", type=int, default=0, help="выгружать строки с id больше этого (только при остановленной записи событий)")
+    export_cmd.add_argument("--append", action="store_true", help="дописать в существующий файл")
+    export_cmd.add_argument("--chunk-size", type=int, default=5000, help="строк на одно чтение из курсора")
+
+    import_cmd = commands.add_parser("import", help="загрузить JSONL через COPY")
+    import_cmd.add_argument("path", help="файл (.jsonl, .jsonl.gz, .jsonl.zst) или - для stdin")
+    import_cmd.add_argument("--offset", type=int, default=0, help="байт несжатого потока, с которого продолжить")
+    import_cmd.add_argument("--chunk-size", type=int, default=10_000, help="событий в одной транзакции")
+    import_cmd.add_argument("--fast-decode", action="store_true", help="проверять только id и data")
+    import_cmd.add_argument("--no-cache", action="store_true", help="не обновлять кеш")
+
+    for command in (export_cmd, import_cmd):
+        command.add_argument("--progress-every", type=float, default=5.0, help="период отчёта о скорости, секунд")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            return await export_command(args)
+        return await import_command(args)
+    finally:
+        await _engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
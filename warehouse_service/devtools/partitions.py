@@ -0,0 +1,218 @@
+"""
+Обслуживание месячных партиций movement_events.
+
+    python -m warehouse_service.devtools.partitions ensure [--months-ahead 3]
+    python -m warehouse_service.devtools.partitions detach --older-than 12 [--archive-schema archive | --drop]
+
+ensure — создаёт партиции с текущего месяца на N месяцев вперёд. Если в DEFAULT-партиции
+уже лежат строки за этот месяц, они переносятся в новую партицию в той же транзакции;
+DEFAULT на это время блокируется, чтобы параллельная вставка не потерялась между копированием и удалением.
+
+detach — отсоединяет партиции старше N месяцев и переносит их в отдельную схему или удаляет.
+DETACH ... CONCURRENTLY недоступен, пока у таблицы есть DEFAULT-партиция, поэтому каждая
+партиция отсоединяется обычным DETACH в своей транзакции с коротким lock_timeout
+(--lock-timeout-ms): не дождавшись блокировки, команда не держит очередь запросов к
+movement_events, а повторяет попытку (--retries). В той же транзакции суммы событий партиции
+по парам (склад, товар) добавляются в stock_baselines: check_stock и снимки остатков прибавляют
+их к оставшейся истории. Ключи дедупликации (movement_event_keys) и проекция stock_balances не меняются.
+"""
+import argparse
+import asyncio
+import re
+import sys
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from warehouse_service.db import _engine
+from warehouse_service.logger import setup_logger
+
+logger = setup_logger("warehouse_service.devtools.partitions")
+
+PARENT = "movement_events"
+PARTITION_RE = re.compile(rf"^{PARENT}_p(\d{{4}})(\d{{2}})$")
+# SQLSTATE lock_not_available: истёк lock_timeout
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> date | None:
+    match = PARTITION_RE.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def _bound(month: date) -> str:
+    return f"{month.isoformat()} 00:00:00+00"
+
+
+async def list_partitions(conn) -> list[str]:
+    result = await conn.execute(text(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :parent
+        ORDER BY c.relname
+        """
+    ), {"parent": PARENT})
+    return list(result.scalars())
+
+
+async def create_partition(conn, month: date) -> None:
+    """Создаёт партицию месяца, забирая её строки из DEFAULT-партиции."""
+    name = partition_name(month)
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    range_filter = f"timestamp >= '{lower}' AND timestamp < '{upper}'"
+
+    # вставка в DEFAULT между INSERT ... SELECT и DELETE была бы удалена без копии:
+    # блокировка до конца транзакции (ATTACH всё равно берёт её же) закрывает это окно
+    await conn.exec_driver_sql(f"LOCK TABLE {PARENT}_default IN ACCESS EXCLUSIVE MODE")
+    # exec_driver_sql: в границах есть «:00», text() принял бы их за параметры
+    await conn.exec_driver_sql(
+        f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    # ATTACH проверяет, что в DEFAULT нет строк нового диапазона — переносим их заранее
+    await conn.exec_driver_sql(
+        f"INSERT INTO {name} SELECT * FROM {PARENT}_default WHERE {range_filter}"
+    )
+    await conn.exec_driver_sql(f"DELETE FROM {PARENT}_default WHERE {range_filter}")
+    await conn.exec_driver_sql(
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    )
+
+
+async def ensure(months_ahead: int) -> list[str]:
+    current = month_start(datetime.now(timezone.utc))
+    created = []
+
+    async with _engine.connect() as conn:
+        existing = set(await list_partitions(conn))
+
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) in existing:
+            continue
+        async with _engine.begin() as conn:
+            await create_partition(conn, month)
+        created.append(partition_name(month))
+        logger.info("Создана партиция %s", partition_name(month))
+
+    return created
+
+
+# суммы отсоединяемой партиции добавляются к уже отсоединённой истории пары
+CARRY_FORWARD_SQL = """
+    INSERT INTO stock_baselines (warehouse_id, product_id, quantity)
+    SELECT warehouse_id, product_id, SUM(CASE WHEN event = 'arrival' THEN quantity ELSE -quantity END)
+    FROM {name}
+    GROUP BY warehouse_id, product_id
+    ON CONFLICT (warehouse_id, product_id)
+    DO UPDATE SET quantity = stock_baselines.quantity + EXCLUDED.quantity
+"""
+
+
+def _lock_not_available(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE
+
+
+async def detach_partition(conn, name: str, archive_schema: str | None, drop: bool,
+                           lock_timeout_ms: int) -> None:
+    """Отсоединяет партицию, добавляет её суммы в stock_baselines и переносит или удаляет её — в одной транзакции conn."""
+    # ACCESS EXCLUSIVE на родителе: ждём его не дольше lock_timeout, чтобы не копить очередь
+    await conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{int(lock_timeout_ms)}ms'")
+    await conn.exec_driver_sql(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+    # после DETACH в партицию уже никто не пишет: суммы окончательные
+    await conn.exec_driver_sql(CARRY_FORWARD_SQL.format(name=name))
+    if drop:
+        await conn.exec_driver_sql(f"DROP TABLE {name}")
+    elif archive_schema:
+        await conn.exec_driver_sql(f'ALTER TABLE {name} SET SCHEMA "{archive_schema}"')
+
+
+async def detach(older_than: int, archive_schema: str | None, drop: bool,
+                 lock_timeout_ms: int = 2000, retries: int = 5, retry_delay: float = 1.0) -> list[str]:
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -older_than)
+    detached = []
+
+    async with _engine.connect() as conn:
+        names = [
+            name for name in await list_partitions(conn)
+            if (month := partition_month(name)) is not None and month < cutoff
+        ]
+
+    if names and archive_schema:
+        async with _engine.begin() as conn:
+            await conn.exec_driver_sql(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"')
+
+    for name in names:
+        attempt = 1
+        while True:
+            try:
+                async with _engine.begin() as conn:
+                    await detach_partition(conn, name, archive_schema, drop, lock_timeout_ms)
+                break
+            except DBAPIError as e:
+                if not _lock_not_available(e) or attempt >= retries:
+                    raise
+                logger.warning("Партиция %s: блокировка не получена за %s мс (попытка %s/%s)",
+                               name, lock_timeout_ms, attempt, retries)
+                attempt += 1
+                await asyncio.sleep(retry_delay)
+
+        if drop:
+            logger.info("Партиция %s удалена", name)
+        elif archive_schema:
+            logger.info("Партиция %s перенесена в схему %s", name, archive_schema)
+        else:
+            logger.info("Партиция %s отсоединена", name)
+        detached.append(name)
+
+    return detached
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ensure_cmd = commands.add_parser("ensure", help="создать партиции на будущие месяцы")
+    ensure_cmd.add_argument("--months-ahead", type=int, default=3)
+
+    detach_cmd = commands.add_parser("detach", help="отсоединить старые партиции")
+    detach_cmd.add_argument("--older-than", type=int, required=True, help="возраст в месяцах")
+    target = detach_cmd.add_mutually_exclusive_group()
+    target.add_argument("--archive-schema", help="перенести отсоединённые партиции в эту схему")
+    target.add_argument("--drop", action="store_true", help="удалить отсоединённые партиции")
+    detach_cmd.add_argument("--lock-timeout-ms", type=int, default=2000,
+                            help="сколько ждать блокировку movement_events на одну попытку")
+    detach_cmd.add_argument("--retries", type=int, default=5, help="попыток на партицию")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "ensure":
+            await ensure(args.months_ahead)
+        else:
+            await detach(args.older_than, args.archive_schema, args.drop, args.lock_timeout_ms, args.retries)
+    finally:
+        await _engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
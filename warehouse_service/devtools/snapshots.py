@@ -0,0 +1,55 @@
+"""
+Периодические снимки остатков для запросов `?as_of=`.
+
+    python -m warehouse_service.devtools.snapshots [--lag-minutes 5] [--every 3600]
+
+Снимок делается на момент now - lag: события обычно доезжают с задержкой,
+а каждое опоздавшее событие помечает stale снимки, которые оно делает неверными;
+следующий запуск пересчитывает такие пары.
+С --every команда не завершается и повторяет снимок с заданным периодом (в секундах).
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+
+from warehouse_service.db import AsyncSessionLocal, _engine
+from warehouse_service.logger import setup_logger
+from warehouse_service.services.snapshots import take_snapshots
+
+logger = setup_logger("warehouse_service.devtools.snapshots")
+
+
+async def run_once(lag: timedelta) -> int:
+    cutoff = datetime.now(timezone.utc) - lag
+    async with AsyncSessionLocal() as session:
+        written = await take_snapshots(session, cutoff)
+    logger.info("Снимки на %s: записано %s", cutoff.isoformat(), written)
+    return written
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lag-minutes", type=int, default=5, help="отставание снимка от текущего времени")
+    parser.add_argument("--every", type=int, default=0, help="период повтора в секундах (0 — один запуск)")
+    args = parser.parse_args(argv)
+    lag = timedelta(minutes=args.lag_minutes)
+
+    try:
+        while True:
+            try:
+                await run_once(lag)
+            except Exception as e:
+                if not args.every:
+                    raise
+                logger.error("Не удалось сделать снимки: %s", e, exc_info=True)
+            if not args.every:
+                break
+            await asyncio.sleep(args.every)
+    finally:
+        await _engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
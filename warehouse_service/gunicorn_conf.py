@@ -0,0 +1,46 @@
+"""
+Конфигурация gunicorn для запуска API в несколько процессов.
+
+    gunicorn -c python:warehouse_service.gunicorn_conf warehouse_service.main:app
+
+Приложение импортируется один раз в мастере (preload_app), воркеры получают его через fork.
+Всё, что держит соединения, создаётся уже в воркере: engine Postgres — в post_fork,
+клиенты Redis и Kafka — в lifespan. Пул каждого воркера — DB_POOL_BUDGET / WEB_CONCURRENCY.
+
+Метрики Prometheus собираются со всех воркеров через каталог PROMETHEUS_MULTIPROC_DIR:
+instrumentator на /metrics сам переходит на MultiProcessCollector, когда переменная задана.
+"""
+import os
+import shutil
+
+from warehouse_service.config import WEB_CONCURRENCY
+
+# до импорта приложения: с preload_app мастер импортирует его раньше хука on_starting,
+# а prometheus_client сразу открывает файлы метрик в этом каталоге. Файлы прошлого запуска
+# дали бы счётчики мёртвых процессов, поэтому каталог очищается.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/warehouse-prometheus")
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+# воркер, не ответивший мастеру за это время, перезапускается
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+accesslog = None
+
+
+def post_fork(server, worker):
+    from warehouse_service.db import init_engine
+
+    init_engine()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # gauge'и умершего воркера больше не учитываются
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,35 +1,73 @@
-from contextlib import asynccontextmanager
-from typing import Union
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+from typing import Optional, Union
 from uuid import UUID
 
 import redis.asyncio as redis
-from fastapi import FastAPI, Depends, Request
+from fastapi import FastAPI, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
 from prometheus_fastapi_instrumentator import Instrumentator
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from kafka_utils.producer import KafkaProducerWrapper
 from warehouse_service.config import KAFKA_URL
 from warehouse_service.config import REDIS_HOST, REDIS_PORT, REDIS_DB, TTL
-from warehouse_service.db import prepare_database, get_db
+from warehouse_service.config import CACHE_L1_MAX_BYTES, CACHE_L1_TTL
+from warehouse_service.db import AsyncSessionLocal, prepare_database, get_db
 from warehouse_service.devtools.debug_routes import router as debug_router
 from warehouse_service.logger import setup_logger
-from warehouse_service.schemas import MovementResponse, StockResponse, ErrorResponse
-from warehouse_service.services.movements import get_movement_info
-from warehouse_service.services.stock import calculate_stock
+from warehouse_service.cache import (
+    CODER, as_of_horizon, as_of_version, cache_expire, cache_key, encode_response, make_backend, set_many,
+    stock_cache_key,
+)
+from warehouse_service.cache_layer import cached
+from warehouse_service.cache_tiers import LocalCache, TieredBackend
+from warehouse_service.schemas import (
+    ErrorResponse, InTransitResponse, MovementBatchRequest, MovementResponse, StockBatchRequest, StockResponse,
+    WarehouseStockItem, WarehouseStockResponse,
+)
+from warehouse_service.services.movements import (
+    UnknownCursor, get_in_transit, get_movement_info, movements_by_ids_stmt, resolve_cursor, stream_movements,
+    unknown_cursor_response, warehouse_movements_stmt,
+)
+from warehouse_service.services.snapshots import calculate_stock_as_of
+from warehouse_service.services.stock import calculate_stock, calculate_warehouse_stock, lookup_stocks
 
 logger = setup_logger("warehouse_service.api")
 instrumentator = Instrumentator()
 
 
+def request_path_key(request: Request) -> str:
+    # например :warehouses:3fa85f64-5717-4562-b3fc-2c963f66afa1:products:3fa85f64-5717-4562-b3fc-2c963f66afa2
+    path_key = request.url.path.replace('/', ':')
+    if request.url.query:
+        # ?as_of=... — отдельная запись, не затирающая текущий остаток
+        path_key = f"{path_key}?{request.url.query}"
+    return path_key
+
+
 def request_key_builder(
     *_, request: Request = None, **__
 ) -> str:
-    # например :warehouses:3fa85f64-5717-4562-b3fc-2c963f66afa1:products:3fa85f64-5717-4562-b3fc-2c963f66afa2
-    cache_key = request.url.path.replace('/', ':')
-    return cache_key
+    return cache_key(request_path_key(request))
+
+
+async def stock_key_builder(*_, request: Request = None, kwargs: dict = None, **__) -> Optional[str]:
+    """
+    Ключ GET остатка. as_of-ответ кешируется только вне окна опозданий (CACHE_AS_OF_LAG) и под
+    версией пары: consumer увеличивает её, когда опоздавшее событие меняет прошлые остатки.
+    """
+    as_of = kwargs.get("as_of")
+    if as_of is None:
+        return request_key_builder(request=request)
+    if (as_of if as_of.tzinfo else as_of.replace(tzinfo=timezone.utc)) > as_of_horizon():
+        return None
+    version = await as_of_version(FastAPICache.get_backend(), kwargs["warehouse_id"], kwargs["product_id"])
+    if version is None:
+        return None
+    return cache_key(f"{request_path_key(request)}#v{version}")
 
 
 @asynccontextmanager
@@ -41,9 +79,15 @@ async def lifespan(app_instance: FastAPI):
         host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
         decode_responses=False
     )
+    backend = make_backend(redis_client)
+    invalidation_listener = None
+    if CACHE_L1_MAX_BYTES > 0:
+        backend = TieredBackend(backend, LocalCache(CACHE_L1_MAX_BYTES, CACHE_L1_TTL))
+        invalidation_listener = asyncio.create_task(backend.listen())
     FastAPICache.init(
-        RedisBackend(redis_client),
+        backend,
         prefix="fastapi-cache",
+        coder=CODER,
         key_builder=request_key_builder
         )
     producer = KafkaProducerWrapper(KAFKA_URL)
@@ -51,6 +95,10 @@ async def lifespan(app_instance: FastAPI):
     app_instance.state.kafka_producer = producer
 
     yield
+    if invalidation_listener is not None:
+        invalidation_listener.cancel()
+        with suppress(asyncio.CancelledError):
+            await invalidation_listener
     await FastAPICache.clear()
     await redis_client.connection_pool.disconnect()
     await producer.disconnect()
@@ -68,9 +116,17 @@ async def health_check():
 
 
 @app.get("/warehouses/{warehouse_id}/products/{product_id}", response_model=StockResponse)
-@cache(expire=TTL)
-async def get_stock(warehouse_id: UUID, product_id: UUID, db: AsyncSession = Depends(get_db)):
-    quantity = await calculate_stock(db, warehouse_id, product_id)
+@cached(expire=TTL, key_builder=stock_key_builder)
+async def get_stock(
+    warehouse_id: UUID,
+    product_id: UUID,
+    as_of: Optional[datetime] = Query(None, description="Остаток на момент времени (ISO 8601)"),
+    db: AsyncSession = Depends(get_db),
+):
+    if as_of is None:
+        quantity = await calculate_stock(db, warehouse_id, product_id)
+    else:
+        quantity = await calculate_stock_as_of(db, warehouse_id, product_id, as_of)
 
     return StockResponse(
         warehouse_id=warehouse_id,
@@ -79,10 +135,94 @@ async def get_stock(warehouse_id: UUID, product_id: UUID, db: AsyncSession = Dep
     )
 
 
+@app.post("/stock/batch", response_model=list[StockResponse])
+async def get_stock_batch(body: StockBatchRequest, db: AsyncSession = Depends(get_db)):
+    # порядок и повторы пар в ответе — как в запросе
+    pairs = [(item.warehouse_id, item.product_id) for item in body.items]
+    return await lookup_stocks(db, FastAPICache.get_backend(), pairs, cache_expire())
+
+
+@app.get("/warehouses/{warehouse_id}/stock", response_model=WarehouseStockResponse)
+async def get_warehouse_stock(warehouse_id: UUID, db: AsyncSession = Depends(get_db)):
+    # список товаров склада известен только БД, поэтому сразу один запрос в stock_balances;
+    # результат прогревает кеш одиночного эндпоинта
+    quantities = await calculate_warehouse_stock(db, warehouse_id)
+    await set_many(FastAPICache.get_backend(), {
+        stock_cache_key(warehouse_id, product_id): encode_response(
+            StockResponse(warehouse_id=warehouse_id, product_id=product_id, quantity=quantity)
+        )
+        for product_id, quantity in quantities.items()
+    }, cache_expire(), notify=False)
+
+    return WarehouseStockResponse(
+        warehouse_id=warehouse_id,
+        items=[WarehouseStockItem(product_id=product_id, quantity=quantity)
+               for product_id, quantity in quantities.items()],
+    )
+
+
+# объявлен раньше /movements/{movement_id}, иначе путь разбирался бы как movement_id
+@app.get("/movements/in-transit", response_model=InTransitResponse, responses={400: {"model": ErrorResponse}})
+async def get_movements_in_transit(
+    older_than_hours: Optional[float] = Query(None, gt=0, description="Только отправленные раньше, чем N часов назад"),
+    after: Optional[UUID] = Query(None, description="next_after предыдущей страницы"),
+    limit: int = Query(100, ge=1, le=5000),
+    db: AsyncSession = Depends(get_db),
+):
+    return await get_in_transit(db, None, older_than_hours, after, limit)
+
+
+@app.get("/warehouses/{warehouse_id}/in-transit", response_model=InTransitResponse, responses={400: {"model": ErrorResponse}})
+async def get_warehouse_in_transit(
+    warehouse_id: UUID,
+    older_than_hours: Optional[float] = Query(None, gt=0, description="Только отправленные раньше, чем N часов назад"),
+    after: Optional[UUID] = Query(None, description="next_after предыдущей страницы"),
+    limit: int = Query(100, ge=1, le=5000),
+    db: AsyncSession = Depends(get_db),
+):
+    # склад-получатель становится известен только с arrival, поэтому фильтр — по отправителю
+    return await get_in_transit(db, warehouse_id, older_than_hours, after, limit)
+
+
 @app.get(
     "/movements/{movement_id}",
     response_model=Union[MovementResponse, ErrorResponse],
 )
-@cache(expire=TTL)
+@cached(expire=TTL)
 async def get_movement(movement_id: UUID, db: AsyncSession = Depends(get_db)):
     return await get_movement_info(db, movement_id)
+
+
+@app.post(
+    "/movements/batch",
+    response_class=StreamingResponse,
+    responses={200: {"model": list[MovementResponse]}},
+)
+async def get_movements_batch(body: MovementBatchRequest):
+    # незавершённые и неизвестные перемещения в ответ не попадают, порядок не гарантируется
+    return StreamingResponse(
+        stream_movements(AsyncSessionLocal, movements_by_ids_stmt(list(dict.fromkeys(body.movement_ids)))),
+        media_type="application/json",
+    )
+
+
+@app.get(
+    "/warehouses/{warehouse_id}/movements",
+    response_class=StreamingResponse,
+    responses={200: {"model": list[MovementResponse]}, 400: {"model": ErrorResponse}},
+)
+async def get_warehouse_movements(
+    warehouse_id: UUID,
+    after: Optional[UUID] = Query(None, description="movement_id последнего перемещения предыдущей страницы"),
+    limit: int = Query(100, ge=1, le=5000),
+    db: AsyncSession = Depends(get_db),
+):
+    # курсор проверяется до начала потока: после первого куска статус ответа уже не поменять
+    try:
+        cursor = await resolve_cursor(db, after)
+    except UnknownCursor as error:
+        return unknown_cursor_response(error)
+    return StreamingResponse(
+        stream_movements(AsyncSessionLocal, warehouse_movements_stmt(warehouse_id, cursor, limit)),
+        media_type="application/json",
+    )
@@ -1,7 +1,9 @@
 from datetime import datetime
+from typing import Optional
 from uuid import UUID
 
-from sqlalchemy import DateTime
+from sqlalchemy import DDL, BigInteger, Boolean, Computed, DateTime, Index, PrimaryKeyConstraint, false, func, text
+from sqlalchemy import event as sa_event
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID as SQLUUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
@@ -12,19 +14,158 @@ class Base(DeclarativeBase):
 
 
 class MovementEvent(Base):
+    """
+    История событий, партиционирована по месяцам `timestamp`.
+
+    Уникальные ограничения на партиционированной таблице обязаны включать ключ
+    партиционирования, поэтому дедупликация вынесена в MovementEventKey.
+    """
     __tablename__ = "movement_events"
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    message_id: Mapped[UUID] = mapped_column(SQLUUID, unique=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    message_id: Mapped[UUID] = mapped_column(SQLUUID)
     movement_id: Mapped[UUID]
     warehouse_id: Mapped[UUID]
     product_id: Mapped[UUID]
-    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
     event: Mapped[str]
     quantity: Mapped[int]
 
     __table_args__ = (
+        # покрывающий индекс: сумма по (склад, товар) без чтения heap
+        Index("ix_movement_events_warehouse_product", "warehouse_id", "product_id",
+              postgresql_include=["event", "quantity"]),
+        Index("ix_movement_events_movement", "movement_id", "event"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+class MovementEventKey(Base):
+    """
+    Глобальные ключи дедупликации событий, пишутся в одной транзакции с MovementEvent.
+
+    Имена ограничений совпадают с прежними именами на movement_events, поэтому
+    разбор IntegrityError в consumer'е не зависит от схемы хранения.
+    """
+    __tablename__ = "movement_event_keys"
+
+    message_id: Mapped[UUID] = mapped_column(SQLUUID)
+    movement_id: Mapped[UUID]
+    event: Mapped[str]
+
+    __table_args__ = (
+        PrimaryKeyConstraint("message_id", name="movement_events_message_id_key"),
         # «один тип события (`arrival`/`departure`) на одно движение»
         UniqueConstraint("movement_id", "event",
                          name="uix_movement_id_event_type"),
     )
+
+
+class DeadLetter(Base):
+    """
+    Сообщения, которые consumer не смог записать: невалидные или с постоянной ошибкой.
+
+    Одна строка на смещение — повторная доставка того же сообщения не дублирует запись.
+    Переотправляются в топик командой python -m kafka_utils.dead_letters replay.
+    """
+    __tablename__ = "dead_letters"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    topic: Mapped[str]
+    partition: Mapped[int]
+    offset: Mapped[int] = mapped_column(BigInteger)
+    key: Mapped[Optional[str]]
+    # сообщение как пришло: JSON или, если не разобралось, исходный текст
+    payload: Mapped[str]
+    error_class: Mapped[str]
+    error: Mapped[str]
+    attempts: Mapped[int]
+    failed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    replayed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
+    __table_args__ = (
+        UniqueConstraint("topic", "partition", "offset", name="uix_dead_letters_offset"),
+        Index("ix_dead_letters_error_class", "error_class", "failed_at"),
+    )
+
+
+# create_all (dev / тесты) создаёт пустую партиционированную таблицу — без партиции
+# в неё нельзя ничего записать. Месячные партиции создаёт devtools/partitions.
+sa_event.listen(
+    MovementEvent.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS movement_events_default PARTITION OF movement_events DEFAULT"),
+)
+
+
+class Movement(Base):
+    """
+    Перемещение одной строкой: половины departure/arrival пишутся upsert'ом по мере прихода
+    событий, поэтому ответ GET /movements/{id} — чтение по первичному ключу.
+    """
+    __tablename__ = "movements"
+
+    movement_id: Mapped[UUID] = mapped_column(primary_key=True)
+    product_id: Mapped[UUID]
+    sender_warehouse: Mapped[Optional[UUID]]
+    receiver_warehouse: Mapped[Optional[UUID]]
+    departure_time: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    arrival_time: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    quantity_departed: Mapped[Optional[int]]
+    quantity_arrived: Mapped[Optional[int]]
+    # arrival может прийти раньше departure
+    status: Mapped[str] = mapped_column(Computed(
+        "CASE WHEN departure_time IS NULL THEN 'awaiting_departure' "
+        "WHEN arrival_time IS NULL THEN 'in_transit' ELSE 'completed' END",
+        persisted=True,
+    ))
+
+    __table_args__ = (
+        # страницы перемещений склада по (departure_time, movement_id)
+        Index("ix_movements_sender", "sender_warehouse", "departure_time", "movement_id"),
+        Index("ix_movements_receiver", "receiver_warehouse", "departure_time", "movement_id"),
+        # частичные индексы по отправленным, но не полученным: их мало относительно всей истории
+        Index("ix_movements_in_transit", "departure_time", "movement_id",
+              postgresql_where=text("status = 'in_transit'"),
+              postgresql_include=["quantity_departed"]),
+        Index("ix_movements_in_transit_sender", "sender_warehouse", "departure_time", "movement_id",
+              postgresql_where=text("status = 'in_transit'"),
+              postgresql_include=["quantity_departed"]),
+    )
+
+
+class StockBalance(Base):
+    """Проекция текущего остатка, обновляется вместе со вставкой события."""
+    __tablename__ = "stock_balances"
+
+    warehouse_id: Mapped[UUID] = mapped_column(primary_key=True)
+    product_id: Mapped[UUID] = mapped_column(primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class StockBaseline(Base):
+    """Сумма событий отсоединённых партиций movement_events по паре, пишется devtools/partitions detach."""
+    __tablename__ = "stock_baselines"
+
+    warehouse_id: Mapped[UUID] = mapped_column(primary_key=True)
+    product_id: Mapped[UUID] = mapped_column(primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class StockSnapshot(Base):
+    """Остаток на момент taken_at, пишется периодической задачей devtools/snapshots."""
+    __tablename__ = "stock_snapshots"
+
+    warehouse_id: Mapped[UUID] = mapped_column(primary_key=True)
+    product_id: Mapped[UUID] = mapped_column(primary_key=True)
+    taken_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger)
+    # опоздавшее событие делает снимок неверным: он не читается и пересчитывается следующим запуском
+    stale: Mapped[bool] = mapped_column(Boolean, server_default=false())
+
+    __table_args__ = (
+        # граница прошлого запуска и проверка снимков одного запуска
+        Index("ix_stock_snapshots_taken_at", "taken_at"),
+        # пары, которые нужно пересчитать; таких строк мало
+        Index("ix_stock_snapshots_stale", "warehouse_id", "product_id", postgresql_where=text("stale")),
+    )
@@ -1,8 +1,8 @@
 from datetime import datetime
-from typing import Literal
+from typing import Literal, Optional
 from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class KafkaEventData(BaseModel):
@@ -27,12 +27,41 @@ class KafkaEnvelope(BaseModel):
     data: KafkaEventData
 
 
+class PublishBatchRequest(BaseModel):
+    events: list[KafkaEnvelope] = Field(min_length=1, max_length=10_000)
+
+
+class KafkaEventRecord(BaseModel):
+    """Только то, что пишется в БД: остальные поля конверта пропускаются без проверки."""
+    id: UUID
+    data: KafkaEventData
+
+
 class StockResponse(BaseModel):
     warehouse_id: UUID
     product_id: UUID
     quantity: int
 
 
+class StockKey(BaseModel):
+    warehouse_id: UUID
+    product_id: UUID
+
+
+class StockBatchRequest(BaseModel):
+    items: list[StockKey] = Field(min_length=1, max_length=1000)
+
+
+class WarehouseStockItem(BaseModel):
+    product_id: UUID
+    quantity: int
+
+
+class WarehouseStockResponse(BaseModel):
+    warehouse_id: UUID
+    items: list[WarehouseStockItem]
+
+
 class MovementResponse(BaseModel):
     movement_id: UUID
     sender_warehouse: UUID
@@ -45,5 +74,26 @@ class MovementResponse(BaseModel):
     transit_seconds: int
 
 
+class InTransitMovement(BaseModel):
+    movement_id: UUID
+    sender_warehouse: UUID
+    product_id: UUID
+    departure_time: datetime
+    quantity_departed: int
+    in_transit_seconds: int
+
+
+class InTransitResponse(BaseModel):
+    # итоги — по всем перемещениям под фильтром, items — одна страница
+    movements: int
+    quantity: int
+    items: list[InTransitMovement]
+    next_after: Optional[UUID] = None
+
+
+class MovementBatchRequest(BaseModel):
+    movement_ids: list[UUID] = Field(min_length=1, max_length=1000)
+
+
 class ErrorResponse(BaseModel):
     detail: str
@@ -1,44 +1,260 @@
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import AsyncIterator, Optional
 from uuid import UUID
 
 from fastapi.responses import JSONResponse
-from sqlalchemy import select
+from sqlalchemy import bindparam, func, literal_column, select, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from warehouse_service.models import MovementEvent
-from warehouse_service.schemas import MovementResponse
+from warehouse_service.models import Movement
+from warehouse_service.schemas import InTransitMovement, InTransitResponse, MovementResponse
 
+MOVEMENT_COLUMNS = (
+    "sender_warehouse", "departure_time", "quantity_departed",
+    "receiver_warehouse", "arrival_time", "quantity_arrived",
+)
 
-async def get_movement_events(db, movement_id):
-    stmt = select(MovementEvent).where(MovementEvent.movement_id == movement_id)
-    result = await db.scalars(stmt)
-    events = list(result)
-    departure = next((e for e in events if e.event == "departure"), None)
-    arrival = next((e for e in events if e.event == "arrival"), None)
 
-    return departure, arrival
+def movement_half(values: dict) -> dict:
+    """Строка для movements из одного события: заполнена половина departure или arrival."""
+    row = dict.fromkeys(MOVEMENT_COLUMNS)
+    row["movement_id"] = values["movement_id"]
+    row["product_id"] = values["product_id"]
+    if values["event"] == "departure":
+        row.update(sender_warehouse=values["warehouse_id"], departure_time=values["timestamp"],
+                   quantity_departed=values["quantity"])
+    else:
+        row.update(receiver_warehouse=values["warehouse_id"], arrival_time=values["timestamp"],
+                   quantity_arrived=values["quantity"])
+    return row
+
+
+def movement_rows(events: list[dict]) -> list[dict]:
+    """Половины событий пачки, сведённые по movement_id и отсортированные по нему."""
+    merged = {}
+    for values in events:
+        half = movement_half(values)
+        row = merged.setdefault(half["movement_id"], half)
+        if row is not half:
+            row.update({column: value for column, value in half.items() if value is not None})
+    # одинаковый порядок блокировок у параллельных транзакций, как у остатков
+    return [merged[movement_id] for movement_id in sorted(merged, key=str)]
+
+
+def upsert_movements_stmt(rows: list[dict]):
+    """INSERT ... ON CONFLICT DO UPDATE: дописывает пришедшую половину, не затирая вторую.
+
+    rows — словари из movement_half / movement_rows, movement_id не должны повторяться.
+    """
+    stmt = insert(Movement).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[Movement.movement_id],
+        set_={
+            column: func.coalesce(getattr(stmt.excluded, column), getattr(Movement, column))
+            for column in MOVEMENT_COLUMNS
+        },
+    )
 
 
 async def get_movement_info(db: AsyncSession, movement_id: UUID) -> MovementResponse | JSONResponse:
-    departure, arrival = await get_movement_events(db, movement_id)
+    # одна строка по первичному ключу вместо чтения и сведения событий
+    row = (await db.execute(_movement_by_id_stmt(), {"movement_id": movement_id})).first()
 
-    if not departure or not arrival:
+    if row is None:
         return JSONResponse(
             status_code=404, content={
                 'detail': 'Movement incomplete or not found'
             }
         )
 
-    quantity_diff = arrival.quantity - departure.quantity
-    transit = int((arrival.timestamp - departure.timestamp).total_seconds())
+    return movement_from_row(row)
+
+
+# сколько строк читать из курсора и отдавать клиенту за один кусок ответа
+STREAM_CHUNK_SIZE = 500
+
+
+def movements_stmt():
+    """Завершённые перемещения из таблицы movements."""
+    return (
+        select(
+            Movement.movement_id,
+            Movement.sender_warehouse,
+            Movement.receiver_warehouse,
+            Movement.departure_time,
+            Movement.arrival_time,
+            Movement.quantity_departed,
+            Movement.quantity_arrived,
+        )
+        .where(Movement.status == "completed")
+    )
+
+
+@cache
+def _movement_by_id_stmt():
+    # запрос строится один раз: на горячем пути построение select дороже самого ответа
+    return movements_stmt().where(Movement.movement_id == bindparam("movement_id"))
+
+
+def movements_by_ids_stmt(movement_ids: list[UUID]):
+    return movements_stmt().where(Movement.movement_id.in_(movement_ids))
+
+
+class UnknownCursor(Exception):
+    """after ссылается на неизвестное или ещё не отправленное перемещение."""
+
+    def __init__(self, after: UUID):
+        super().__init__(f"Unknown pagination cursor: {after}")
+        self.after = after
+
+
+async def resolve_cursor(db: AsyncSession, after: Optional[UUID]) -> Optional[tuple[datetime, UUID]]:
+    """
+    Курсор keyset-пагинации (departure_time, movement_id) по movement_id из after.
+
+    None — если after не задан. Неизвестный или ещё не отправленный movement_id даёт UnknownCursor:
+    иначе условие сравнивалось бы с NULL и клиент получил бы пустую страницу вместо ошибки.
+    """
+    if after is None:
+        return None
+    departure_time = await db.scalar(select(Movement.departure_time).where(Movement.movement_id == after))
+    if departure_time is None:
+        raise UnknownCursor(after)
+    return departure_time, after
+
+
+def unknown_cursor_response(error: UnknownCursor) -> JSONResponse:
+    return JSONResponse(status_code=400, content={'detail': str(error)})
+
 
+def _page_after(stmt, cursor: Optional[tuple[datetime, UUID]]):
+    if cursor is not None:
+        stmt = stmt.where(tuple_(Movement.departure_time, Movement.movement_id) > tuple_(*cursor))
+    return stmt.order_by(Movement.departure_time, Movement.movement_id)
+
+
+def warehouse_movements_stmt(warehouse_id: UUID, cursor: Optional[tuple[datetime, UUID]], limit: int):
+    """
+    Страница перемещений, где склад — отправитель или получатель.
+
+    Keyset-пагинация по (departure_time, movement_id): cursor — эта пара для последнего
+    перемещения предыдущей страницы (см. resolve_cursor), OFFSET не нужен.
+    С OR по двум столбцам Postgres не может идти по индексу в порядке страницы и сортирует
+    всю историю склада, поэтому страница — UNION ALL двух веток по ix_movements_sender
+    и ix_movements_receiver, каждая со своим LIMIT, и общий ORDER BY ... LIMIT поверх.
+    """
+    sender = _page_after(movements_stmt().where(Movement.sender_warehouse == warehouse_id), cursor)
+    receiver = _page_after(movements_stmt().where(
+        Movement.receiver_warehouse == warehouse_id,
+        # перемещение внутри склада уже попало в ветку отправителя
+        Movement.sender_warehouse != warehouse_id,
+    ), cursor)
+    page = union_all(sender.limit(limit), receiver.limit(limit)).subquery()
+    return select(page).order_by(page.c.departure_time, page.c.movement_id).limit(limit)
+
+
+# литерал, а не параметр: иначе планировщик не сопоставит условие с частичными индексами ix_movements_in_transit*
+_IN_TRANSIT = Movement.status == literal_column("'in_transit'")
+
+
+def _in_transit_filter(warehouse_id: Optional[UUID], departed_before: Optional[datetime]) -> list:
+    conditions = [_IN_TRANSIT]
+    if warehouse_id is not None:
+        conditions.append(Movement.sender_warehouse == warehouse_id)
+    if departed_before is not None:
+        conditions.append(Movement.departure_time < departed_before)
+    return conditions
+
+
+def in_transit_stmt(warehouse_id: Optional[UUID], departed_before: Optional[datetime],
+                    cursor: Optional[tuple[datetime, UUID]], limit: int):
+    """
+    Страница отправленных, но не полученных перемещений, самые давние первыми.
+
+    Keyset-пагинация по (departure_time, movement_id), как в warehouse_movements_stmt;
+    departed_before оставляет только зависшие — отправленные раньше этого момента.
+    """
+    stmt = (
+        select(
+            Movement.movement_id,
+            Movement.sender_warehouse,
+            Movement.product_id,
+            Movement.departure_time,
+            Movement.quantity_departed,
+        )
+        .where(*_in_transit_filter(warehouse_id, departed_before))
+    )
+    return _page_after(stmt, cursor).limit(limit)
+
+
+def in_transit_totals_stmt(warehouse_id: Optional[UUID], departed_before: Optional[datetime]):
+    """Число перемещений и единиц товара в пути — index-only scan по частичному индексу."""
+    return select(
+        func.count().label("movements"),
+        func.coalesce(func.sum(Movement.quantity_departed), 0).label("quantity"),
+    ).where(*_in_transit_filter(warehouse_id, departed_before))
+
+
+async def get_in_transit(db: AsyncSession, warehouse_id: Optional[UUID], older_than_hours: Optional[float],
+                         after: Optional[UUID], limit: int,
+                         now: Optional[datetime] = None) -> InTransitResponse | JSONResponse:
+    now = now or datetime.now(timezone.utc)
+    departed_before = None if older_than_hours is None else now - timedelta(hours=older_than_hours)
+    try:
+        cursor = await resolve_cursor(db, after)
+    except UnknownCursor as error:
+        return unknown_cursor_response(error)
+
+    totals = (await db.execute(in_transit_totals_stmt(warehouse_id, departed_before))).one()
+    rows = (await db.execute(in_transit_stmt(warehouse_id, departed_before, cursor, limit))).all()
+
+    return InTransitResponse(
+        movements=totals.movements,
+        quantity=totals.quantity,
+        items=[
+            InTransitMovement(
+                movement_id=row.movement_id,
+                sender_warehouse=row.sender_warehouse,
+                product_id=row.product_id,
+                departure_time=row.departure_time,
+                quantity_departed=row.quantity_departed,
+                in_transit_seconds=int((now - row.departure_time).total_seconds()),
+            )
+            for row in rows
+        ],
+        # неполная страница — последняя
+        next_after=rows[-1].movement_id if len(rows) == limit else None,
+    )
+
+
+def movement_from_row(row) -> MovementResponse:
     return MovementResponse(
-        movement_id=movement_id,
-        sender_warehouse=departure.warehouse_id,
-        receiver_warehouse=arrival.warehouse_id,
-        departure_time=departure.timestamp,
-        arrival_time=arrival.timestamp,
-        quantity_departed=departure.quantity,
-        quantity_arrived=arrival.quantity,
-        quantity_difference=quantity_diff,
-        transit_seconds=transit
+        movement_id=row.movement_id,
+        sender_warehouse=row.sender_warehouse,
+        receiver_warehouse=row.receiver_warehouse,
+        departure_time=row.departure_time,
+        arrival_time=row.arrival_time,
+        quantity_departed=row.quantity_departed,
+        quantity_arrived=row.quantity_arrived,
+        quantity_difference=row.quantity_arrived - row.quantity_departed,
+        transit_seconds=int((row.arrival_time - row.departure_time).total_seconds()),
     )
+
+
+async def stream_movements(session_factory, stmt, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    JSON-массив MovementResponse по кускам из серверного курсора.
+
+    Сессия открывается внутри генератора: зависимость get_db закрывается
+    раньше, чем StreamingResponse дочитает ответ.
+    """
+    yield b"["
+    separator = b""
+    async with session_factory() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions(chunk_size):
+            yield separator + b",".join(movement_from_row(row).model_dump_json().encode() for row in rows)
+            separator = b","
+    yield b"]"
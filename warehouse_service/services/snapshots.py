@@ -0,0 +1,236 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from uuid import UUID
+
+from sqlalchemy import DateTime, Uuid, column, func, select, text, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from warehouse_service.logger import setup_logger
+from warehouse_service.models import MovementEvent, StockBaseline, StockSnapshot
+from warehouse_service.services.stock import events_sum_expr
+
+logger = setup_logger("warehouse_service.services.snapshots")
+
+# Снимки для пар (склад, товар), по которым были события в окне (since, cutoff], и для пар,
+# чьи снимки опоздавшее событие пометило stale (по таким парам движения могло больше не быть):
+# последний верный снимок пары (без него — сумма отсоединённой истории из stock_baselines)
+# + сумма её событий после него. Помеченные снимки удаляются тем же
+# запросом. Пары без движения не копируются — их последний снимок остаётся актуальным.
+TAKE_SNAPSHOTS_SQL = text(
+    """
+    WITH invalidated AS (
+        DELETE FROM stock_snapshots
+        WHERE stale AND taken_at <= :cutoff
+        RETURNING warehouse_id, product_id
+    ),
+    active AS (
+        SELECT warehouse_id, product_id
+        FROM movement_events
+        WHERE timestamp > :since AND timestamp <= :cutoff
+        UNION
+        SELECT warehouse_id, product_id FROM invalidated
+    ),
+    last AS (
+        SELECT a.warehouse_id, a.product_id, s.taken_at, COALESCE(s.quantity, bl.quantity, 0) AS quantity
+        FROM active a
+        LEFT JOIN stock_baselines bl
+          ON bl.warehouse_id = a.warehouse_id AND bl.product_id = a.product_id
+        LEFT JOIN LATERAL (
+            SELECT taken_at, quantity
+            FROM stock_snapshots
+            WHERE warehouse_id = a.warehouse_id
+              AND product_id = a.product_id
+              AND taken_at <= :cutoff
+              AND NOT stale
+            ORDER BY taken_at DESC
+            LIMIT 1
+        ) s ON true
+    )
+    INSERT INTO stock_snapshots (warehouse_id, product_id, taken_at, quantity)
+    SELECT l.warehouse_id, l.product_id, CAST(:cutoff AS timestamptz),
+           l.quantity + COALESCE((
+               SELECT SUM(CASE WHEN e.event = 'arrival' THEN e.quantity ELSE -e.quantity END)
+               FROM movement_events e
+               WHERE e.warehouse_id = l.warehouse_id
+                 AND e.product_id = l.product_id
+                 AND e.timestamp <= :cutoff
+                 AND (l.taken_at IS NULL OR e.timestamp > l.taken_at)
+           ), 0)
+    FROM last l
+    ON CONFLICT DO NOTHING
+    """
+)
+
+# Повторный расчёт снимков запуска cutoff по уже закоммиченным событиям: расходящиеся
+# помечаются stale. Ловит событие, записанное параллельно с запуском, — запуск его не видел,
+# а его UPDATE не видел ещё не закоммиченные снимки.
+VERIFY_SNAPSHOTS_SQL = text(
+    """
+    UPDATE stock_snapshots s
+    SET stale = true
+    FROM (
+        SELECT n.warehouse_id, n.product_id, n.quantity,
+               COALESCE(b.quantity, bl.quantity, 0) + COALESCE((
+                   SELECT SUM(CASE WHEN e.event = 'arrival' THEN e.quantity ELSE -e.quantity END)
+                   FROM movement_events e
+                   WHERE e.warehouse_id = n.warehouse_id
+                     AND e.product_id = n.product_id
+                     AND e.timestamp <= :cutoff
+                     AND (b.taken_at IS NULL OR e.timestamp > b.taken_at)
+               ), 0) AS expected
+        FROM stock_snapshots n
+        LEFT JOIN stock_baselines bl
+          ON bl.warehouse_id = n.warehouse_id AND bl.product_id = n.product_id
+        LEFT JOIN LATERAL (
+            SELECT taken_at, quantity
+            FROM stock_snapshots
+            WHERE warehouse_id = n.warehouse_id
+              AND product_id = n.product_id
+              AND taken_at < :cutoff
+              AND NOT stale
+            ORDER BY taken_at DESC
+            LIMIT 1
+        ) b ON true
+        WHERE n.taken_at = :cutoff AND NOT n.stale
+    ) checked
+    WHERE s.warehouse_id = checked.warehouse_id
+      AND s.product_id = checked.product_id
+      AND s.taken_at = :cutoff
+      AND NOT s.stale
+      AND checked.quantity <> checked.expected
+    """
+)
+
+# запуски снимков сериализуются advisory-блокировкой, запись событий её не берёт
+SNAPSHOT_LOCK_KEY = 0x736E6170  # "snap"
+
+_CURRENT_XMAX = text("SELECT CAST(pg_snapshot_xmax(pg_current_snapshot()) AS text)")
+_XMIN_REACHED = text("SELECT pg_snapshot_xmin(pg_current_snapshot()) >= CAST(:horizon AS xid8)")
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+async def wait_for_running_transactions(db: AsyncSession, timeout: float, poll_interval: float = 0.05) -> bool:
+    """
+    Ждёт завершения транзакций, которые шли в момент вызова; False — не дождались за timeout.
+
+    Между опросами транзакция сессии закрывается, чтобы не держать горизонт сама.
+    """
+    horizon = await db.scalar(_CURRENT_XMAX)
+    deadline = time.monotonic() + timeout
+    try:
+        while not await db.scalar(_XMIN_REACHED, {"horizon": horizon}):
+            if time.monotonic() >= deadline:
+                return False
+            await db.rollback()
+            await asyncio.sleep(poll_interval)
+        return True
+    finally:
+        await db.rollback()
+
+
+async def take_snapshots(db: AsyncSession, cutoff: datetime, verify_timeout: float = 60.0) -> int:
+    """
+    Пишет снимки остатков на момент cutoff и возвращает их количество (0 — если запуск уже идёт).
+
+    Таблица не блокируется: запись событий идёт параллельно. Событие, закоммиченное до запроса
+    снимков, попадает в сумму; начатое после их коммита помечает устаревшие снимки stale
+    (см. mark_stale_snapshots_stmt). Событие, записанное во время запуска, не видит ни одна
+    сторона, поэтому после коммита запуск дожидается таких транзакций и сверяет свои снимки
+    (VERIFY_SNAPSHOTS_SQL).
+    """
+    cutoff = _aware(cutoff)
+    if not await db.scalar(select(func.pg_try_advisory_xact_lock(SNAPSHOT_LOCK_KEY))):
+        logger.info("Снимки уже делает другой запуск")
+        await db.rollback()
+        return 0
+    # граница предыдущего запуска: активность раньше неё уже учтена в снимках
+    since = await db.scalar(select(func.max(StockSnapshot.taken_at)))
+    if since is not None and since >= cutoff:
+        await db.rollback()
+        return 0
+
+    result = await db.execute(
+        TAKE_SNAPSHOTS_SQL,
+        {"since": since or datetime.min.replace(tzinfo=timezone.utc), "cutoff": cutoff},
+    )
+    await db.commit()
+
+    if not await wait_for_running_transactions(db, verify_timeout):
+        logger.warning("Транзакции, начатые до коммита снимков на %s, не завершились за %s с; "
+                       "снимки сверяются без них", cutoff.isoformat(), verify_timeout)
+    verified = await db.execute(VERIFY_SNAPSHOTS_SQL, {"cutoff": cutoff})
+    await db.commit()
+    if verified.rowcount:
+        logger.warning("Снимки на %s: %s разошлись с событиями и будут пересчитаны",
+                       cutoff.isoformat(), verified.rowcount)
+    return result.rowcount
+
+
+def mark_stale_snapshots_stmt(events: list[tuple[UUID, UUID, datetime]]):
+    """
+    UPDATE снимков, сделанных не раньше событий (warehouse_id, product_id, timestamp): stale = true.
+
+    Событие «из прошлого» делает такие снимки неверными; as_of-запрос их пропускает и берёт
+    более ранний снимок, а задача снимков пересчитывает пару, даже если движения по ней больше нет.
+    """
+    late = values(
+        column("warehouse_id", Uuid),
+        column("product_id", Uuid),
+        column("since", DateTime(timezone=True)),
+        name="late_events",
+    ).data(events)
+    return (
+        update(StockSnapshot)
+        .where(
+            StockSnapshot.warehouse_id == late.c.warehouse_id,
+            StockSnapshot.product_id == late.c.product_id,
+            StockSnapshot.taken_at >= late.c.since,
+            StockSnapshot.stale.is_(False),
+        )
+        .values(stale=True)
+    )
+
+
+async def calculate_stock_as_of(db: AsyncSession, warehouse_id: UUID, product_id: UUID,
+                                as_of: datetime) -> int:
+    """Остаток на момент as_of: ближайший предыдущий снимок + события после него."""
+    as_of = _aware(as_of)
+    snapshot = (await db.execute(
+        select(StockSnapshot.taken_at, StockSnapshot.quantity)
+        .where(
+            StockSnapshot.warehouse_id == warehouse_id,
+            StockSnapshot.product_id == product_id,
+            StockSnapshot.taken_at <= as_of,
+            StockSnapshot.stale.is_(False),
+        )
+        .order_by(StockSnapshot.taken_at.desc())
+        .limit(1)
+    )).first()
+
+    stmt = select(events_sum_expr()).where(
+        MovementEvent.warehouse_id == warehouse_id,
+        MovementEvent.product_id == product_id,
+        MovementEvent.timestamp <= as_of,
+    )
+    if snapshot is not None:
+        base = snapshot.quantity
+        # нижняя граница по timestamp отсекает лишние месячные партиции
+        stmt = stmt.where(MovementEvent.timestamp > snapshot.taken_at)
+    else:
+        # без снимка — вся история: отсоединённая её часть хранится суммой в stock_baselines
+        base = await db.scalar(select(StockBaseline.quantity).where(
+            StockBaseline.warehouse_id == warehouse_id,
+            StockBaseline.product_id == product_id,
+        )) or 0
+
+    raw_quantity = base + (await db.scalar(stmt) or 0)
+    if raw_quantity < 0:
+        logger.info(
+            f"Отрицательное значение остатков на {as_of}: склад {warehouse_id}, товар {product_id}, "
+            f"рассчитано {raw_quantity}, возвращаю 0"
+        )
+    return max(raw_quantity, 0)
@@ -1,39 +1,134 @@
 from uuid import UUID
 
-from sqlalchemy import select, func, case
+from sqlalchemy import select, func, case, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from warehouse_service.cache import decode_stock, encode_response, get_many, set_many, stock_cache_key
 from warehouse_service.logger import setup_logger
-from warehouse_service.models import MovementEvent
+from warehouse_service.models import MovementEvent, StockBalance
+from warehouse_service.schemas import StockResponse
 
 logger = setup_logger("warehouse_service.services.stock")
 
 
-async def calculate_stock(db: AsyncSession, warehouse_id: UUID, product_id: UUID) -> int:
-    stmt = select(
-        func.coalesce(
-            func.sum(
-                case(
-                    (MovementEvent.event == "arrival", MovementEvent.quantity),
-                    (MovementEvent.event == "departure", -MovementEvent.quantity),
-                    else_=0
-                )
-            ),
-            0
-        )
-    ).where(
+def stock_delta(event: str, quantity: int) -> int:
+    """Изменение остатка, которое вносит одно событие."""
+    return quantity if event == "arrival" else -quantity
+
+
+def upsert_balances_stmt(rows: list[dict]):
+    """INSERT ... ON CONFLICT DO UPDATE: увеличивает/уменьшает остатки в проекции.
+
+    rows — словари warehouse_id / product_id / quantity (дельта), пары не должны повторяться.
+    """
+    stmt = insert(StockBalance).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[StockBalance.warehouse_id, StockBalance.product_id],
+        set_={"quantity": StockBalance.quantity + stmt.excluded.quantity},
+    )
+
+
+def upsert_balance_stmt(warehouse_id: UUID, product_id: UUID, delta: int):
+    return upsert_balances_stmt([
+        {"warehouse_id": warehouse_id, "product_id": product_id, "quantity": delta}
+    ])
+
+
+def events_sum_expr():
+    """SUM(CASE ...) по истории событий — эталон для проверки проекции."""
+    return func.coalesce(
+        func.sum(
+            case(
+                (MovementEvent.event == "arrival", MovementEvent.quantity),
+                (MovementEvent.event == "departure", -MovementEvent.quantity),
+                else_=0
+            )
+        ),
+        0
+    )
+
+
+async def calculate_stock_from_events(db: AsyncSession, warehouse_id: UUID, product_id: UUID) -> int:
+    stmt = select(events_sum_expr()).where(
         MovementEvent.warehouse_id == warehouse_id,
         MovementEvent.product_id == product_id
     )
+    return await db.scalar(stmt) or 0
 
-    result = await db.scalar(stmt)
-    raw_quantity = result or 0
-    quantity = max(raw_quantity, 0)
 
+def non_negative_stock(warehouse_id: UUID, product_id: UUID, raw_quantity: int) -> int:
     if raw_quantity < 0:
         logger.info(
             f"Отрицательное значение остатков: склад {warehouse_id}, товар {product_id}, "
             f"рассчитано {raw_quantity}, возвращаю 0"
         )
+    return max(raw_quantity, 0)
+
+
+async def calculate_stock(db: AsyncSession, warehouse_id: UUID, product_id: UUID) -> int:
+    # одна строка по первичному ключу вместо суммирования всей истории
+    stmt = select(StockBalance.quantity).where(
+        StockBalance.warehouse_id == warehouse_id,
+        StockBalance.product_id == product_id
+    )
+
+    result = await db.scalar(stmt)
+    return non_negative_stock(warehouse_id, product_id, result or 0)
+
+
+async def calculate_stocks(db: AsyncSession, pairs: list[tuple[UUID, UUID]]) -> dict[tuple[UUID, UUID], int]:
+    """Остатки для набора пар (склад, товар) одним запросом; пары без движения — 0."""
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}
+
+    stmt = select(StockBalance.warehouse_id, StockBalance.product_id, StockBalance.quantity).where(
+        tuple_(StockBalance.warehouse_id, StockBalance.product_id).in_(pairs)
+    )
+    found = {(row.warehouse_id, row.product_id): row.quantity for row in await db.execute(stmt)}
+    return {
+        (warehouse_id, product_id): non_negative_stock(warehouse_id, product_id, found.get((warehouse_id, product_id), 0))
+        for warehouse_id, product_id in pairs
+    }
+
+
+async def calculate_warehouse_stock(db: AsyncSession, warehouse_id: UUID) -> dict[UUID, int]:
+    """Остатки всех товаров склада — диапазон по первому полю первичного ключа stock_balances."""
+    stmt = (
+        select(StockBalance.product_id, StockBalance.quantity)
+        .where(StockBalance.warehouse_id == warehouse_id)
+        .order_by(StockBalance.product_id)
+    )
+    return {
+        row.product_id: non_negative_stock(warehouse_id, row.product_id, row.quantity)
+        for row in await db.execute(stmt)
+    }
+
+
+async def lookup_stocks(db: AsyncSession, backend, pairs: list[tuple[UUID, UUID]],
+                        expire: int) -> list[StockResponse]:
+    """
+    Остатки для набора пар в порядке запроса: один MGET в кеш,
+    один запрос в stock_balances по промахам и одна pipeline-запись промахов обратно в кеш.
+    """
+    unique = list(dict.fromkeys(pairs))
+    cached = await get_many(backend, [stock_cache_key(*pair) for pair in unique])
+
+    found = {}
+    for pair, value in zip(unique, cached):
+        if value is not None:
+            found[pair] = decode_stock(value)
+
+    misses = [pair for pair in unique if pair not in found]
+    if misses:
+        quantities = await calculate_stocks(db, misses)
+        fresh = {
+            pair: StockResponse(warehouse_id=pair[0], product_id=pair[1], quantity=quantities[pair])
+            for pair in misses
+        }
+        await set_many(backend, {stock_cache_key(*pair): encode_response(response)
+                                 for pair, response in fresh.items()}, expire, notify=False)
+        found.update(fresh)
 
-    return quantity
+    return [found[pair] for pair in pairs]